@@ -1,8 +1,9 @@
 """
 Agente de Argumentos - Especializado en argumentos de venta por especialidad
 """
-from typing import List, Tuple
+from typing import List, Tuple, Union
 from .base_agent import BaseAgent
+from .rag_engine import AnalyzedQuery
 
 
 class AgenteArgumentos(BaseAgent):
@@ -41,9 +42,9 @@ class AgenteArgumentos(BaseAgent):
             "empresa_marca"
         ]
 
-    def enrich_context(self, query: str, results: List[Tuple[dict, float]]) -> str:
+    def enrich_context(self, query: Union[str, AnalyzedQuery], results: List[Tuple[dict, float]]) -> str:
         """Detecta la especialidad médica para adaptar argumentos SPIN y Teach"""
-        query_lower = query.lower()
+        query_lower = self.rag.analyze(query).lower
         for key, specialty_name in self.SPECIALTIES.items():
             if key in query_lower:
                 return (f"ESPECIALIDAD DETECTADA: {specialty_name}.\n"
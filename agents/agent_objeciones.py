@@ -1,8 +1,9 @@
 """
 Agente de Objeciones - Especializado en manejar objeciones del médico
 """
-from typing import List, Tuple
+from typing import List, Tuple, Union
 from .base_agent import BaseAgent
+from .rag_engine import AnalyzedQuery
 
 
 class AgenteObjeciones(BaseAgent):
@@ -37,9 +38,9 @@ class AgenteObjeciones(BaseAgent):
             "certificaciones"
         ]
 
-    def enrich_context(self, query: str, results: List[Tuple[dict, float]]) -> str:
+    def enrich_context(self, query: Union[str, AnalyzedQuery], results: List[Tuple[dict, float]]) -> str:
         """Detecta el tipo de objeción para adaptar la respuesta Feel-Felt-Found"""
-        query_lower = query.lower()
+        query_lower = self.rag.analyze(query).lower
         detected = [obj_type for obj_type, keywords in self.OBJECTION_TYPES.items()
                     if any(kw in query_lower for kw in keywords)]
         if detected:
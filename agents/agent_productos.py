@@ -1,8 +1,9 @@
 """
 Agente de Productos - Especializado en información técnica de productos
 """
-from typing import List, Tuple
+from typing import List, Tuple, Union
 from .base_agent import BaseAgent
+from .rag_engine import AnalyzedQuery
 
 
 class AgenteProductos(BaseAgent):
@@ -58,9 +59,9 @@ class AgenteProductos(BaseAgent):
             "empresa_marca"
         ]
 
-    def enrich_context(self, query: str, results: List[Tuple[dict, float]]) -> str:
+    def enrich_context(self, query: Union[str, AnalyzedQuery], results: List[Tuple[dict, float]]) -> str:
         """Enriquece el contexto con sugerencias de productos según la condición médica detectada"""
-        query_lower = query.lower()
+        query_lower = self.rag.analyze(query).lower
         suggestions = []
         for condition, products in self.CONDITION_PRODUCT_MAP.items():
             if condition in query_lower:
@@ -0,0 +1,118 @@
+"""
+Índice aproximado (IVF) sobre vectores de documentos, solo numpy.
+
+Los documentos se agrupan con k-means esférico en `n_lists` listas. En búsqueda
+se compara la query con los centroides y solo se puntúan los documentos de las
+`n_probe` listas más cercanas: n_probe es el control recall/latencia
+(n_probe = n_lists equivale a la búsqueda exacta).
+"""
+from typing import Dict, Optional, Union
+import numpy as np
+
+from .sparse_matrix import CSRMatrix
+
+# Vectores de los documentos: densos por bucket (dim × documentos) o dispersos (CSR, documentos × dim)
+Vectors = Union[np.ndarray, CSRMatrix]
+
+
+def _n_docs(vectors: Vectors) -> int:
+    return vectors.shape[0] if isinstance(vectors, CSRMatrix) else vectors.shape[1]
+
+
+def _columns(vectors: Vectors, docs) -> np.ndarray:
+    """Vectores densos (dim × len(docs)) de los documentos `docs` (índices o slice)"""
+    if isinstance(vectors, CSRMatrix):
+        rows = np.arange(vectors.shape[0])[docs] if isinstance(docs, slice) else docs
+        return vectors.dense_rows(rows).T
+    return vectors[:, docs]
+
+
+class IVFIndex:
+    """
+    Listas invertidas sobre centroides. Los vectores se pasan por bucket (dim × documentos)
+    o como CSRMatrix (documentos × dim); solo se densifican por bloques.
+    """
+
+    KMEANS_ITERATIONS = 10
+    KMEANS_SAMPLE_PER_LIST = 64     # Documentos muestreados por lista para entrenar los centroides
+    ASSIGN_CHUNK = 8192             # Documentos por bloque al asignar (acota la memoria)
+
+    def __init__(self, centroids: np.ndarray, assignments: np.ndarray):
+        self.centroids = centroids          # dim × n_lists (float32, norma L2 = 1)
+        self.assignments = assignments      # lista de cada documento
+        # Documentos ordenados por lista: los de la lista l son list_docs[list_ptr[l]:list_ptr[l + 1]]
+        self.list_docs = np.argsort(assignments, kind='stable').astype(np.int64)
+        self.list_ptr = np.zeros(centroids.shape[1] + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignments, minlength=centroids.shape[1]), out=self.list_ptr[1:])
+
+    @property
+    def n_lists(self) -> int:
+        return self.centroids.shape[1]
+
+    @staticmethod
+    def default_n_lists(n_docs: int) -> int:
+        """Número de listas por defecto: ~2·√N"""
+        return max(1, min(n_docs, int(2 * np.sqrt(n_docs))))
+
+    @classmethod
+    def build(cls, vectors: Vectors, n_lists: Optional[int] = None, seed: int = 0) -> "IVFIndex":
+        """Entrena los centroides (k-means esférico sobre una muestra) y asigna todos los documentos"""
+        n_docs = _n_docs(vectors)
+        n_lists = n_lists or cls.default_n_lists(n_docs)
+        rng = np.random.default_rng(seed)
+        sample_size = min(n_docs, n_lists * cls.KMEANS_SAMPLE_PER_LIST)
+        sample = np.ascontiguousarray(_columns(vectors, rng.choice(n_docs, sample_size, replace=False)).T)
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(cls.KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            order = np.argsort(assign, kind='stable')
+            counts = np.bincount(assign, minlength=n_lists)
+            starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+            non_empty = counts > 0
+            sums = np.add.reduceat(sample[order], starts[non_empty], axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids[non_empty] = sums / norms    # las listas vacías conservan su centroide
+
+        centroids = np.ascontiguousarray(centroids.T.astype(np.float32))
+        return cls(centroids, cls._assign(centroids, vectors))
+
+    @classmethod
+    def _assign(cls, centroids: np.ndarray, vectors: Vectors) -> np.ndarray:
+        """Centroide más cercano de cada documento (por bloques)"""
+        n_docs = _n_docs(vectors)
+        assignments = np.zeros(n_docs, dtype=np.int32)
+        for start in range(0, n_docs, cls.ASSIGN_CHUNK):
+            block = _columns(vectors, slice(start, start + cls.ASSIGN_CHUNK))
+            assignments[start:start + block.shape[1]] = np.argmax(centroids.T @ block, axis=0)
+        return assignments
+
+    def updated(self, sources: np.ndarray, vectors: Vectors) -> "IVFIndex":
+        """
+        Índice para una nueva versión de los documentos: las filas conservadas mantienen
+        su lista y las nuevas/editadas se asignan al centroide más cercano (sin reentrenar).
+        """
+        kept = sources >= 0
+        assignments = np.zeros(len(sources), dtype=np.int32)
+        assignments[kept] = self.assignments[sources[kept]]
+        changed = np.flatnonzero(~kept)
+        if len(changed):
+            assignments[changed] = self._assign(self.centroids, _columns(vectors, changed))
+        return IVFIndex(self.centroids, assignments)
+
+    def probe(self, bucket_ids: np.ndarray, weights: np.ndarray, n_probe: int) -> np.ndarray:
+        """Las n_probe listas cuyo centroide está más cerca de la query (vector disperso)"""
+        if n_probe >= self.n_lists:
+            return np.arange(self.n_lists)
+        similarity = weights @ self.centroids[bucket_ids]
+        return np.argpartition(-similarity, n_probe - 1)[:n_probe]
+
+    def to_arrays(self, prefix: str) -> Dict[str, np.ndarray]:
+        return {prefix + 'centroids': self.centroids, prefix + 'assignments': self.assignments}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], prefix: str) -> Optional["IVFIndex"]:
+        if prefix + 'centroids' not in arrays:
+            return None
+        return cls(arrays[prefix + 'centroids'], arrays[prefix + 'assignments'])
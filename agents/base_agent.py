@@ -1,53 +1,79 @@
 """
 Clase base para todos los agentes
 """
-from typing import List, Tuple, Optional
+from typing import List, Tuple, Optional, Union
 from abc import ABC, abstractmethod
-from .rag_engine import get_rag_engine
+from .rag_engine import AnalyzedQuery, get_rag_engine, run_retrieval
+from .retrieval_pool import get_retrieval_pool
 
 
 class BaseAgent(ABC):
     """Clase base abstracta para agentes especializados"""
 
     def __init__(self):
-        self.rag = get_rag_engine()
         self.name = "BaseAgent"
         self.description = ""
         self.categories = []  # Categorías del RAG que este agente maneja
 
+    @property
+    def rag(self):
+        """Versión publicada del motor RAG (cambia tras una recarga de la base)"""
+        return get_rag_engine()
+
     @property
     @abstractmethod
     def system_prompt(self) -> str:
         """Prompt de sistema específico del agente"""
         pass
 
-    def search_knowledge(self, query: str, top_k: int = 5) -> List[Tuple[dict, float]]:
+    def search_knowledge(self, query: Union[str, AnalyzedQuery], top_k: int = 5) -> List[Tuple[dict, float]]:
         """Busca en la base de conocimiento filtrado por las categorías del agente"""
         return self.rag.search(query, top_k=top_k, categories=self.categories if self.categories else None)
 
-    def search_knowledge_with_fallback(self, query: str, top_k: int = 5,
+    def search_knowledge_with_fallback(self, query: Union[str, AnalyzedQuery], top_k: int = 5,
                                        score_threshold: float = 0.25) -> List[Tuple[dict, float]]:
         """Búsqueda dual: primero filtrada por categorías, si no hay buenos resultados busca sin filtro"""
+        rag = self.rag  # misma versión del índice durante toda la búsqueda
+        query = rag.analyze(query)
 
-        # 1. Búsqueda filtrada por categorías del agente
-        filtered_results = self.rag.search(
+        # 1. Búsqueda filtrada por categorías del agente + sin filtro (una sola pasada de scoring)
+        filtered_results, unfiltered_results = rag.search_dual(
             query, top_k=top_k,
             categories=self.categories if self.categories else None
         )
 
-        # 2. Evaluar calidad
+        return self._apply_fallback(query, filtered_results, unfiltered_results, top_k, score_threshold)
+
+    async def asearch_knowledge_with_fallback(self, query: Union[str, AnalyzedQuery], top_k: int = 5,
+                                              score_threshold: float = 0.25) -> List[Tuple[dict, float]]:
+        """
+        Versión async de search_knowledge_with_fallback (mismos resultados): la búsqueda
+        corre en el pool de procesos si está activo, o en el executor de búsqueda.
+        """
+        rag = self.rag
+        query = rag.analyze(query)
+        categories = self.categories if self.categories else None
+        pool = get_retrieval_pool()
+        if pool is not None:
+            filtered_results, unfiltered_results = await pool.search_dual(rag, query, top_k, categories)
+        else:
+            filtered_results, unfiltered_results = await run_retrieval(rag.search_dual, query, top_k, categories)
+        return self._apply_fallback(query, filtered_results, unfiltered_results, top_k, score_threshold)
+
+    def _apply_fallback(self, query: AnalyzedQuery, filtered_results: List[Tuple[dict, float]],
+                        unfiltered_results: List[Tuple[dict, float]], top_k: int,
+                        score_threshold: float) -> List[Tuple[dict, float]]:
+        """Filtrados si son buenos; si no, combinación con los resultados sin filtro"""
+        # Evaluar calidad
         best_score = max((score for _, score in filtered_results), default=0.0)
 
         if best_score >= score_threshold:
             return filtered_results  # Buenos resultados, usar filtrados
 
-        # 3. Fallback activado — log para métricas
-        print(f"[FALLBACK] Query: '{query[:50]}' | Score: {best_score:.2f} | Agent: {self.name}")
-
-        # 4. Búsqueda SIN filtro de categorías
-        unfiltered_results = self.rag.search(query, top_k=top_k, categories=None)
+        # Fallback activado — log para métricas
+        print(f"[FALLBACK] Query: '{query.raw[:50]}' | Score: {best_score:.2f} | Agent: {self.name}")
 
-        # 5. Combinar: boost 1.1x a resultados de categorías nativas
+        # Combinar: boost 1.1x a resultados de categorías nativas
         combined = {}
         for qa, score in unfiltered_results:
             combined[qa['pregunta']] = (qa, score)
@@ -62,9 +88,10 @@ class BaseAgent(ABC):
         results = sorted(combined.values(), key=lambda x: x[1], reverse=True)
         return results[:top_k]
 
-    def enrich_context(self, query: str, results: List[Tuple[dict, float]]) -> str:
+    def enrich_context(self, query: Union[str, AnalyzedQuery], results: List[Tuple[dict, float]]) -> str:
         """Enriquece el contexto RAG con conocimiento estructurado del agente.
-        Override en subclases para aportar inteligencia específica."""
+        Override en subclases para aportar inteligencia específica.
+        Las subclases usan self.rag.analyze(query) para no re-procesar el texto."""
         return ""
 
     def format_context(self, results: List[Tuple[dict, float]], min_score: float = 0.1) -> str:
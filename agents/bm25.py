@@ -0,0 +1,196 @@
+"""
+Índice de keywords BM25F con postings en arrays numpy.
+Cada documento tiene varios campos (pregunta, respuesta) con peso propio.
+"""
+import sys
+from collections import Counter
+from typing import Dict, Iterator, List, Mapping, Sequence, Set
+import numpy as np
+
+from .sparse_matrix import CSRMatrix, merge_count_rows
+
+
+class BM25FIndex:
+    """
+    Scorer BM25F: combina las frecuencias de cada campo ponderadas y
+    normalizadas por longitud antes de la saturación k1.
+
+    El índice guarda las frecuencias crudas por campo (`field_counts`); todo
+    lo demás (longitudes, IDF, pesos por posting) se deriva de ellas con
+    operaciones vectorizadas. En búsqueda solo se acumulan las postings de
+    los términos de la query con numpy.
+    """
+
+    def __init__(self, field_weights: Sequence[float], field_b: Sequence[float], k1: float = 1.2):
+        self.field_weights = np.asarray(field_weights, dtype=np.float64)
+        self.field_b = np.asarray(field_b, dtype=np.float64)
+        self.k1 = k1
+        self.term_to_id: Dict[str, int] = {}  # única tabla de términos: el orden de inserción es el id
+        self.field_counts: List[CSRMatrix] = []
+        self.field_matrices: List[CSRMatrix] = []
+        self.idf = np.zeros(0)
+        self.doc_lengths = np.zeros((0, len(field_weights)))
+        self.matrix = CSRMatrix.from_rows([], 0)
+
+    def build(self, docs: List[List[List[str]]]):
+        """
+        Construye el índice.
+
+        Args:
+            docs: Por documento, la lista de términos de cada campo
+        """
+        n_fields = len(self.field_weights)
+        field_counts = [[Counter(field) for field in doc] for doc in docs]
+        self.term_to_id = {}
+        for doc in field_counts:
+            for counts in doc:
+                for term in counts:
+                    if term not in self.term_to_id:
+                        self.term_to_id[sys.intern(term)] = len(self.term_to_id)
+
+        self.field_counts = [
+            CSRMatrix.from_rows([self._count_row(doc[f]) for doc in field_counts], len(self.term_to_id),
+                                dtype=np.float32)
+            for f in range(n_fields)
+        ]
+        self.derive()
+
+    @property
+    def terms(self) -> List[str]:
+        """Términos por id (lista construida bajo demanda desde term_to_id)"""
+        return list(self.term_to_id)
+
+    def updated(self, sources: np.ndarray, new_docs: Dict[int, List[List[str]]]) -> "BM25FIndex":
+        """
+        Nuevo índice con filas conservadas/reemplazadas (el actual no se modifica).
+
+        Args:
+            sources: Para cada documento nuevo, su fila en este índice (-1 = nuevo o editado)
+            new_docs: Documento → términos de cada campo, para las filas con -1
+        """
+        index = BM25FIndex(self.field_weights, self.field_b, self.k1)
+        new_rows = {row: [Counter(field) for field in doc] for row, doc in new_docs.items()}
+        index.field_counts, terms = merge_count_rows(self.field_counts, self.terms, sources, new_rows)
+        index.term_to_id = {sys.intern(term): i for i, term in enumerate(terms)}
+        index.derive()
+        return index
+
+    def derive(self):
+        """Calcula longitudes, IDF y pesos por posting a partir de las frecuencias por campo"""
+        n_docs, n_terms = self.field_counts[0].shape
+        self.doc_lengths = np.stack([m.row_sums() for m in self.field_counts], axis=1)
+        avg_lengths = self.doc_lengths.mean(axis=0) if n_docs else np.ones(len(self.field_counts))
+        avg_lengths[avg_lengths == 0] = 1.0
+        # Normalización de longitud por campo: (1 - b) + b * len / avg_len
+        length_norm = (1 - self.field_b) + self.field_b * self.doc_lengths / avg_lengths
+
+        # Presencia binaria de términos por campo (para boosts por coincidencia en un campo)
+        self.field_matrices = [m.with_data(np.ones(len(m.data), dtype=np.uint8)) for m in self.field_counts]
+
+        # Pseudo-frecuencia BM25F: suma ponderada de las frecuencias normalizadas de cada campo
+        rows, cols, values = [], [], []
+        for f, counts in enumerate(self.field_counts):
+            row_ids = counts.row_ids()
+            rows.append(row_ids)
+            cols.append(counts.indices)
+            values.append(counts.data * self.field_weights[f] / length_norm[row_ids, f])
+        tf = CSRMatrix.from_coo(np.concatenate(rows), np.concatenate(cols),
+                                np.concatenate(values), (n_docs, n_terms))
+        self.matrix = tf.with_data((tf.data / (self.k1 + tf.data)).astype(np.float32))
+
+        doc_freq = self.matrix.column_nnz().astype(np.float64)
+        self.idf = np.log(1 + (n_docs - doc_freq + 0.5) / (doc_freq + 0.5))
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Arrays para persistir el índice (los términos se guardan aparte)"""
+        arrays = {'bm25_idf': self.idf, 'bm25_doc_lengths': self.doc_lengths}
+        for f, counts in enumerate(self.field_counts):
+            arrays.update(counts.to_arrays(f'bm25_field{f}_'))
+        arrays.update(self.matrix.to_arrays('bm25_weights_'))
+        return arrays
+
+    def load_arrays(self, terms: List[str], arrays: Dict[str, np.ndarray], n_docs: int):
+        """Restaura el índice desde arrays persistidos sin recalcular nada"""
+        self.term_to_id = {sys.intern(term): i for i, term in enumerate(terms)}
+        shape = (n_docs, len(terms))
+        self.field_counts = [CSRMatrix.from_arrays(arrays, f'bm25_field{f}_', shape)
+                             for f in range(len(self.field_weights))]
+        self.field_matrices = [m.with_data(np.ones(len(m.data), dtype=np.uint8)) for m in self.field_counts]
+        self.matrix = CSRMatrix.from_arrays(arrays, 'bm25_weights_', shape)
+        self.idf = arrays['bm25_idf']
+        self.doc_lengths = arrays['bm25_doc_lengths']
+
+    def _count_row(self, counts: Counter):
+        """Fila (ids, frecuencias) con los términos de un campo"""
+        indices = np.fromiter((self.term_to_id[t] for t in counts), dtype=np.int32, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        return indices, values
+
+    def _term_vector(self, term_weights: Dict[str, float]):
+        """Convierte {término: peso} en (ids, pesos) ignorando términos fuera del índice"""
+        ids = [(self.term_to_id[t], w) for t, w in term_weights.items() if t in self.term_to_id]
+        return (np.array([i for i, _ in ids], dtype=np.int64),
+                np.array([w for _, w in ids], dtype=np.float64))
+
+    def _term_batch(self, batch: Sequence[Dict[str, float]]):
+        """Vectores de un lote de queries como tripletas (query, ids, pesos)"""
+        vectors = [self._term_vector(term_weights) for term_weights in batch]
+        rows = np.repeat(np.arange(len(batch)), [len(ids) for ids, _ in vectors])
+        if not vectors:
+            return rows, np.zeros(0, dtype=np.int64), np.zeros(0)
+        return rows, np.concatenate([ids for ids, _ in vectors]), np.concatenate([w for _, w in vectors])
+
+    def field_matches(self, terms: Set[str], field: int) -> np.ndarray:
+        """Número de términos que aparecen en el campo indicado, por documento"""
+        indices, weights = self._term_vector({t: 1.0 for t in terms})
+        return self.field_matrices[field].dot_sparse(indices, weights)
+
+    def field_matches_many(self, batch: Sequence[Set[str]], field: int) -> np.ndarray:
+        """field_matches para un lote de queries (queries × documentos)"""
+        rows, indices, weights = self._term_batch([{t: 1.0 for t in terms} for terms in batch])
+        return self.field_matrices[field].dot_sparse_many(rows, indices, weights, len(batch))
+
+    def postings(self, term: str) -> np.ndarray:
+        """Documentos (ids enteros) que contienen el término"""
+        term_id = self.term_to_id.get(term)
+        if term_id is None:
+            return np.zeros(0, dtype=np.int32)
+        return self.matrix.col_rows[self.matrix.col_ptr[term_id]:self.matrix.col_ptr[term_id + 1]]
+
+    def score(self, term_weights: Dict[str, float]) -> np.ndarray:
+        """Score BM25F de todos los documentos para términos de query con peso"""
+        return self.score_ids(*self._term_vector(term_weights))
+
+    def score_ids(self, indices: np.ndarray, weights: np.ndarray) -> np.ndarray:
+        """score() con los términos ya convertidos a ids"""
+        return self.matrix.dot_sparse(indices, weights * self.idf[indices])
+
+    def score_many(self, batch: Sequence[Dict[str, float]]) -> np.ndarray:
+        """Scores BM25F de un lote de queries en un solo producto (queries × documentos)"""
+        return self.score_ids_many(*self._term_batch(batch), len(batch))
+
+    def score_ids_many(self, rows: np.ndarray, indices: np.ndarray, weights: np.ndarray,
+                       n_queries: int) -> np.ndarray:
+        """score_many() con tripletas (query, id de término, peso)"""
+        return self.matrix.dot_sparse_many(rows, indices, weights * self.idf[indices], n_queries)
+
+
+class PostingsView(Mapping):
+    """Vista de solo lectura término → postings sobre un BM25FIndex (sin copiar en un dict)"""
+
+    def __init__(self, index: BM25FIndex):
+        self._index = index
+
+    def __getitem__(self, term: str) -> np.ndarray:
+        if term not in self._index.term_to_id:
+            raise KeyError(term)
+        return self._index.postings(term)
+
+    def __contains__(self, term) -> bool:
+        return term in self._index.term_to_id
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._index.term_to_id)
+
+    def __len__(self) -> int:
+        return len(self._index.term_to_id)
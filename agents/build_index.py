@@ -0,0 +1,27 @@
+"""
+Construcción offline del artefacto de índice RAG (p. ej. en el Dockerfile).
+
+Uso:
+    python -m agents.build_index [--kb knowledge_base.json] [--index-dir .rag_index] [--force]
+"""
+import argparse
+import os
+
+from .index_store import default_index_dir
+from .rag_engine import RAGEngine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Construye el artefacto de índice del RAG")
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser.add_argument('--kb', default=os.path.join(base_path, 'knowledge_base.json'))
+    parser.add_argument('--index-dir', default=default_index_dir())
+    parser.add_argument('--force', action='store_true', help="Reconstruir aunque exista el artefacto")
+    args = parser.parse_args()
+
+    engine = RAGEngine(args.kb, index_dir=args.index_dir, rebuild_index=args.force)
+    print(f"[RAG] Artefacto listo: {os.path.join(args.index_dir, engine.kb_hash)}")
+
+
+if __name__ == '__main__':
+    main()
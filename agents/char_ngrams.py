@@ -0,0 +1,259 @@
+"""
+Canal de n-gramas de caracteres con hashing (solo numpy).
+
+Pensado para transcripciones de voz (Whisper) donde los nombres de producto
+llegan deformados: "bio pro", "vio pro", "efe bio", "tres de ve ese". El texto
+se compacta sin espacios y con las letras deletreadas convertidas ("efe" → f),
+y sus n-gramas se proyectan con un hash estable en un vector float32 disperso
+de dimensión fija. La búsqueda es un único producto matriz × vector disperso.
+"""
+import re
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from .ann import IVFIndex
+from .sparse_matrix import CSRMatrix
+
+# Multiplicador del hash de Fibonacci (mezcla los bits antes de reducir a `dim`)
+_HASH_MULTIPLIER = np.uint64(0x9E3779B97F4A7C15)
+
+# Nombres de letras y números tal como los transcribe el reconocimiento de voz
+SPOKEN_LETTERS: Dict[str, str] = {
+    'be': 'b', 'ce': 'c', 'de': 'd', 'efe': 'f', 'ge': 'g', 'hache': 'h', 'jota': 'j',
+    'ka': 'k', 'ele': 'l', 'eme': 'm', 'ene': 'n', 'pe': 'p', 'cu': 'q', 'erre': 'r',
+    'ese': 's', 'te': 't', 'uve': 'v', 've': 'v', 'equis': 'x', 'zeta': 'z',
+    'uno': '1', 'dos': '2', 'tres': '3', 'cuatro': '4', 'cinco': '5',
+}
+
+
+class CharNgramIndex:
+    """
+    Matriz dispersa de n-gramas de caracteres con hashing.
+
+    Igual que BM25FIndex, guarda las frecuencias crudas y deriva de ellas el IDF y
+    los vectores ponderados (tf sublineal × idf, norma L2). Las frecuencias se
+    guardan dispersas (~80 n-gramas por pregunta de `dim` posibles): fila r =
+    count_buckets/count_values[count_ptr[r]:count_ptr[r + 1]].
+
+    La matriz ponderada (`weights`) es una CSRMatrix float32 con el mismo patrón
+    que las frecuencias (solo ~3 % de los `dim` buckets de un documento son no
+    nulos): una query lee solo las columnas de sus n-gramas, como el canal TF-IDF.
+    Con índice IVF, sus filas se reordenan por lista (`row_docs` = documento de
+    cada fila) para que cada lista sea un rango contiguo de filas, y
+    `list_positions` guarda dónde empieza cada lista dentro de cada columna. Con
+    quantization='int8' los valores se guardan en int8 con una escala por fila
+    (`scales`) a cambio de un error de ~0.4 % en los scores del canal.
+    """
+
+    QUANTIZATIONS = ('float32', 'int8')
+
+    def __init__(self, dim: int = 2048, sizes: Sequence[int] = (3, 4), quantization: str = 'float32'):
+        if quantization not in self.QUANTIZATIONS:
+            raise ValueError(f"Cuantización desconocida: {quantization} (opciones: {', '.join(self.QUANTIZATIONS)})")
+        self.dim = dim
+        self.sizes = tuple(sizes)
+        self.quantization = quantization
+        self.count_ptr = np.zeros(1, dtype=np.int64)
+        self.count_buckets = np.zeros(0, dtype=np.uint16)   # dim ≤ 65536
+        self.count_values = np.zeros(0, dtype=np.uint16)
+        self.idf = np.ones(dim, dtype=np.float32)
+        self.weights = CSRMatrix.from_rows([], dim, dtype=np.float32)
+        self.scales: Optional[np.ndarray] = None   # Escala por fila de los pesos int8
+        self.ivf: Optional[IVFIndex] = None        # Índice aproximado opcional (ver build_ivf)
+        self.row_docs: Optional[np.ndarray] = None  # None = filas en orden de documento
+        self.list_positions: Optional[np.ndarray] = None  # dim × (n_lists + 1), con IVF
+
+    @property
+    def n_docs(self) -> int:
+        return len(self.count_ptr) - 1
+
+    @staticmethod
+    def compact(normalized: str) -> str:
+        """Texto normalizado → cadena sin espacios con letras deletreadas convertidas"""
+        words = re.sub(r'[^\w\s]', ' ', normalized).split()
+        return ''.join(SPOKEN_LETTERS.get(w, w) for w in words)
+
+    def _buckets(self, normalized: str) -> np.ndarray:
+        """Bucket de cada n-grama del texto (hash polinómico vectorizado sobre los bytes, estable entre procesos)"""
+        data = np.frombuffer(self.compact(normalized).encode('utf-8'), dtype=np.uint8).astype(np.uint64)
+        buckets = []
+        for n in self.sizes:
+            count = len(data) - n + 1
+            if count <= 0:
+                continue
+            hashes = np.full(count, n, dtype=np.uint64)
+            for k in range(n):
+                hashes = hashes * np.uint64(257) + data[k:k + count]
+            buckets.append(((hashes * _HASH_MULTIPLIER) >> np.uint64(32)) % np.uint64(self.dim))
+        return np.concatenate(buckets).astype(np.int64) if buckets else np.zeros(0, dtype=np.int64)
+
+    def encode(self, normalized_texts: Sequence[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Frecuencias dispersas de n-gramas hasheados de cada texto: (ptr, buckets, frecuencias)"""
+        rows = [np.unique(self._buckets(text), return_counts=True) for text in normalized_texts]
+        ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum([len(buckets) for buckets, _ in rows], out=ptr[1:])
+        if not rows:
+            return ptr, np.zeros(0, dtype=np.uint16), np.zeros(0, dtype=np.uint16)
+        return (ptr, np.concatenate([b for b, _ in rows]).astype(np.uint16),
+                np.concatenate([c for _, c in rows]).astype(np.uint16))
+
+    def build(self, normalized_texts: Sequence[str]):
+        """Construye el índice desde los textos normalizados de los documentos"""
+        self.count_ptr, self.count_buckets, self.count_values = self.encode(normalized_texts)
+        self.derive()
+        self._quantize()
+
+    def derive(self):
+        """Calcula IDF y la matriz ponderada (float32, dispersa) desde las frecuencias crudas"""
+        n_docs = self.n_docs
+        buckets = self.count_buckets.astype(np.int64)
+        doc_freq = np.bincount(buckets, minlength=self.dim)
+        self.idf = (np.log((1.0 + n_docs) / (1.0 + doc_freq)) + 1.0).astype(np.float32)
+
+        # tf sublineal × idf, normalizado L2 por documento
+        row_ids = np.repeat(np.arange(n_docs), np.diff(self.count_ptr))
+        weights = (1.0 + np.log(self.count_values)) * self.idf[buckets]
+        norms = np.sqrt(np.bincount(row_ids, weights=weights * weights, minlength=n_docs))
+        norms[norms == 0] = 1.0
+        # Comparte indptr/indices con las frecuencias (mismo patrón de no nulos)
+        self.weights = CSRMatrix(self.count_ptr, self.count_buckets,
+                                 (weights / norms[row_ids]).astype(np.float32), (n_docs, self.dim))
+        self.scales = None
+        self.row_docs = None
+        self.list_positions = None
+
+    def _quantize(self):
+        """Con quantization='int8', pasa los pesos a int8 con una escala por fila"""
+        if self.quantization != 'int8' or self.scales is not None:
+            return
+        data, indptr = self.weights.data, self.weights.indptr
+        scales = np.ones(self.weights.shape[0], dtype=np.float32)
+        non_empty = np.diff(indptr) > 0
+        if non_empty.any():
+            # Las filas vacías no ocupan entradas: los tramos entre inicios no vacíos son las filas
+            scales[non_empty] = np.maximum.reduceat(data, indptr[:-1][non_empty]) / 127.0
+        scales[scales == 0] = 1.0
+        self.weights = self.weights.with_data(np.rint(data / scales[self.weights.row_ids()]).astype(np.int8))
+        self.scales = scales
+
+    def updated(self, sources: np.ndarray, new_texts: Dict[int, str]) -> "CharNgramIndex":
+        """Nuevo índice con filas conservadas (sources ≥ 0) y filas recalculadas (el actual no cambia)"""
+        index = CharNgramIndex(self.dim, self.sizes, self.quantization)
+        rows = list(new_texts)
+        new_ptr, new_buckets, new_values = self.encode([new_texts[row] for row in rows])
+
+        # Longitud de cada fila nueva: la de su fila de origen o la recién calculada
+        lengths = np.zeros(len(sources), dtype=np.int64)
+        kept = np.flatnonzero(sources >= 0)
+        lengths[kept] = np.diff(self.count_ptr)[sources[kept]]
+        lengths[rows] = np.diff(new_ptr)
+        index.count_ptr = np.zeros(len(sources) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=index.count_ptr[1:])
+        index.count_buckets = np.zeros(index.count_ptr[-1], dtype=np.uint16)
+        index.count_values = np.zeros(index.count_ptr[-1], dtype=np.uint16)
+
+        # Copia vectorizada de las entradas de las filas conservadas y de las nuevas
+        for targets, src_rows, (ptr, buckets, values) in (
+                (kept, sources[kept], (self.count_ptr, self.count_buckets, self.count_values)),
+                (np.asarray(rows, dtype=np.int64), np.arange(len(rows)), (new_ptr, new_buckets, new_values))):
+            row_lengths = lengths[targets]
+            total = int(row_lengths.sum())
+            src = np.repeat(ptr[src_rows] - np.cumsum(row_lengths) + row_lengths, row_lengths) + np.arange(total)
+            dst = np.repeat(index.count_ptr[targets] - np.cumsum(row_lengths) + row_lengths, row_lengths) + np.arange(total)
+            index.count_buckets[dst] = buckets[src]
+            index.count_values[dst] = values[src]
+
+        index.derive()
+        if self.ivf is not None:
+            index.ivf = self.ivf.updated(sources, index.weights)
+            index._order_by_lists()
+        index._quantize()
+        return index
+
+    def build_ivf(self, n_lists: Optional[int] = None):
+        """Construye el índice aproximado IVF sobre los vectores de los documentos"""
+        if self.row_docs is not None or self.scales is not None:
+            self.derive()
+        self.ivf = IVFIndex.build(self.weights, n_lists)
+        self._order_by_lists()
+        self._quantize()
+
+    def _order_by_lists(self):
+        """Reordena las filas de la matriz por lista IVF"""
+        self.weights = self.weights.take_rows(self.ivf.list_docs)
+        self.row_docs = self.ivf.list_docs
+        self.list_positions = self.weights.column_positions(self.ivf.list_ptr)
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        arrays = {'ngram_count_ptr': self.count_ptr, 'ngram_count_buckets': self.count_buckets,
+                  'ngram_count_values': self.count_values, 'ngram_idf': self.idf}
+        arrays.update(self.weights.to_arrays('ngram_weights_'))
+        if self.scales is not None:
+            arrays['ngram_scales'] = self.scales
+        if self.ivf is not None:
+            arrays.update(self.ivf.to_arrays('ngram_ivf_'))
+        return arrays
+
+    def load_arrays(self, arrays: Dict[str, np.ndarray]):
+        self.count_ptr = arrays['ngram_count_ptr']
+        self.count_buckets = arrays['ngram_count_buckets']
+        self.count_values = arrays['ngram_count_values']
+        self.idf = arrays['ngram_idf']
+        self.weights = CSRMatrix.from_arrays(arrays, 'ngram_weights_', (self.n_docs, self.dim))
+        self.scales = arrays.get('ngram_scales')
+        self.ivf = IVFIndex.from_arrays(arrays, 'ngram_ivf_')
+        self.row_docs = self.ivf.list_docs if self.ivf is not None else None
+        self.list_positions = (self.weights.column_positions(self.ivf.list_ptr)
+                               if self.ivf is not None else None)
+
+    def arrays(self) -> List[np.ndarray]:
+        """Arrays del índice (frecuencias, pesos, IVF), sin repetir los compartidos"""
+        arrays = [self.count_ptr, self.count_buckets, self.count_values, self.idf, self.weights.data,
+                  self.weights.col_data] + [getattr(self.weights, name) for name in CSRMatrix.STRUCTURE_ARRAYS]
+        if self.scales is not None:
+            arrays.append(self.scales)
+        if self.ivf is not None:
+            arrays += [self.ivf.centroids, self.ivf.assignments, self.ivf.list_docs, self.ivf.list_ptr,
+                       self.list_positions]
+        return list({id(a): a for a in arrays}.values())
+
+    def nbytes(self) -> int:
+        """Memoria de los arrays del índice (frecuencias, pesos, IVF)"""
+        return int(sum(a.nbytes for a in self.arrays()))
+
+    def score_many(self, normalized_queries: Sequence[str], n_probe: Optional[int] = None) -> np.ndarray:
+        """
+        Coseno de cada query con todos los documentos (producto disperso sobre las
+        columnas de sus n-gramas).
+
+        Con `n_probe` y un índice IVF, solo se puntúan los documentos de las n_probe
+        listas más cercanas (el resto queda a 0): búsqueda aproximada.
+        """
+        scores = np.zeros((len(normalized_queries), self.n_docs))
+        # Un producto por query: el score no depende del tamaño del lote y search_many
+        # coincide con search
+        for i, text in enumerate(normalized_queries):
+            buckets, counts = np.unique(self._buckets(text), return_counts=True)
+            weights = ((1.0 + np.log(counts)) * self.idf[buckets]).astype(np.float32)
+            norm = np.linalg.norm(weights)
+            if norm == 0:
+                continue
+            weights /= norm
+            if n_probe and self.ivf is not None and n_probe < self.ivf.n_lists:
+                # Solo los tramos de cada columna con las filas de las listas visitadas
+                lists = self.ivf.probe(buckets, weights, n_probe)
+                positions = self.list_positions[buckets]
+                row_scores = self.weights.dot_sparse_ranges(weights, positions[:, lists], positions[:, lists + 1])
+            else:
+                row_scores = self.weights.dot_sparse(buckets, weights)
+            if self.scales is not None:
+                row_scores *= self.scales
+            if self.row_docs is not None:
+                scores[i, self.row_docs] = row_scores
+            else:
+                scores[i] = row_scores
+        return scores
+
+    def fingerprint(self) -> Tuple[int, Tuple[int, ...], str, str, List[Tuple[str, str]]]:
+        """Configuración que afecta a los vectores (para el hash del artefacto)"""
+        return self.dim, self.sizes, 'poly257-fib', self.quantization, sorted(SPOKEN_LETTERS.items())
@@ -0,0 +1,173 @@
+"""
+Empaquetado del contexto dinámico del prompt (hechos, enriquecimiento e historial)
+dentro de un presupuesto de tokens por modo de respuesta.
+
+Los tokens del prompt marcan la latencia y el coste de cada llamada al LLM. El
+estimador es local (sin tokenizer): cuenta palabras, números y signos y
+reparte las palabras largas en trozos de ~4 letras, como hacen los tokenizers
+BPE con el español. Si el contexto no cabe:
+
+- el historial conserva al menos su parte del presupuesto (HISTORY_SHARE) y
+  recorta desde los mensajes más antiguos;
+- el enriquecimiento del agente entra si cabe junto al mejor hecho;
+- los hechos se recortan o se descartan empezando por el de menor score (el
+  mejor siempre entra, recortado si hace falta).
+"""
+import os
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .base_agent import BaseAgent
+
+CONTEXT_TOKEN_BUDGETS = {
+    'full': int(os.getenv('CONTEXT_TOKEN_BUDGET_FULL', '4000')),
+    'short': int(os.getenv('CONTEXT_TOKEN_BUDGET_SHORT', '2500')),
+}
+HISTORY_SHARE = 0.5         # Parte del presupuesto reservada al historial si el contexto RAG no cabe
+MIN_PIECE_TOKENS = 40       # Por debajo de esto no merece la pena recortar: se descarta
+FACT_OVERHEAD_TOKENS = 20   # Cabecera "HECHO VERIFICADO #n (confianza...)" de cada hecho
+MESSAGE_OVERHEAD_TOKENS = 4  # Rol y separadores de cada mensaje del historial
+TRUNCATION_MARK = " […]"
+
+_TOKEN_PIECES = re.compile(r'[^\W\d_]+|\d{1,3}|\S')
+
+
+@lru_cache(maxsize=8192)
+def estimate_tokens(text: str) -> int:
+    """Tokens aproximados de un texto (palabras en trozos de 4 letras, números de 3 cifras, signos)"""
+    return sum((len(piece) + 3) // 4 for piece in _TOKEN_PIECES.findall(text))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Recorta el texto a ~max_tokens, en un final de frase si lo hay (si no, de palabra)"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    # Último trozo que cabe junto con la marca de recorte
+    end, total = 0, estimate_tokens(TRUNCATION_MARK)
+    for match in _TOKEN_PIECES.finditer(text):
+        total += (match.end() - match.start() + 3) // 4
+        if total > max_tokens:
+            break
+        end = match.end()
+    cut = text[:end]
+    sentence_end = max(cut.rfind('. '), cut.rfind('.\n'), cut.rfind('\n'))
+    if sentence_end >= len(cut) // 2:
+        cut = cut[:sentence_end + 1]
+    elif ' ' in cut:
+        cut = cut[:cut.rfind(' ')]
+    return cut.rstrip() + TRUNCATION_MARK
+
+
+@dataclass
+class PackedContext:
+    """Contexto y historial que van al prompt, con las cuentas del empaquetado"""
+    context: str
+    history: List[dict]
+    tokens: int                     # Tokens estimados de contexto + historial empaquetados
+    original_tokens: int            # Lo que ocuparían sin presupuesto
+    facts: int = 0                  # Hechos incluidos
+    facts_truncated: int = 0
+    facts_dropped: int = 0
+    history_dropped: int = 0        # Mensajes del historial descartados
+    history_truncated: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.original_tokens - self.tokens
+
+
+class ContextPacker:
+    """Ajusta hechos, enriquecimiento e historial al presupuesto de tokens del modo de respuesta"""
+
+    def __init__(self, budgets: Optional[Dict[str, int]] = None, history_share: float = HISTORY_SHARE):
+        self.budgets = dict(CONTEXT_TOKEN_BUDGETS if budgets is None else budgets)
+        self.history_share = history_share
+
+    def budget(self, response_mode: str) -> int:
+        return self.budgets['short' if response_mode == 'short' else 'full']
+
+    def pack(self, agent: BaseAgent, results: Sequence[Tuple[dict, float]], enrichment: str,
+             history: Sequence[dict], response_mode: str = "full", min_score: float = 0.1) -> PackedContext:
+        budget = self.budget(response_mode)
+        facts = sorted((r for r in results if r[1] >= min_score), key=lambda r: r[1], reverse=True)
+        fact_tokens = [FACT_OVERHEAD_TOKENS + estimate_tokens(qa['pregunta']) + estimate_tokens(qa['respuesta'])
+                       for qa, _ in facts]
+        enrichment_tokens = estimate_tokens(enrichment) if enrichment else 0
+        message_tokens = [MESSAGE_OVERHEAD_TOKENS + estimate_tokens(m['content']) for m in history]
+        knowledge_needed = sum(fact_tokens) + enrichment_tokens
+        history_needed = sum(message_tokens)
+
+        # Reparto: el historial cede sitio al contexto RAG, pero conserva su parte mínima
+        if knowledge_needed + history_needed <= budget:
+            history_budget = history_needed
+        else:
+            history_budget = min(history_needed, max(budget - knowledge_needed, int(budget * self.history_share)))
+        packed = PackedContext(context="", history=[], tokens=0, original_tokens=knowledge_needed + history_needed)
+        packed.history = self._pack_history(history, message_tokens, history_budget, packed)
+        history_used = sum(MESSAGE_OVERHEAD_TOKENS + estimate_tokens(m['content']) for m in packed.history)
+
+        # Enriquecimiento: cabe si queda sitio tras el mejor hecho (si no, se recorta)
+        remaining = budget - history_used
+        if enrichment and enrichment_tokens > remaining - (fact_tokens[0] if facts else 0):
+            room = remaining - (fact_tokens[0] if facts else 0)
+            enrichment = truncate_to_tokens(enrichment, room) if room >= MIN_PIECE_TOKENS else ""
+            enrichment_tokens = estimate_tokens(enrichment) if enrichment else 0
+        remaining -= enrichment_tokens
+
+        # Hechos por score: los de menor score se recortan/descartan primero
+        kept: List[Tuple[dict, float]] = []
+        for (qa, score), tokens in zip(facts, fact_tokens):
+            if tokens <= remaining:
+                kept.append((qa, score))
+                remaining -= tokens
+                continue
+            room = remaining - FACT_OVERHEAD_TOKENS - estimate_tokens(qa['pregunta'])
+            if room >= MIN_PIECE_TOKENS or not kept:
+                kept.append(({**qa, 'respuesta': truncate_to_tokens(qa['respuesta'], max(room, MIN_PIECE_TOKENS))}, score))
+                packed.facts_truncated += 1
+                remaining = 0
+            packed.facts_dropped = len(facts) - len(kept)
+            break
+        packed.facts = len(kept)
+
+        context = agent.format_context(kept, min_score=min_score)
+        if enrichment:
+            context += f"\n\n═══ CONTEXTO ADICIONAL DEL AGENTE ═══\n{enrichment}"
+        packed.context = context
+        packed.tokens = history_used + enrichment_tokens + sum(
+            FACT_OVERHEAD_TOKENS + estimate_tokens(qa['pregunta']) + estimate_tokens(qa['respuesta']) for qa, _ in kept)
+        return packed
+
+    @staticmethod
+    def _pack_history(history: Sequence[dict], message_tokens: Sequence[int], budget: int,
+                      packed: PackedContext) -> List[dict]:
+        """
+        Mensajes más recientes que caben. El primero que no cabe se recorta (si es una
+        respuesta, junto con su pregunta entera) y los anteriores se descartan.
+        """
+        kept: List[dict] = []
+        remaining = budget
+        i = len(history) - 1
+        while i >= 0:
+            message, tokens = history[i], message_tokens[i]
+            if tokens <= remaining:
+                kept.append(message)
+                remaining -= tokens
+                i -= 1
+                continue
+            question = history[i - 1] if i > 0 and message['role'] == 'assistant' and history[i - 1]['role'] == 'user' else None
+            room = remaining - MESSAGE_OVERHEAD_TOKENS - (message_tokens[i - 1] if question else 0)
+            if room >= MIN_PIECE_TOKENS:
+                kept.append({**message, 'content': truncate_to_tokens(message['content'], room)})
+                packed.history_truncated += 1
+                if question:
+                    kept.append(question)
+            break
+        kept.reverse()
+        # El historial empieza siempre con una pregunta del usuario
+        if kept and kept[0]['role'] == 'assistant':
+            kept = kept[1:]
+        packed.history_dropped = len(history) - len(kept)
+        return kept
@@ -0,0 +1,116 @@
+"""
+Historial de conversación de una sesión con compactación progresiva.
+
+Cada turno reenvía el historial al LLM: sin compactar, con respuestas de ~1000
+tokens, el turno 10 lleva ~10k tokens de historial. Cuando los mensajes
+literales superan COMPACT_TOKENS, los intercambios antiguos se resumen en una
+línea cada uno (resumen extractivo local: la pregunta y las frases de la
+respuesta con más productos, términos de SYNONYMS y cifras) y solo los últimos
+KEEP_EXCHANGES intercambios quedan literales.
+
+El resumen solo crece por el final, así que el prefijo del prompt (prefijo
+estático + resumen anterior) se mantiene entre turnos para la caché de prompts
+del proveedor. Si supera SUMMARY_TOKENS se descartan sus líneas más antiguas.
+"""
+import os
+import re
+from typing import List
+
+from .context_packer import estimate_tokens
+from .rag_engine import get_rag_engine
+
+COMPACT_TOKENS = int(os.getenv('HISTORY_COMPACT_TOKENS', '2000'))    # Umbral de los mensajes literales
+KEEP_EXCHANGES = int(os.getenv('HISTORY_KEEP_EXCHANGES', '1'))        # Intercambios que siempre quedan literales
+SUMMARY_TOKENS = int(os.getenv('HISTORY_SUMMARY_TOKENS', '800'))      # Tamaño máximo del resumen
+SUMMARY_SENTENCES = 2               # Frases de cada respuesta en el resumen
+MAX_SENTENCE_CHARS = 220
+MAX_QUESTION_CHARS = 150
+
+SUMMARY_HEADER = "RESUMEN DE LA CONVERSACIÓN ANTERIOR (intercambios más antiguos, resumidos):"
+
+_TABLE_SEPARATOR = re.compile(r'^\s*\|?\s*:?-{2,}')
+_LINE_MARKUP = re.compile(r'^\s*(?:#+|>|[-*•]|\d+[.)])\s*')
+_INLINE_MARKUP = re.compile(r'\*\*|__|[*`]')
+_SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+')
+_DIGIT = re.compile(r'\d')
+
+
+def _plain_sentences(markdown: str) -> List[str]:
+    """Frases de una respuesta en markdown (sin cabeceras, viñetas, énfasis ni separadores de tabla)"""
+    sentences = []
+    for line in markdown.splitlines():
+        if not line.strip() or _TABLE_SEPARATOR.match(line):
+            continue
+        line = _INLINE_MARKUP.sub('', _LINE_MARKUP.sub('', line))
+        if '|' in line:
+            line = ': '.join(cell.strip() for cell in line.strip().strip('|').split('|') if cell.strip())
+        sentences.extend(s.strip() for s in _SENTENCE_SPLIT.split(line) if len(s.split()) >= 4)
+    return sentences
+
+
+def summarize_exchange(question: str, answer: str) -> str:
+    """
+    Una línea por intercambio: la pregunta y las SUMMARY_SENTENCES frases distintas
+    de la respuesta que nombran más productos y términos ancla (las cifras puntúan
+    doble), en su orden.
+    """
+    rag = get_rag_engine()
+    sentences = list(dict.fromkeys(_plain_sentences(answer)))
+    scores = [rag.anchor_mentions(sentence) + (2 if _DIGIT.search(sentence) else 0) for sentence in sentences]
+    best = sorted(sorted(range(len(sentences)), key=lambda i: scores[i], reverse=True)[:SUMMARY_SENTENCES])
+    points = " · ".join(sentences[i][:MAX_SENTENCE_CHARS] for i in best)
+    question = " ".join(question.split())[:MAX_QUESTION_CHARS]
+    return f"- P: {question}" + (f" → R: {points}" if points else "")
+
+
+class ConversationHistory:
+    """Resumen de los intercambios antiguos + mensajes literales de los recientes"""
+
+    def __init__(self, compact_tokens: int = COMPACT_TOKENS, keep_exchanges: int = KEEP_EXCHANGES,
+                 summary_tokens: int = SUMMARY_TOKENS):
+        self.compact_tokens = compact_tokens
+        self.keep_exchanges = keep_exchanges
+        self.summary_tokens = summary_tokens
+        self.recent: List[dict] = []            # Mensajes literales (user/assistant alternos)
+        self.summary_lines: List[str] = []      # Una línea por intercambio compactado
+        self.compacted = 0                      # Intercambios resumidos en total
+
+    def __len__(self) -> int:
+        """Mensajes que van al prompt (el resumen cuenta como uno)"""
+        return len(self.recent) + (1 if self.summary_lines else 0)
+
+    def add_exchange(self, question: str, answer: str):
+        """Añade un intercambio y compacta si los mensajes literales superan el umbral"""
+        self.recent.append({"role": "user", "content": question})
+        self.recent.append({"role": "assistant", "content": answer})
+        self.compact()
+
+    def recent_tokens(self) -> int:
+        return sum(estimate_tokens(m['content']) for m in self.recent)
+
+    def compact(self) -> int:
+        """Resume los intercambios antiguos si hace falta; devuelve cuántos se han resumido"""
+        keep = 2 * self.keep_exchanges
+        if len(self.recent) <= keep or self.recent_tokens() <= self.compact_tokens:
+            return 0
+        split = len(self.recent) - keep
+        old, self.recent = self.recent[:split], self.recent[split:]
+        questions = [m['content'] for m in old if m['role'] == 'user']
+        answers = [m['content'] for m in old if m['role'] == 'assistant']
+        for question, answer in zip(questions, answers):
+            self.summary_lines.append(summarize_exchange(question, answer))
+        # Resumen acotado: fuera las líneas más antiguas
+        while len(self.summary_lines) > 1 and estimate_tokens(self.summary_text()) > self.summary_tokens:
+            self.summary_lines.pop(0)
+        self.compacted += len(questions)
+        print(f"[HISTORY] {len(questions)} intercambios resumidos — resumen: {len(self.summary_lines)} líneas, "
+              f"~{estimate_tokens(self.summary_text())} tokens; literales: ~{self.recent_tokens()} tokens")
+        return len(questions)
+
+    def summary_text(self) -> str:
+        return SUMMARY_HEADER + "\n" + "\n".join(self.summary_lines) if self.summary_lines else ""
+
+    def messages(self) -> List[dict]:
+        """Historial para el prompt: resumen (si lo hay) y mensajes literales"""
+        summary = [{"role": "system", "content": self.summary_text()}] if self.summary_lines else []
+        return summary + self.recent
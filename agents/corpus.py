@@ -0,0 +1,72 @@
+"""
+Representación compacta de los QA pairs de la base de conocimiento.
+
+Cada QA pair es un objeto con __slots__ en lugar de un dict de JSON (~3× menos
+memoria por registro) y la categoría es un string internado: todos los
+registros de una categoría comparten el mismo objeto. Se comporta como un
+Mapping de solo lectura, así que el código que usa qa['pregunta'] o
+qa.get('id') no cambia.
+"""
+import sys
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional
+
+
+class QARecord(Mapping):
+    """QA pair inmutable: id, categoria, pregunta, respuesta (+ campos extra poco habituales)"""
+
+    __slots__ = ('id', 'categoria', 'pregunta', 'respuesta', 'extra')
+    FIELDS = ('id', 'categoria', 'pregunta', 'respuesta')
+
+    def __init__(self, id: Any, categoria: str, pregunta: str, respuesta: str,
+                 extra: Optional[Dict[str, Any]] = None):
+        self.id = id
+        self.categoria = sys.intern(categoria)
+        self.pregunta = pregunta
+        self.respuesta = respuesta
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "QARecord":
+        """Registro desde el dict del JSON (un id ausente se guarda como None)"""
+        extra = {key: value for key, value in data.items() if key not in cls.FIELDS}
+        return cls(data.get('id'), data['categoria'], data['pregunta'], data['respuesta'], extra or None)
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.FIELDS:
+            value = getattr(self, key)
+            if value is not None or key != 'id':
+                return value
+        elif self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __iter__(self) -> Iterator[str]:
+        for key in self.FIELDS:
+            if key != 'id' or self.id is not None:
+                yield key
+        if self.extra is not None:
+            yield from self.extra
+
+    def __len__(self) -> int:
+        return (3 if self.id is None else 4) + (len(self.extra) if self.extra else 0)
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, QARecord):
+            return (self.id == other.id and self.categoria == other.categoria and
+                    self.pregunta == other.pregunta and self.respuesta == other.respuesta and
+                    self.extra == other.extra)
+        return Mapping.__eq__(self, other)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return dict(self.items())
+
+    def __repr__(self) -> str:
+        return f"QARecord({self.to_dict()!r})"
+
+    def nbytes(self) -> int:
+        """Memoria del registro y de sus strings propios (la categoría internada no se cuenta)"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.pregunta) + sys.getsizeof(self.respuesta)
+        if self.extra is not None:
+            size += sys.getsizeof(self.extra) + sum(sys.getsizeof(v) for v in self.extra.values())
+        return size
@@ -0,0 +1,88 @@
+"""
+Fusión de scores del RAG: pipeline de scorers + combinación vectorizada.
+
+Cada scorer devuelve una matriz (queries × documentos) y la fusión los combina
+con pesos configurables o con reciprocal-rank fusion (RRF) en unas pocas
+operaciones de arrays: añadir una señal no añade pasadas en Python sobre el corpus.
+"""
+from abc import ABC, abstractmethod
+from typing import List, Sequence
+import numpy as np
+
+
+class Scorer(ABC):
+    """Señal de relevancia: puntúa todos los documentos para un lote de queries"""
+
+    name = "scorer"
+
+    @abstractmethod
+    def score_many(self, engine, queries: Sequence) -> np.ndarray:
+        """Scores (queries × documentos) para queries ya analizadas (AnalyzedQuery)"""
+
+
+class TfidfScorer(Scorer):
+    """Similitud coseno TF-IDF con la query expandida con sinónimos"""
+
+    name = "tfidf"
+
+    def score_many(self, engine, queries: Sequence) -> np.ndarray:
+        return engine._tfidf_scores_many(queries)
+
+
+class KeywordScorer(Scorer):
+    """BM25F por campos con boost de coincidencia en pregunta, normalizado a [0, 1]"""
+
+    name = "keywords"
+
+    def score_many(self, engine, queries: Sequence) -> np.ndarray:
+        return engine._keyword_scores_many(queries)
+
+
+class CharNgramScorer(Scorer):
+    """Coseno de n-gramas de caracteres hasheados: tolera nombres deformados por la voz"""
+
+    name = "ngrams"
+
+    def score_many(self, engine, queries: Sequence) -> np.ndarray:
+        return engine._ngram_scores_many(queries)
+
+
+class ScoreFusion:
+    """
+    Combina los scores de varios scorers.
+
+    Métodos:
+        'weighted': suma ponderada de los scores de cada canal
+        'rrf': reciprocal-rank fusion, sum(w / (k + rank)) sobre los documentos con
+               score > 0 en cada canal, reescalado para que 1.0 sea el primer
+               puesto en todos los canales (los umbrales de cobertura siguen en [0, 1])
+    """
+
+    METHODS = ('weighted', 'rrf')
+
+    def __init__(self, method: str = 'weighted', rrf_k: int = 60):
+        if method not in self.METHODS:
+            raise ValueError(f"Método de fusión desconocido: {method} (opciones: {', '.join(self.METHODS)})")
+        self.method = method
+        self.rrf_k = rrf_k
+
+    def fuse(self, channels: List[np.ndarray], weights: Sequence[float]) -> np.ndarray:
+        """Combina matrices (queries × documentos) de cada canal"""
+        if self.method == 'rrf':
+            return self._reciprocal_rank(channels, weights)
+        combined = channels[0] * weights[0]
+        for scores, weight in zip(channels[1:], weights[1:]):
+            combined += scores * weight
+        return combined
+
+    def _reciprocal_rank(self, channels: List[np.ndarray], weights: Sequence[float]) -> np.ndarray:
+        n_queries, n_docs = channels[0].shape
+        combined = np.zeros((n_queries, n_docs))
+        rows = np.arange(n_queries)[:, None]
+        for scores, weight in zip(channels, weights):
+            order = np.argsort(-scores, axis=1, kind='stable')
+            ranks = np.empty_like(order)
+            ranks[rows, order] = np.arange(1, n_docs + 1)
+            combined += np.where(scores > 0, weight / (self.rrf_k + ranks), 0.0)
+        max_possible = sum(weights) / (self.rrf_k + 1)
+        return combined / max_possible if max_possible > 0 else combined
@@ -0,0 +1,88 @@
+"""
+Persistencia del índice RAG en disco.
+
+El artefacto es un directorio con un .npy por array (cargables con mmap) y un
+manifest.json con los vocabularios. Se identifica por el hash del contenido de
+knowledge_base.json + la configuración de tokenización, así que solo se
+reconstruye cuando alguno de los dos cambia.
+
+Construcción offline: ver agents/build_index.py
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+# Subir cuando cambie el formato de los arrays persistidos
+INDEX_FORMAT_VERSION = 3
+
+MANIFEST_FILE = 'manifest.json'
+
+
+def default_index_dir() -> str:
+    """Directorio del artefacto: RAG_INDEX_DIR o .rag_index junto a knowledge_base.json"""
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    return os.getenv('RAG_INDEX_DIR', os.path.join(base_path, '.rag_index'))
+
+
+def index_key(kb_bytes: bytes, fingerprint: dict) -> str:
+    """Hash del contenido de la base + configuración del pipeline de indexado"""
+    h = hashlib.sha256()
+    h.update(kb_bytes)
+    h.update(json.dumps({'format': INDEX_FORMAT_VERSION, **fingerprint},
+                        sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    return h.hexdigest()[:16]
+
+
+def save_index(index_dir: str, key: str, arrays: Dict[str, np.ndarray], meta: dict):
+    """
+    Escribe el artefacto de forma atómica (directorio temporal + rename)
+    y elimina artefactos de versiones anteriores.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    target = os.path.join(index_dir, key)
+    tmp_dir = tempfile.mkdtemp(prefix=f'{key}.tmp-', dir=index_dir)
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_dir, f'{name}.npy'), np.ascontiguousarray(array))
+        with open(os.path.join(tmp_dir, MANIFEST_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'format': INDEX_FORMAT_VERSION,
+                       'arrays': sorted(arrays), **meta}, f, ensure_ascii=False)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.rename(tmp_dir, target)
+    except OSError:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not os.path.isdir(target):
+            raise
+
+    # Limpiar artefactos de hashes anteriores
+    for entry in os.listdir(index_dir):
+        path = os.path.join(index_dir, entry)
+        if entry != key and '.tmp-' not in entry and os.path.isdir(path):
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def load_index(index_dir: str, key: str, mmap: bool = True
+               ) -> Optional[Tuple[Dict[str, np.ndarray], dict]]:
+    """Carga el artefacto para `key` (arrays memory-mapped). None si no existe o es inválido."""
+    target = os.path.join(index_dir, key)
+    manifest_path = os.path.join(target, MANIFEST_FILE)
+    if not os.path.isfile(manifest_path):
+        return None
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format') != INDEX_FORMAT_VERSION or meta.get('key') != key:
+            return None
+        arrays = {name: np.load(os.path.join(target, f'{name}.npy'),
+                                mmap_mode='r' if mmap else None)
+                  for name in meta['arrays']}
+    except (OSError, ValueError, KeyError) as e:
+        print(f"[RAG] Artefacto de índice inválido en {target}: {e}")
+        return None
+    return arrays, meta
@@ -0,0 +1,127 @@
+"""
+Clasificador local de intención (productos / objeciones / argumentos), solo numpy.
+
+Regresión logística multinomial sobre los vectores TF-IDF del motor RAG: el
+mensaje se analiza con el mismo pipeline que la búsqueda (normalización, typos,
+raíces) y se pondera con el IDF del índice. Las raíces que solo aparecen en los
+ejemplos etiquetados tienen columna propia (con el IDF máximo). Se entrena al
+arrancar en milisegundos y da una probabilidad por intención, de modo que el
+LLM solo hace falta para los mensajes dudosos.
+"""
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Sequence, Tuple, Union
+import numpy as np
+
+from .rag_engine import AnalyzedQuery, RAGEngine
+
+
+@dataclass(frozen=True)
+class IntentPrediction:
+    """Intención más probable, su probabilidad y la de cada intención"""
+    intent: str
+    probability: float
+    probabilities: Dict[str, float]
+
+
+class IntentClassifier:
+    """Regresión logística multinomial (softmax) entrenada por descenso de gradiente"""
+
+    EPOCHS = 400
+    LEARNING_RATE = 4.0
+    L2 = 1e-3
+
+    def __init__(self, rag: RAGEngine, intents: Sequence[str]):
+        self.rag = rag                      # Vocabulario e IDF de esta versión del índice
+        self.intents = list(intents)
+        self.extra_terms: Dict[str, int] = {}   # Raíces fuera del vocabulario del índice (solo ejemplos)
+        self.weights = np.zeros((len(rag.word_to_idx), len(self.intents)))
+        self.bias = np.zeros(len(self.intents))
+
+    def _features(self, query: Union[str, AnalyzedQuery], grow: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Vector TF-IDF disperso (ids, valores) con norma L2 = 1"""
+        n_vocab = len(self.rag.word_to_idx)
+        counts: Counter = Counter()
+        for stem in self.rag.analyze(query).stems:
+            index = self.rag.word_to_idx.get(stem)
+            if index is None:
+                index = self.extra_terms.get(stem)
+                if index is None:
+                    if not grow:
+                        continue
+                    index = self.extra_terms[stem] = n_vocab + len(self.extra_terms)
+            counts[index] += 1
+        ids = np.fromiter(counts, dtype=np.int64, count=len(counts))
+        values = np.fromiter(counts.values(), dtype=np.float64, count=len(counts))
+        max_idf = float(self.rag.idf.max()) if n_vocab else 1.0
+        known = ids < n_vocab
+        values[known] *= self.rag.idf[ids[known]]
+        values[~known] *= max_idf
+        norm = np.linalg.norm(values)
+        return ids, values / norm if norm else values
+
+    def fit(self, texts: Sequence[str], labels: Sequence[str]) -> "IntentClassifier":
+        """Entrena con pesos por clase inversos a su frecuencia (clases equilibradas)"""
+        features = [self._features(text, grow=True) for text in texts]
+        n_samples, n_classes = len(texts), len(self.intents)
+        n_features = len(self.rag.word_to_idx) + len(self.extra_terms)
+        # Matriz de entrenamiento en COO: muestra, columna y valor de cada entrada
+        rows = np.repeat(np.arange(n_samples), [len(ids) for ids, _ in features])
+        cols = np.concatenate([ids for ids, _ in features]) if features else np.zeros(0, dtype=np.int64)
+        vals = np.concatenate([values for _, values in features]) if features else np.zeros(0)
+
+        y = np.array([self.intents.index(label) for label in labels], dtype=np.int64)
+        targets = np.zeros((n_samples, n_classes))
+        targets[np.arange(n_samples), y] = 1.0
+        class_counts = np.bincount(y, minlength=n_classes)
+        sample_weights = (n_samples / (n_classes * np.maximum(class_counts, 1)))[y] / max(n_samples, 1)
+
+        self.weights = np.zeros((n_features, n_classes))
+        self.bias = np.zeros(n_classes)
+        for _ in range(self.EPOCHS):
+            logits = self._logits(rows, cols, vals, n_samples)
+            residual = (self._softmax(logits) - targets) * sample_weights[:, None]
+            gradient = np.stack([np.bincount(cols, weights=vals * residual[rows, c], minlength=n_features)
+                                 for c in range(n_classes)], axis=1)
+            self.weights -= self.LEARNING_RATE * (gradient + self.L2 * self.weights)
+            self.bias -= self.LEARNING_RATE * residual.sum(axis=0)
+        return self
+
+    def _logits(self, rows: np.ndarray, cols: np.ndarray, vals: np.ndarray, n_samples: int) -> np.ndarray:
+        contributions = vals[:, None] * self.weights[cols]
+        return np.stack([np.bincount(rows, weights=contributions[:, c], minlength=n_samples)
+                         for c in range(len(self.intents))], axis=1) + self.bias
+
+    @staticmethod
+    def _softmax(logits: np.ndarray) -> np.ndarray:
+        exp = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+    def predict_proba(self, query: Union[str, AnalyzedQuery]) -> np.ndarray:
+        """Probabilidad de cada intención (en el orden de self.intents)"""
+        ids, values = self._features(query)
+        return self._softmax(values @ self.weights[ids] + self.bias)
+
+    def predict(self, query: Union[str, AnalyzedQuery]) -> IntentPrediction:
+        probabilities = self.predict_proba(query)
+        best = int(np.argmax(probabilities))
+        return IntentPrediction(
+            intent=self.intents[best],
+            probability=float(probabilities[best]),
+            probabilities={intent: float(p) for intent, p in zip(self.intents, probabilities)},
+        )
+
+    @staticmethod
+    def training_set(qa_pairs: Sequence, category_intents: Dict[str, str],
+                     examples: Dict[str, List[str]]) -> Tuple[List[str], List[str]]:
+        """Preguntas de la base etiquetadas por su categoría + ejemplos etiquetados a mano"""
+        texts, labels = [], []
+        for qa in qa_pairs:
+            intent = category_intents.get(qa['categoria'])
+            if intent is not None:
+                texts.append(qa['pregunta'])
+                labels.append(intent)
+        for intent, messages in examples.items():
+            texts.extend(messages)
+            labels.extend([intent] * len(messages))
+        return texts, labels
@@ -1,15 +1,22 @@
 """
 Orquestador - Detecta intención y delega al agente apropiado
 """
+import asyncio
+import json
 import os
-import re
-from typing import Optional, Tuple
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Union
 from openai import AsyncOpenAI
 
 from .agent_productos import AgenteProductos
 from .agent_objeciones import AgenteObjeciones
 from .agent_argumentos import AgenteArgumentos
 from .base_agent import BaseAgent
+from .intent_classifier import IntentClassifier, IntentPrediction
+from .pattern_matcher import MultiPatternMatcher
+from .prompts import PromptLibrary
+from .rag_engine import AnalyzedQuery, RAGEngine, add_domain_seed_phrases, add_reload_hook, get_rag_engine, run_retrieval
 
 
 # Modelo LLM
@@ -29,6 +36,30 @@ def get_llm_client():
     return _llm_client
 
 
+@dataclass(frozen=True)
+class IntentRuleMatch:
+    """
+    Resultado de la clasificación por reglas.
+
+    `hits` tiene los patrones que aparecieron, por intención (solo las que tienen
+    alguno). `confidence` es la fracción de patrones disparados que apoyan la
+    intención elegida: 1.0 si no hay señales en conflicto, 0.0 si no disparó
+    ninguno (productos por defecto).
+    """
+    intent: str
+    hits: Dict[str, Tuple[str, ...]] = field(default_factory=dict)
+
+    @property
+    def counts(self) -> Dict[str, int]:
+        """Patrones disparados por intención"""
+        return {intent: len(patterns) for intent, patterns in self.hits.items()}
+
+    @property
+    def confidence(self) -> float:
+        total = sum(len(patterns) for patterns in self.hits.values())
+        return len(self.hits.get(self.intent, ())) / total if total else 0.0
+
+
 class Orchestrator:
     """
     Orquestador del sistema multi-agente.
@@ -77,14 +108,96 @@ REGLAS:
 
 Responde SOLO con una palabra: productos, objeciones o argumentos"""
 
+    # Clasificador local: ejemplos etiquetados y confianza mínima para no consultar al LLM
+    INTENT_EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'intent_examples.json')
+    LLM_FALLBACK_CONFIDENCE = float(os.getenv('INTENT_LLM_FALLBACK', '0.6'))   # 0 = nunca llamar al LLM
+    # Búsqueda especulativa: recuperar para todos los agentes mientras se clasifica
+    SPECULATIVE_RETRIEVAL = os.getenv('SPECULATIVE_RETRIEVAL', '1') != '0'
+
     def __init__(self):
         self.agents = {
             name: agent_class()
             for name, agent_class in self.AGENT_MAP.items()
         }
         self.default_agent = "productos"
+        self.prompts = PromptLibrary(self.agents)   # Prefijos de sistema estáticos, renderizados una vez
+        self._report_category_coverage()
+        self._classifier = self.train_intent_classifier(self.rag)
+        add_reload_hook(self._retrain_intent_classifier)
+
+    @property
+    def rag(self):
+        """Versión publicada del motor RAG (cambia tras una recarga de la base)"""
+        return get_rag_engine()
+
+    def analyze(self, message: Union[str, AnalyzedQuery]) -> AnalyzedQuery:
+        """Analiza el mensaje una sola vez para todos los consumidores (reglas, RAG, agentes)"""
+        return self.rag.analyze(message)
+
+    def _report_category_coverage(self):
+        """Informa al arrancar de categorías de agentes sin documentos en la base"""
+        for name, agent in self.agents.items():
+            missing = agent.rag.missing_categories(agent.categories)
+            if missing:
+                print(f"[RAG] Agente '{name}': categorías sin documentos: {', '.join(missing)}")
+
+    def category_intents(self, overrides: Dict[str, str]) -> Dict[str, str]:
+        """
+        Categoría de la base → intención: la del único agente que la declara, o la
+        del agente con su mismo nombre; `overrides` resuelve las compartidas.
+        """
+        owners: Dict[str, set] = {}
+        for name, agent in self.agents.items():
+            for category in agent.categories:
+                owners.setdefault(category, set()).add(name)
+        mapping = {category: next(iter(names)) for category, names in owners.items() if len(names) == 1}
+        mapping.update({name: name for name in self.agents})
+        mapping.update(overrides)
+        return mapping
+
+    def train_intent_classifier(self, rag: RAGEngine) -> IntentClassifier:
+        """Entrena el clasificador local sobre una versión del índice"""
+        start = time.perf_counter()
+        with open(self.INTENT_EXAMPLES_PATH, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        category_intents = self.category_intents(data.get('categories', {}))
+        texts, labels = IntentClassifier.training_set(rag.qa_pairs, category_intents, data['examples'])
+        classifier = IntentClassifier(rag, list(self.AGENT_MAP)).fit(texts, labels)
+        unlabeled = sorted(set(rag.get_categories()) - set(category_intents))
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"[INTENT] Clasificador local: {len(texts)} ejemplos en {elapsed:.1f} ms"
+              + (f" (categorías sin intención: {', '.join(unlabeled)})" if unlabeled else ""))
+        return classifier
+
+    def _retrain_intent_classifier(self, rag: RAGEngine):
+        """Hook de recarga: reentrena con la versión nueva antes de publicarla y la sustituye de una vez"""
+        self._classifier = self.train_intent_classifier(rag)
+
+    @property
+    def intent_classifier(self) -> IntentClassifier:
+        """Clasificador local de la última versión del índice (reload_rag_engine lo reentrena)"""
+        return self._classifier
+
+    def predict_intent(self, message: Union[str, AnalyzedQuery]) -> IntentPrediction:
+        """Intención con el clasificador local (sin llamadas externas) y su probabilidad"""
+        return self.intent_classifier.predict(self.analyze(message))
+
+    async def classify_intent(self, message: Union[str, AnalyzedQuery]) -> str:
+        """
+        Clasifica la intención con el clasificador local; el LLM solo se consulta
+        si la probabilidad queda por debajo de LLM_FALLBACK_CONFIDENCE.
 
-    async def classify_intent(self, message: str) -> str:
+        Returns:
+            str: 'productos', 'objeciones' o 'argumentos'
+        """
+        analyzed = self.analyze(message)
+        prediction = self.predict_intent(analyzed)
+        if self.LLM_FALLBACK_CONFIDENCE <= 0 or prediction.probability >= self.LLM_FALLBACK_CONFIDENCE:
+            return prediction.intent
+        print(f"[INTENT] Confianza baja ({prediction.intent}: {prediction.probability:.2f}), consultando LLM")
+        return await self.classify_intent_llm(analyzed.raw)
+
+    async def classify_intent_llm(self, message: str) -> str:
         """
         Clasifica la intención del usuario usando el LLM.
 
@@ -146,28 +259,42 @@ Responde SOLO con una palabra: productos, objeciones o argumentos"""
         r'\bespecialista\b', r'\bespecialidad\b',
     ]
 
-    def classify_intent_rules(self, message: str) -> str:
+    # Todos los patrones compilados en una sola regex (se evalúa una vez por mensaje)
+    RULE_MATCHER = MultiPatternMatcher({
+        "objeciones": OBJECTION_PATTERNS,
+        "argumentos": ARGUMENT_PATTERNS,
+    })
+
+    def match_intent_rules(self, message: Union[str, AnalyzedQuery]) -> IntentRuleMatch:
         """
-        Clasificación contextual en 2 fases.
+        Clasificación contextual en 2 fases, con todos los patrones que dispararon.
 
         Fase 1: Detecta estructura de OBJECIÓN (rechazo/resistencia explícita).
         Fase 2: Detecta estructura de ARGUMENTO (venta/especialidad).
         Default: PRODUCTOS (temas médicos, info técnica, dudas generales).
         """
-        message_lower = message.lower()
+        hits = self.RULE_MATCHER.find(self.analyze(message).lower)
 
-        # Fase 1: ¿Hay rechazo/resistencia explícita?
-        for pattern in self.OBJECTION_PATTERNS:
-            if re.search(pattern, message_lower):
-                return "objeciones"
-
-        # Fase 2: ¿Hay contexto de venta/especialidad?
-        for pattern in self.ARGUMENT_PATTERNS:
-            if re.search(pattern, message_lower):
-                return "argumentos"
+        # Fase 1 antes que fase 2: el rechazo explícito manda aunque haya contexto de venta
+        for intent in ("objeciones", "argumentos"):
+            if intent in hits:
+                return IntentRuleMatch(intent, hits)
 
         # Default: productos (incluye temas médicos, dudas, info técnica)
-        return "productos"
+        return IntentRuleMatch("productos", hits)
+
+    def classify_intent_rules(self, message: Union[str, AnalyzedQuery]) -> str:
+        """Intención por reglas: 'productos', 'objeciones' o 'argumentos'"""
+        return self.match_intent_rules(message).intent
+
+    def search_candidates(self, message: Union[str, AnalyzedQuery],
+                          top_k: int = 5) -> Dict[str, List[Tuple[dict, float]]]:
+        """
+        Resultados de search_knowledge de cada agente con una sola pasada de scoring
+        (cada agente filtra por sus categorías sobre los mismos scores).
+        """
+        scopes = {name: agent.categories or None for name, agent in self.agents.items()}
+        return self.rag.search_scopes(message, scopes, top_k=top_k)
 
     def get_agent(self, agent_name: str) -> BaseAgent:
         """Obtiene una instancia del agente especificado."""
@@ -185,22 +312,34 @@ Responde SOLO con una palabra: productos, objeciones o argumentos"""
         Args:
             message: Mensaje del usuario
             history: Historial de conversación
-            use_llm_classification: Si usar LLM para clasificar (más preciso pero más lento)
+            use_llm_classification: Si usar el clasificador local (con LLM para los mensajes dudosos) en vez de las reglas
 
         Returns:
             Tuple[intent, agent, context]: Intención detectada, agente usado y contexto RAG
         """
-        # Clasificar intención
-        if use_llm_classification:
-            intent = await self.classify_intent(message)
+        analyzed = self.analyze(message)
+
+        if use_llm_classification and self.SPECULATIVE_RETRIEVAL:
+            # La búsqueda de todos los candidatos corre en el executor mientras se clasifica
+            # (la espera del LLM, si hace falta, ya no retrasa la recuperación); se usa la del ganador
+            intent, candidates = await asyncio.gather(
+                self.classify_intent(analyzed),
+                run_retrieval(self.search_candidates, analyzed, 5),
+            )
+            agent = self.get_agent(intent)
+            results = candidates.get(intent, candidates[self.default_agent])
         else:
-            intent = self.classify_intent_rules(message)
+            # Clasificar intención
+            if use_llm_classification:
+                intent = await self.classify_intent(analyzed)
+            else:
+                intent = self.classify_intent_rules(analyzed)
 
-        # Obtener agente
-        agent = self.get_agent(intent)
+            # Obtener agente
+            agent = self.get_agent(intent)
 
-        # Buscar contexto relevante
-        results = agent.search_knowledge(message, top_k=5)
+            # Buscar contexto relevante
+            results = agent.search_knowledge(analyzed, top_k=5)
         context = agent.format_context(results, min_score=0.1)
 
         return intent, agent, context
@@ -300,6 +439,11 @@ Responde basándote en el contexto anterior. Si no tienes información específi
         return response.choices[0].message.content, intent, agent.name
 
 
+# Las frases de las reglas de intención son consultas del dominio aunque no estén en la base
+# ("no funciona", "efectos secundarios"): semilla del léxico de detección de mensajes vagos
+add_domain_seed_phrases(Orchestrator.RULE_MATCHER.literal_phrases())
+
+
 # Singleton del orquestador
 _orchestrator_instance = None
 
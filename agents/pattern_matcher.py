@@ -0,0 +1,64 @@
+"""
+Matcher de múltiples patrones regex en una sola pasada.
+
+Los patrones de todos los grupos (p. ej. intenciones) se compilan en una única
+regex: cada patrón va dentro de un lookahead con grupo con nombre, así que una
+coincidencia no consume texto y finditer visita cada posición en la que empieza
+algún patrón. En esas pocas posiciones se comprueban también los patrones
+posteriores de la alternancia, de modo que se informan TODOS los patrones que
+aparecen en el texto (lo mismo que re.search uno a uno), no solo el primero.
+"""
+import re
+from typing import Dict, List, Sequence, Tuple
+
+
+def regex_literal(pattern: str) -> str:
+    """
+    Texto de ejemplo que casa con un patrón sencillo: sin anclas, con la primera
+    opción de cada clase de caracteres o grupo y los comodines como espacios
+    (r'\\bno (?:le |me )?convence\\b' → 'no le convence', r'\\befecto.? secundario' →
+    'efecto secundario').
+    """
+    text = re.sub(r'\\[bBsS][*+?]?', ' ', pattern)
+    text = re.sub(r'\[(.)[^\]]*\]', r'\1', text)
+    text = re.sub(r'\(\?:([^|)]*)[^)]*\)\??', r'\1', text)
+    text = re.sub(r'\.[*+?]?', ' ', text)
+    text = re.sub(r'[?*+^$\\]', '', text)
+    return ' '.join(text.split())
+
+
+class MultiPatternMatcher:
+    """Grupos de patrones → qué patrones de cada grupo aparecen en un texto"""
+
+    def __init__(self, groups: Dict[str, Sequence[str]]):
+        # Orden global de los patrones: el de los grupos y, dentro de cada uno, el de la lista
+        self.entries: List[Tuple[str, str]] = [(group, pattern) for group, patterns in groups.items()
+                                               for pattern in patterns]
+        self.groups = list(groups)
+        self.compiled = [re.compile(pattern) for _, pattern in self.entries]
+        # El \b inicial común se saca fuera de la alternancia: solo se prueba en límites de palabra
+        shared = '\\b' if self.entries and all(p.startswith('\\b') for _, p in self.entries) else ''
+        alternatives = '|'.join(f'(?=(?P<p{i}>{pattern[len(shared):]}))'
+                                for i, (_, pattern) in enumerate(self.entries))
+        self.combined = re.compile(f'{shared}(?:{alternatives})')
+
+    def literal_phrases(self) -> List[str]:
+        """Texto de ejemplo de cada patrón (regex_literal), en el orden declarado"""
+        return [regex_literal(pattern) for _, pattern in self.entries]
+
+    def find(self, text: str) -> Dict[str, Tuple[str, ...]]:
+        """Patrones que aparecen en el texto, por grupo (solo grupos con alguno), en el orden declarado"""
+        fired = set()
+        for match in self.combined.finditer(text):
+            first = int(match.lastgroup[1:])
+            fired.add(first)
+            position = match.start()
+            # En la misma posición pueden empezar otros patrones posteriores de la alternancia
+            for index in range(first + 1, len(self.compiled)):
+                if index not in fired and self.compiled[index].match(text, position):
+                    fired.add(index)
+        hits: Dict[str, Tuple[str, ...]] = {}
+        for index in sorted(fired):
+            group, pattern = self.entries[index]
+            hits[group] = hits.get(group, ()) + (pattern,)
+        return hits
@@ -0,0 +1,220 @@
+"""
+Prompt de sistema del chat, pre-renderizado por (agente, cobertura RAG, modo de respuesta).
+
+Todo lo estático va al principio: anti-fabricación, prompt del agente,
+instrucción de cobertura y formato. Se renderiza una sola vez al arrancar y es
+idéntico byte a byte entre peticiones, así que la caché de prompts del
+proveedor lo reutiliza. Lo dinámico va después, en este orden: historial,
+hechos verificados de la búsqueda (con el enriquecimiento del agente),
+instrucción de continuidad y mensaje del usuario. Con ese orden, el prefijo de
+un turno (prompt estático + historial) también es prefijo del siguiente.
+"""
+from typing import Dict, List, Mapping, Sequence, Tuple
+
+from .base_agent import BaseAgent
+
+COVERAGES = ('low', 'medium', 'high')
+RESPONSE_MODES = ('short', 'full')      # Cualquier otro modo se trata como "full"
+
+# Regla #1: va AL INICIO del prompt
+ANTI_FABRICATION = (
+    "══════════════════════════════════════════\n"
+    "REGLA #1 — LA MÁS IMPORTANTE DE TODAS:\n"
+    "══════════════════════════════════════════\n"
+    "USA SOLO datos de la sección 'DATOS VERIFICADOS DE NOVACUTAN' de abajo.\n"
+    "- NO inventes cifras (mg, %, ratios) ni estudios que no estén en los datos verificados.\n"
+    "- NO menciones productos que no aparezcan en los datos verificados.\n"
+    "- Si una sección de tu formato NO tiene datos verificados disponibles → OMITE esa sección ENTERA. No la incluyas.\n"
+    "- NUNCA pongas '—', 'No disponible', 'Consultar ficha técnica' ni celdas vacías. Si no hay dato, no pongas la fila/sección.\n"
+    "- SÍ usa técnicas de persuasión (FAB, SPIN, Feel-Felt-Found, storytelling) con los datos que SÍ tienes.\n"
+    "- Presenta los datos verificados de forma COMPLETA, ÚTIL y PERSUASIVA para que el representante pueda vender con confianza.\n"
+    "══════════════════════════════════════════\n\n"
+)
+
+# Instrucciones según cobertura RAG (los hechos verificados van después, "abajo")
+RAG_INSTRUCTIONS = {
+    'low': """⚠️ COBERTURA RAG: BAJA — Hay poca información específica para esta consulta.
+
+REGLAS:
+1. Respuesta CORTA (máximo 150 palabras). No generes un argumentario completo.
+2. NO inventes cifras, porcentajes ni datos específicos.
+3. SÍ puedes mencionar consenso médico general sin cifras exactas (ej: "El ácido hialurónico reticulado con DVS ofrece mayor estabilidad y menor edema").
+4. Si HAY algún dato relevante en el contexto RAG de abajo (aunque sea tangencial), úsalo — son datos verificados de Novacutan.
+5. Redirige al usuario hacia temas que SÍ puedes cubrir con preguntas sugeridas.
+6. NO muestres secciones vacías ni uses placeholders.
+
+FORMATO para cobertura baja:
+## [Tema consultado]
+
+[Si hay datos RAG relevantes, preséntalos de forma útil y persuasiva]
+
+[1-2 frases de consenso médico general SIN cifras inventadas si aplica]
+
+**Te puedo ayudar con:**
+- [Pregunta sugerida 1 sobre productos/protocolos de Novacutan]
+- [Pregunta sugerida 2]
+- [Pregunta sugerida 3]""",
+    'medium': """⚠️ COBERTURA RAG: PARCIAL — Los datos verificados de abajo son limitados.
+
+REGLAS OBLIGATORIAS:
+1. Usa SOLO la información de los HECHOS VERIFICADOS de abajo.
+2. NO añadas datos externos. Si necesitas mencionar algo fuera del contexto, di "según consenso médico general" SIN cifras.
+3. Si una sección de tu formato no tiene datos verificados, OMÍTELA entera. No incluyas tablas con celdas vacías ni secciones sin contenido real.
+4. Aprovecha al MÁXIMO los datos que SÍ tienes: preséntelos de forma persuasiva, clara y útil para vender.
+5. PROHIBIDO EXTRAPOLAR INDICACIONES: Si un producto aparece en los datos verificados con indicación X, NO lo recomiendes para indicación Y. Solo recomienda cada producto para las indicaciones que EXPLÍCITAMENTE aparecen en los datos verificados. Ejemplo: si un producto está indicado para "flacidez facial", NO lo recomiendes para relleno labial a menos que los datos verificados digan EXPLÍCITAMENTE que tiene esa indicación.
+6. Menciona SOLO los productos que tengan indicación EXPLÍCITA para la condición consultada en los datos verificados.""",
+    'high': """COBERTURA RAG: ALTA — Tienes buenos datos verificados abajo.
+Responde EXCLUSIVAMENTE con los datos verificados. NO complementes con conocimiento externo.
+Si alguna sección de tu formato no tiene datos verificados, OMÍTELA — no dejes huecos ni placeholders.
+Presenta TODA la información disponible de forma persuasiva, completa y útil para que el representante venda con confianza.
+PROHIBIDO EXTRAPOLAR INDICACIONES: Recomienda cada producto SOLO para las indicaciones que aparecen EXPLÍCITAMENTE en los datos verificados. No atribuyas indicaciones nuevas a un producto existente.""",
+}
+
+# Formato resumido adaptado a cada agente — preserva los elementos de diseño clave
+SHORT_FORMATS = {
+    'productos': """MODO RESUMIDO — Usa EXACTAMENTE este formato reducido (markdown):
+
+## [Nombre del producto o tema]
+
+| Parámetro | Valor |
+|-----------|-------|
+| (los 3-4 datos más importantes: composición, volumen, reticulante, zona) |
+
+**Indicación principal**: Una frase directa con FAB.
+
+**Protocolo**: Técnica y sesiones en una línea.
+
+**Dato diferenciador**
+> Frase clave FAB que el representante puede usar literalmente con el médico. OBLIGATORIO.
+
+REGLAS DE MODO RESUMIDO:
+- Máximo 200-250 palabras totales.
+- La tabla, la indicación FAB y el dato diferenciador (blockquote) son OBLIGATORIOS.
+- NO incluyas evidencia clínica, caso clínico ni secciones adicionales.
+- El dato diferenciador SIEMPRE debe ser un blockquote (>) con una frase memorable.""",
+    'objeciones': """MODO RESUMIDO — Usa EXACTAMENTE este formato reducido (markdown):
+
+## Objeción: "[Resumen breve]"
+
+### Reconocimiento
+> Frase empática Feel-Felt-Found condensada en 2 líneas máximo.
+
+### Datos clave
+| Dato | Valor |
+|------|-------|
+| (2-3 datos que desmonta la objeción) |
+
+### Reencuadre
+Una frase de Boomerang o aversión a la pérdida. Máximo 2 líneas.
+
+### Guion sugerido
+> "Doctor/a, [frase lista para usar literalmente]." OBLIGATORIO.
+
+REGLAS DE MODO RESUMIDO:
+- Máximo 200-250 palabras totales.
+- La tabla, el reconocimiento y el guion sugerido (blockquote) son OBLIGATORIOS.
+- No incluyas secciones adicionales.""",
+    'argumentos': """MODO RESUMIDO — Usa EXACTAMENTE este formato reducido (markdown):
+
+## Argumentario: [Especialidad]
+
+### Insight clave
+> Dato sorprendente en 1-2 líneas. OBLIGATORIO.
+
+### Producto recomendado
+| Producto | Dosis | Indicación |
+|----------|-------|------------|
+| (1 producto principal) |
+
+### Argumentos clave
+1. **[Argumento 1]**: Dato concreto en 1 línea.
+2. **[Argumento 2]**: Dato concreto en 1 línea.
+
+### Guion de apertura
+> "Doctor/a, [frase de apertura lista para usar]." OBLIGATORIO.
+
+REGLAS DE MODO RESUMIDO:
+- Máximo 200-250 palabras totales.
+- El insight (blockquote), la tabla y el guion de apertura (blockquote) son OBLIGATORIOS.
+- NO incluyas SPIN, perfil de paciente, caso clínico ni plan de prescripción.""",
+}
+
+EXTENDED_FORMAT = "MODO EXTENDIDO: Responde con el formato completo y detallado según tu estructura habitual."
+
+CONTINUITY_INSTRUCTION = (
+    "CONTINUIDAD CONVERSACIONAL OBLIGATORIA:\n"
+    "El usuario venía hablando sobre: \"{last_question}\"\n"
+    "Su nueva pregunta es un FOLLOW-UP de esa conversación.\n\n"
+    "REGLAS:\n"
+    "1. Tu respuesta DEBE conectar temáticamente con lo anterior. "
+    "Si antes hablaban de precio y ahora preguntan sobre duración, "
+    "conecta ambos temas (ej: el coste-beneficio a largo plazo).\n"
+    "2. NO uses frases genéricas como 'En relación con lo anterior...' o "
+    "'Continuando con el tema...'. En su lugar, conecta de forma ESPECÍFICA "
+    "mencionando el tema concreto (ej: 'Precisamente, uno de los argumentos "
+    "más potentes frente a la objeción del precio es el tiempo de respuesta...').\n"
+    "3. NO repitas información ya dada. Amplía, profundiza o conecta con ángulos nuevos.\n"
+    "4. Mantén tono conversacional natural, como un colega que te está explicando algo "
+    "y tú le haces otra pregunta — no como un chatbot que empieza de cero cada vez."
+)
+
+
+def response_mode_key(response_mode: str) -> str:
+    return 'short' if response_mode == 'short' else 'full'
+
+
+def length_instruction(intent: str, coverage: str, response_mode: str) -> str:
+    """Instrucción de formato/longitud (vacía con cobertura baja: el formato corto ya está en su instrucción)"""
+    if coverage == 'low':
+        return ""
+    if response_mode_key(response_mode) == 'short':
+        return SHORT_FORMATS.get(intent, SHORT_FORMATS['argumentos'])
+    return EXTENDED_FORMAT
+
+
+def max_tokens_for(coverage: str, response_mode: str) -> int:
+    """Tokens de respuesta según modo (cobertura baja siempre corto)"""
+    if coverage == 'low':
+        return 400
+    return 500 if response_mode_key(response_mode) == 'short' else 1000
+
+
+def render_prompt_prefix(agent: BaseAgent, intent: str, coverage: str, response_mode: str) -> str:
+    """Parte estática del prompt de sistema (no depende del mensaje)"""
+    prefix = f"{ANTI_FABRICATION}{agent.system_prompt}\n\n---\n{RAG_INSTRUCTIONS[coverage]}"
+    length = length_instruction(intent, coverage, response_mode)
+    return f"{prefix}\n\n{length}" if length else prefix
+
+
+class PromptLibrary:
+    """Prefijos de sistema pre-renderizados para cada (intención, cobertura, modo)"""
+
+    def __init__(self, agents: Mapping[str, BaseAgent]):
+        self.prefixes: Dict[Tuple[str, str, str], str] = {
+            (intent, coverage, mode): render_prompt_prefix(agent, intent, coverage, mode)
+            for intent, agent in agents.items()
+            for coverage in COVERAGES
+            for mode in RESPONSE_MODES
+        }
+
+    def prefix(self, intent: str, coverage: str, response_mode: str) -> str:
+        return self.prefixes[(intent, coverage, response_mode_key(response_mode))]
+
+    def build_messages(self, intent: str, coverage: str, response_mode: str, context: str,
+                       history: Sequence[dict], user_message: str) -> List[dict]:
+        """
+        Mensajes para el LLM: prefijo estático, historial, hechos verificados,
+        continuidad (si hay historial) y mensaje del usuario.
+        """
+        messages = [{"role": "system", "content": self.prefix(intent, coverage, response_mode)}]
+        messages.extend(history)
+        messages.append({"role": "system", "content": context})
+
+        # Instrucción de continuidad conversacional (justo antes del user msg)
+        if history:
+            # Última pregunta del historial para dar contexto explícito
+            last_question = next((h["content"][:120] for h in reversed(history) if h["role"] == "user"), "")
+            messages.append({"role": "system", "content": CONTINUITY_INSTRUCTION.format(last_question=last_question)})
+
+        messages.append({"role": "user", "content": user_message})
+        return messages
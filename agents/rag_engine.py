@@ -2,13 +2,27 @@
 Motor RAG Mejorado - Base de conocimiento compartida por todos los agentes
 v2.0 - Con stemming español, sinónimos y búsqueda híbrida
 """
+import asyncio
+import functools
 import json
 import numpy as np
 from collections import Counter
-from typing import List, Tuple, Optional, Set, Dict
-import math
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Tuple, Optional, Dict, FrozenSet, Iterable, NamedTuple, Sequence, Set, Union
 import os
 import re
+import sys
+import threading
+import time
+
+from .bm25 import BM25FIndex, PostingsView
+from .char_ngrams import CharNgramIndex
+from .corpus import QARecord
+from .fusion import CharNgramScorer, KeywordScorer, Scorer, ScoreFusion, TfidfScorer
+from .index_store import default_index_dir, index_key, load_index, save_index
+from .query_cache import QueryCache
+from .spelling import SpellingIndex
+from .sparse_matrix import CSRMatrix, merge_count_rows, top_k_indices, top_k_indices_rows
 
 
 # ============================================
@@ -120,6 +134,36 @@ INTENT_KEYWORDS: Dict[str, List[str]] = {
     'productos': ['biopro', 'fbio', 'light', 'medium', 'volume', 'dvs', 'biomodulador', 'relleno'],
 }
 
+# Palabras vacías que no se indexan ni se buscan
+STOPWORDS = {
+    'el', 'la', 'los', 'las', 'de', 'del', 'en', 'un', 'una',
+    'y', 'a', 'que', 'es', 'por', 'para', 'con', 'se', 'su',
+    'al', 'lo', 'como', 'mas', 'pero', 'sus', 'le', 'ya', 'o',
+    'que', 'como', 'cual', 'cuales', 'donde', 'cuando', 'si',
+    'no', 'muy', 'sin', 'sobre', 'este', 'esta', 'esto', 'eso',
+    'mi', 'tu', 'me', 'te', 'nos', 'les', 'tiene', 'hay'
+}
+
+# Palabras que aparecen en preguntas de la base pero no indican tema del dominio
+# (saludos, cortesía, peticiones genéricas): no cuentan para el léxico de dominio
+CONVERSATIONAL_WORDS = {
+    'hola', 'buenas', 'buenos', 'dias', 'tardes', 'noches', 'gracias', 'adios', 'hasta', 'luego',
+    'tal', 'bien', 'vale', 'okay', 'perfecto', 'genial', 'quien', 'eres', 'puedes', 'puede',
+    'puedo', 'hacer', 'hace', 'hago', 'necesito', 'necesita', 'quiero', 'quiere', 'ayuda',
+    'ayudar', 'ayudame', 'saber', 'dame', 'dime', 'decir', 'digo', 'algo', 'cosa', 'pregunta',
+    'muchas', 'muchisimas', 'test', 'prueba', 'probando', 'oyes', 'estas', 'estoy',
+    'hoy', 'tiempo', 'hora', 'cuanto', 'cuantos', 'anos',
+}
+
+# Frases semilla del léxico de dominio: vocabulario de ficha técnica, técnica de inyección y
+# visita médica que la base no escribe en las preguntas, y las que registran otros módulos
+# (add_domain_seed_phrases)
+DOMAIN_SEED_PHRASES: List[str] = [
+    'composición', 'ingredientes', 'ficha técnica', 'prospecto', 'dosis', 'indicaciones',
+    'concentración', 'marcado CE', 'fanning', 'supraperióstico', 'prescriptor', 'visita médica',
+    'visita', 'representante', 'venta', 'vender',
+]
+
 # Frases de consulta comunes que mapean a preguntas específicas de la KB
 QUERY_PATTERNS: Dict[str, List[str]] = {
     'protocolo': ['cómo se aplica', 'como se aplica', 'protocolo v-lift', 'protocolo d-lift',
@@ -129,31 +173,331 @@ QUERY_PATTERNS: Dict[str, List[str]] = {
 }
 
 
+class DocumentFields(NamedTuple):
+    """Campos normalizados y tokenizados de un QA pair (precalculados al cargar)"""
+    pregunta_norm: str
+    respuesta_norm: str
+    pregunta_tokens: Tuple[str, ...]
+    respuesta_tokens: Tuple[str, ...]
+    tokens: FrozenSet[str]
+    stems: FrozenSet[str]
+
+
+class AnalyzedQuery(NamedTuple):
+    """
+    Mensaje del usuario analizado UNA sola vez y compartido por todos los consumidores
+    (detección de saludo, clasificador de reglas, RAG y enriquecimiento de agentes).
+    """
+    raw: str                           # Texto original
+    lower: str                         # Minúsculas (con acentos)
+    normalized: str                    # Minúsculas, sin acentos, alias de producto unificados
+    tokens: Tuple[str, ...]            # Tokens sin stopwords ni stemming
+    stems: Tuple[str, ...]             # Tokens con stemming
+    aliases: Tuple[str, ...]           # Nombres de producto canónicos detectados por alias
+    corrections: Tuple[Tuple[str, str], ...] = ()  # Typos corregidos: (token original, término del índice)
+
+
 class RAGEngine:
     """Motor de búsqueda RAG mejorado con stemming, sinónimos y búsqueda híbrida"""
 
-    def __init__(self, knowledge_base_path: str):
-        self.qa_pairs = []
-        self.embeddings = []
-        self.vocab = []
-        self.word_to_idx = {}
-        self.idf = {}
-        self.stemmer = SpanishStemmer()
+    # Parámetros BM25F: la pregunta pesa más que la respuesta (antes era un boost aparte)
+    BM25_K1 = 1.2
+    BM25_FIELD_WEIGHTS = {'pregunta': 3.0, 'respuesta': 1.0}
+    BM25_FIELD_B = {'pregunta': 0.5, 'respuesta': 0.75}
+
+    # Palabras clave de alta importancia (boost extra en keywords)
+    HIGH_VALUE_TERMS = {'biopro', 'fbio', 'dvs', '3dvs', 'biomodulador',
+                        'lifting', 'relleno', 'protocolo', 'precio'}
 
-        # Índice invertido para búsqueda por keywords
-        self.keyword_index: Dict[str, Set[int]] = {}
+    # Léxico de dominio (mensajes vagos): términos de las respuestas que entran y prefijo de palabras largas
+    ANSWER_TERM_MIN_SENTENCES = 2       # Frases con un término ancla en que aparece el término
+    ANSWER_TERM_MIN_RATIO = 0.5         # Parte de sus frases que nombran un término ancla
+    DOMAIN_PREFIX_CHARS = 8
 
+    # Canal de n-gramas de caracteres (transcripciones de voz con nombres deformados)
+    NGRAM_DIM = 2048
+    NGRAM_SIZES = (3, 4)
+    NGRAM_QUANTIZATION = os.getenv('RAG_NGRAM_QUANTIZATION', 'float32')   # 'int8': ~30 % menos memoria del canal
+
+    # Búsqueda aproximada (IVF) en el canal de n-gramas: 'exact', 'ivf' o 'auto' (IVF desde ANN_MIN_DOCS documentos)
+    ANN_MODE = os.getenv('RAG_ANN', 'auto')
+    ANN_MIN_DOCS = 20000
+    ANN_N_PROBE = int(os.getenv('RAG_ANN_NPROBE', '8'))   # Listas visitadas por query: más = más recall y latencia
+
+    # memory_report proyecta la memoria a una base MEMORY_PROJECTION_FACTOR veces mayor: lineal por
+    # documento, salvo vocabularios y corrector (crecen de forma sublineal y se dejan fijos)
+    MEMORY_PROJECTION_FACTOR = 100
+    MEMORY_FIXED_COMPONENTS = ('vocabulary', 'spelling')
+
+    # Corrección de typos en tokens fuera del vocabulario de keywords (0 = desactivada)
+    SPELL_MAX_DISTANCE = int(os.getenv('RAG_SPELL_DISTANCE', '2'))
+
+    # Fusión de señales: pesos por scorer y método ('weighted' o 'rrf')
+    FUSION_WEIGHTS = {'tfidf': 0.48, 'keywords': 0.32, 'ngrams': 0.2}
+    FUSION_METHOD = os.getenv('RAG_FUSION', 'weighted')
+
+    # Caché de resultados (0 entradas = desactivada)
+    CACHE_SIZE = int(os.getenv('RAG_CACHE_SIZE', '1024'))
+    CACHE_TTL = float(os.getenv('RAG_CACHE_TTL', '3600'))
+
+    # Caracteres de los extremos que no afectan al resultado (se ignoran en la clave de caché)
+    _CACHE_KEY_STRIP = ' \t\n¿?¡!.,;:'
+
+    def __init__(self, knowledge_base_path: str, index_dir: Optional[str] = None,
+                 rebuild_index: bool = False):
+        self._init_state(knowledge_base_path, index_dir)
         self.load_knowledge_base(knowledge_base_path)
-        self.compute_embeddings()
-        self.build_keyword_index()
+        self.build_category_index()
+        if rebuild_index or not self.load_index_artifact():
+            self.build_index()
+            self.save_index_artifact()
+        elif self.ann_active and self.ngrams.ivf is None:
+            self.build_ann_index()
+            self.save_index_artifact()
+        self.build_boost_masks()
+        self.prepare_query_analysis()
+        self.build_synonym_index()
+        self.build_spelling_index()
+        self.build_domain_lexicon()
+
+    def _init_state(self, knowledge_base_path: str, index_dir: Optional[str]):
+        """Estado vacío del motor (compartido por __init__ y reload)"""
+        self.knowledge_base_path = knowledge_base_path
+        self.qa_pairs: List[QARecord] = []
+        self.kb_hash = ""
+        self.version = 1                               # Se incrementa en cada recarga publicada
+        self.tf_counts: Optional[CSRMatrix] = None     # Frecuencias crudas (documentos × vocabulario)
+        self.embeddings: Optional[CSRMatrix] = None    # TF-IDF normalizado (misma estructura, float32)
+        self.word_to_idx: Dict[str, int] = {}          # Vocabulario: única tabla (orden de inserción = id)
+        self.idf = np.zeros(0)
+        self.stemmer = SpanishStemmer()
+
+        # Índice invertido para búsqueda por keywords (término → ids de documento)
+        self.bm25 = BM25FIndex(
+            field_weights=[self.BM25_FIELD_WEIGHTS['pregunta'], self.BM25_FIELD_WEIGHTS['respuesta']],
+            field_b=[self.BM25_FIELD_B['pregunta'], self.BM25_FIELD_B['respuesta']],
+            k1=self.BM25_K1,
+        )
+        self.keyword_index = PostingsView(self.bm25)
+        self.spelling = SpellingIndex(self.SPELL_MAX_DISTANCE)
+        self.domain_terms: FrozenSet[str] = frozenset()
+        self.domain_abbreviations: FrozenSet[str] = frozenset()
+        self.domain_prefixes: FrozenSet[str] = frozenset()
+        self._domain_anchors: FrozenSet[str] = frozenset()
+        self.domain_phrases: FrozenSet[Tuple[str, ...]] = frozenset()
+        self._domain_phrase_lengths: List[int] = []
+
+        # Vectores dispersos de n-gramas de caracteres de cada pregunta
+        self.ngrams = CharNgramIndex(self.NGRAM_DIM, self.NGRAM_SIZES, self.NGRAM_QUANTIZATION)
+        self.ann_mode = self.ANN_MODE
+        self.ann_n_probe = self.ANN_N_PROBE
+
+        # Categorías internadas: código por documento + categoría → filas (para filtrar)
+        self.category_names: List[str] = []
+        self.category_codes = np.zeros(0, dtype=np.int16)
+        self.category_rows: Dict[str, np.ndarray] = {}
+
+        self._static_nbytes: Optional[Dict[str, int]] = None   # caché de memory_report
+
+        # Campos normalizados por documento (solo al construir el índice) y máscaras de boost
+        self.doc_fields: List[DocumentFields] = []
+        self.intent_rows: Dict[str, np.ndarray] = {}
+        self.concentration_masks: Dict[str, np.ndarray] = {}
+
+        self.index_dir = default_index_dir() if index_dir is None else index_dir
+        self.cache = QueryCache(self.CACHE_SIZE, self.CACHE_TTL)
+
+        # Pipeline de scoring: (scorer, peso) + fusión vectorizada
+        self.scorers: List[Tuple[Scorer, float]] = [
+            (TfidfScorer(), self.FUSION_WEIGHTS['tfidf']),
+            (KeywordScorer(), self.FUSION_WEIGHTS['keywords']),
+            (CharNgramScorer(), self.FUSION_WEIGHTS['ngrams']),
+        ]
+        self.fusion = ScoreFusion(self.FUSION_METHOD)
 
     def load_knowledge_base(self, path: str):
-        """Carga la base de conocimiento desde JSON"""
-        with open(path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        self.qa_pairs = data['qa_pairs']
+        """Carga la base de conocimiento desde JSON y calcula su hash de contenido"""
+        self.qa_pairs, self.kb_hash = self._read_knowledge_base(path)
         print(f"[RAG] Cargadas {len(self.qa_pairs)} preguntas")
 
+    def _read_knowledge_base(self, path: str) -> Tuple[List[QARecord], str]:
+        """Lee los QA pairs y el hash de contenido (lanza excepción si el JSON no es válido)"""
+        with open(path, 'rb') as f:
+            raw = f.read()
+        data = json.loads(raw.decode('utf-8'))
+        return [QARecord.from_dict(qa) for qa in data['qa_pairs']], index_key(raw, self._pipeline_fingerprint())
+
+    def _pipeline_fingerprint(self) -> dict:
+        """Configuración que afecta al índice: si cambia, el artefacto se reconstruye"""
+        return {
+            'stopwords': sorted(STOPWORDS),
+            'suffixes': SpanishStemmer.SUFFIXES,
+            'exceptions': sorted(SpanishStemmer.EXCEPTIONS),
+            'aliases': self.PRODUCT_ALIASES,
+            'bm25': [self.BM25_K1, self.BM25_FIELD_WEIGHTS, self.BM25_FIELD_B],
+            'ngrams': self.ngrams.fingerprint(),
+        }
+
+    def build_index(self):
+        """Construye todo el índice desde el texto de la base de conocimiento"""
+        self.prepare_documents()
+        self.compute_embeddings()
+        self.build_keyword_index()
+        self.build_ngram_index()
+        if self.ann_active:
+            self.build_ann_index()
+        self.build_concentration_masks()
+        self.doc_fields = []  # solo hacen falta para construir: no mantener los tokens de todo el corpus
+
+    def export_index(self) -> Tuple[Dict[str, np.ndarray], dict]:
+        """Arrays y metadatos del índice para persistirlo"""
+        arrays = {'tfidf_idf': self.idf}
+        arrays.update(self.tf_counts.to_arrays('tfidf_counts_'))
+        arrays.update(self.embeddings.to_arrays('tfidf_weights_', include_structure=False))
+        arrays.update(self.bm25.to_arrays())
+        arrays.update(self.ngrams.to_arrays())
+        arrays.update({f'mask_{name}': mask for name, mask in self.concentration_masks.items()})
+        meta = {'n_docs': len(self.qa_pairs), 'vocab': self.vocab, 'bm25_terms': self.bm25.terms}
+        return arrays, meta
+
+    def import_index(self, arrays: Dict[str, np.ndarray], meta: dict):
+        """Restaura el índice desde un artefacto (sin tokenizar ni recalcular)"""
+        n_docs = meta['n_docs']
+        self.word_to_idx = {sys.intern(word): idx for idx, word in enumerate(meta['vocab'])}
+        shape = (n_docs, len(self.word_to_idx))
+        self.tf_counts = CSRMatrix.from_arrays(arrays, 'tfidf_counts_', shape)
+        self.embeddings = CSRMatrix.from_arrays(arrays, 'tfidf_weights_', shape, structure=self.tf_counts)
+        self.idf = arrays['tfidf_idf']
+        self.bm25.load_arrays(meta['bm25_terms'], arrays, n_docs)
+        self.ngrams.load_arrays(arrays)
+        self.concentration_masks = {name[len('mask_'):]: arrays[name]
+                                    for name in arrays if name.startswith('mask_')}
+
+    def load_index_artifact(self) -> bool:
+        """Carga el índice persistido si coincide con el hash actual de la base"""
+        if not self.index_dir:
+            return False
+        start = time.perf_counter()
+        loaded = load_index(self.index_dir, self.kb_hash)
+        if loaded is None or loaded[1].get('n_docs') != len(self.qa_pairs):
+            return False
+        self.import_index(*loaded)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"[RAG] Índice cargado desde artefacto {self.kb_hash} en {elapsed:.1f} ms "
+              f"({len(self.word_to_idx)} palabras, {len(self.bm25.term_to_id)} términos de keywords)")
+        return True
+
+    def save_index_artifact(self):
+        """Persiste el índice construido (si falla, el motor sigue funcionando en memoria)"""
+        if not self.index_dir:
+            return
+        try:
+            save_index(self.index_dir, self.kb_hash, *self.export_index())
+            print(f"[RAG] Artefacto de índice guardado: {self.index_dir}/{self.kb_hash}")
+        except OSError as e:
+            print(f"[RAG] No se pudo guardar el artefacto de índice: {e}")
+
+    def reload(self, path: Optional[str] = None) -> Tuple["RAGEngine", Dict[str, int]]:
+        """
+        Crea una NUEVA versión del motor con los cambios de la base de conocimiento.
+
+        Solo se tokenizan los QA pairs añadidos o editados (identificados por `id`);
+        las filas sin cambios se copian de las matrices actuales y después se
+        recalculan IDF, postings y pesos de forma vectorizada. Esta instancia no
+        se modifica, así que las búsquedas en curso terminan sobre ella.
+
+        Returns:
+            (motor, estadísticas). Si el contenido no ha cambiado devuelve self.
+        """
+        path = path or self.knowledge_base_path
+        qa_pairs, kb_hash = self._read_knowledge_base(path)
+        if kb_hash == self.kb_hash:
+            return self, {'added': 0, 'edited': 0, 'removed': 0, 'version': self.version}
+
+        start = time.perf_counter()
+        current = {self._doc_key(qa): (i, qa) for i, qa in enumerate(self.qa_pairs)}
+        sources = np.full(len(qa_pairs), -1, dtype=np.int64)   # fila actual de cada documento (-1 = retokenizar)
+        changed: Dict[int, DocumentFields] = {}
+        added = edited = 0
+        for j, qa in enumerate(qa_pairs):
+            previous = current.pop(self._doc_key(qa), None)
+            if previous is not None and previous[1] == qa:
+                sources[j] = previous[0]
+                continue
+            changed[j] = self._document_fields(qa)
+            if previous is None:
+                added += 1
+            else:
+                edited += 1
+
+        engine = RAGEngine.__new__(RAGEngine)
+        engine._init_state(path, self.index_dir)
+        engine.qa_pairs, engine.kb_hash, engine.version = qa_pairs, kb_hash, self.version + 1
+        engine.cache = self.cache  # la versión forma parte de la clave: las entradas viejas ya no se usan
+        engine.scorers, engine.fusion = self.scorers, self.fusion
+        engine.ann_mode, engine.ann_n_probe = self.ann_mode, self.ann_n_probe
+
+        # TF-IDF: empalmar frecuencias y recalcular IDF + normalización
+        (engine.tf_counts,), vocab = merge_count_rows(
+            [self.tf_counts], self.vocab, sources,
+            {j: [self._stem_counts(f)] for j, f in changed.items()})
+        engine.word_to_idx = {sys.intern(word): idx for idx, word in enumerate(vocab)}
+        engine.derive_tfidf()
+
+        # BM25F: mismas filas, por campo
+        engine.bm25 = self.bm25.updated(sources, {j: self._bm25_fields(f) for j, f in changed.items()})
+        engine.keyword_index = PostingsView(engine.bm25)
+        engine.ngrams = self.ngrams.updated(sources, {j: f.pregunta_norm for j, f in changed.items()})
+        if engine.ann_active and engine.ngrams.ivf is None:
+            engine.build_ann_index()
+
+        # Máscaras de concentración: copiar las filas conservadas y calcular solo las nuevas
+        kept = sources >= 0
+        changed_rows = np.flatnonzero(~kept)
+        new_masks = self._concentration_masks([changed[j] for j in changed_rows])
+        for name, mask in self.concentration_masks.items():
+            merged = np.zeros(len(qa_pairs), dtype=bool)
+            merged[kept] = mask[sources[kept]]
+            merged[changed_rows] = new_masks[name]
+            engine.concentration_masks[name] = merged
+
+        engine.build_category_index()
+        engine.build_boost_masks()
+        engine._synonym_stems = self._synonym_stems
+        engine._synonym_terms = self._synonym_terms
+        engine.build_synonym_index()
+        engine.build_spelling_index()
+        engine.build_domain_lexicon()
+        engine.save_index_artifact()
+
+        stats = {'added': added, 'edited': edited, 'removed': len(current), 'version': engine.version}
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"[RAG] Base recargada (v{engine.version}) en {elapsed:.1f} ms: "
+              f"{added} añadidas, {edited} editadas, {len(current)} eliminadas")
+        return engine, stats
+
+    @staticmethod
+    def _doc_key(qa: QARecord):
+        """Identidad de un QA pair entre versiones de la base"""
+        return qa.get('id', qa['pregunta'])
+
+    def prepare_documents(self):
+        """Normaliza y tokeniza una sola vez los campos de cada QA pair"""
+        self.doc_fields = [self._document_fields(qa) for qa in self.qa_pairs]
+
+    def _document_fields(self, qa: QARecord) -> DocumentFields:
+        pregunta_tokens = tuple(self._tokenize(qa['pregunta'], apply_stemming=False))
+        respuesta_tokens = tuple(self._tokenize(qa['respuesta'], apply_stemming=False))
+        tokens = frozenset(pregunta_tokens + respuesta_tokens)
+        return DocumentFields(
+            pregunta_norm=self._normalize(qa['pregunta']),
+            respuesta_norm=self._normalize(qa['respuesta']),
+            pregunta_tokens=pregunta_tokens,
+            respuesta_tokens=respuesta_tokens,
+            tokens=tokens,
+            stems=frozenset(self.stemmer.stem(t) for t in tokens),
+        )
+
     # Nombres de producto con guion → forma canónica (sin guion)
     PRODUCT_ALIASES = {
         'bio-pro': 'biopro',
@@ -192,148 +536,501 @@ class RAGEngine:
         text = re.sub(r'[^\w\s]', ' ', text)
         words = text.split()
 
-        stopwords = {
-            'el', 'la', 'los', 'las', 'de', 'del', 'en', 'un', 'una',
-            'y', 'a', 'que', 'es', 'por', 'para', 'con', 'se', 'su',
-            'al', 'lo', 'como', 'mas', 'pero', 'sus', 'le', 'ya', 'o',
-            'que', 'como', 'cual', 'cuales', 'donde', 'cuando', 'si',
-            'no', 'muy', 'sin', 'sobre', 'este', 'esta', 'esto', 'eso',
-            'mi', 'tu', 'me', 'te', 'nos', 'les', 'tiene', 'hay'
-        }
-
-        tokens = [w for w in words if w not in stopwords and len(w) > 2]
+        tokens = [w for w in words if w not in STOPWORDS and len(w) > 2]
 
         if apply_stemming:
             tokens = [self.stemmer.stem(w) for w in tokens]
 
         return tokens
 
-    def _expand_query(self, query: str) -> str:
-        """Expande la query con sinónimos"""
-        words = self._tokenize(query, apply_stemming=False)
-        expanded = list(words)
+    def prepare_query_analysis(self):
+        """Precalcula la tokenización de los sinónimos (entrada de build_synonym_index)"""
+        # Canal TF-IDF: máx. 3 sinónimos por palabra, tokenizados con stemming
+        self._synonym_stems = {key: tuple(self._tokenize(' '.join(synonyms[:3])))
+                               for key, synonyms in SYNONYMS.items()}
+        # Canal keywords: términos indexables (tokens + raíces) de los mismos sinónimos
+        self._synonym_terms = {key: frozenset(t for syn in synonyms[:3] for t in self._index_terms(syn))
+                               for key, synonyms in SYNONYMS.items()}
 
-        for word in words:
-            word_lower = word.lower()
-            if word_lower in SYNONYMS:
-                expanded.extend(SYNONYMS[word_lower][:3])  # Max 3 sinónimos por palabra
+    def build_synonym_index(self):
+        """
+        Compila SYNONYMS en el índice: para cada palabra clave, la contribución de sus
+        sinónimos a cada documento se precalcula como una columna (documentos × claves)
+        en los canales TF-IDF y BM25F. En búsqueda solo se buscan los tokens originales
+        de la query y cada clave presente es una columna más del producto disperso.
 
-        return ' '.join(expanded)
+        Depende del IDF de ambos canales: se recalcula tras construir, cargar o recargar.
+        """
+        self._synonym_key_ids = {key: k for k, key in enumerate(SYNONYMS)}
+        n_docs = len(self.qa_pairs)
+
+        # TF-IDF: {id de raíz: frecuencia} de los sinónimos (para la norma de la query) y su columna
+        self._synonym_tfidf_vectors = []
+        tfidf_columns = []
+        # BM25F: {id de término: peso} de los sinónimos (los de alta importancia pesan más) y su columna
+        self._synonym_keyword_weights = []
+        keyword_columns = []
+        for key in SYNONYMS:
+            tf = Counter(self.word_to_idx[w] for w in self._synonym_stems[key] if w in self.word_to_idx)
+            self._synonym_tfidf_vectors.append(tf)
+            ids = np.fromiter(tf, dtype=np.int64, count=len(tf))
+            counts = np.fromiter(tf.values(), dtype=np.float64, count=len(tf))
+            tfidf_columns.append(self.embeddings.dot_sparse(ids, counts * self.idf[ids]))
+
+            weights = {self.bm25.term_to_id[t]: 1.5 if t in self.HIGH_VALUE_TERMS else 1.0
+                       for t in self._synonym_terms[key] if t in self.bm25.term_to_id}
+            self._synonym_keyword_weights.append(weights)
+            ids = np.fromiter(weights, dtype=np.int64, count=len(weights))
+            values = np.fromiter(weights.values(), dtype=np.float64, count=len(weights))
+            keyword_columns.append(self.bm25.score_ids(ids, values))
+
+        # Columnas guardadas por clave (claves × documentos): una query suma solo las filas de sus claves
+        self.synonym_tfidf = np.stack(tfidf_columns) if tfidf_columns else np.zeros((0, n_docs))
+        self.synonym_keywords = np.stack(keyword_columns) if keyword_columns else np.zeros((0, n_docs))
+
+    def build_spelling_index(self):
+        """Índice de borrados sobre los términos de keywords (frecuencia documental como desempate)"""
+        start = time.perf_counter()
+        self.spelling = SpellingIndex(self.SPELL_MAX_DISTANCE)
+        if self.SPELL_MAX_DISTANCE > 0:
+            self.spelling.build(self.bm25.terms, self.bm25.matrix.column_nnz())
+            elapsed = (time.perf_counter() - start) * 1000
+            print(f"[RAG] Índice de typos: {self.spelling.n_deletes} borrados en {elapsed:.1f} ms")
+
+    def build_domain_lexicon(self):
+        """
+        Léxico de dominio para detectar mensajes vagos: tokens de las preguntas de la
+        base, palabras clave de SYNONYMS con sus sinónimos, frases semilla
+        (DOMAIN_SEED_PHRASES) y los términos de las respuestas que son del dominio
+        (domain_answer_terms); el resto de las respuestas es prosa general ("hoy",
+        "parte"). Sin las palabras conversacionales. Un producto nuevo en la base
+        entra solo.
+
+        Se guarda por lexicon_key, la forma con la que se comparan los mensajes. Las
+        semillas de varias palabras (reglas de intención: "no funciona", "no le
+        gusta") solo cuentan como frase completa, no palabra a palabra.
+        """
+        start = time.perf_counter()
+        anchors = set()
+        for key, synonyms in SYNONYMS.items():
+            for text in [key] + synonyms:
+                anchors.update(self._tokenize(text, apply_stemming=False))
+        anchors.update(self.HIGH_VALUE_TERMS)
+        anchors.update(alias for canonical in self.PRODUCT_ALIASES.values() for alias in canonical.split())
+        self._domain_anchors = frozenset(anchors)
+
+        terms = set(anchors)
+        for qa in self.qa_pairs:
+            terms.update(self._tokenize(qa['pregunta'], apply_stemming=False))
+        terms.update(self.domain_answer_terms(anchors))
+
+        phrases = set()
+        for phrase in DOMAIN_SEED_PHRASES:
+            words = re.findall(r'[^\W\d_]+', self._normalize(phrase))
+            if len(words) == 1:
+                terms.add(words[0])
+            elif words:
+                phrases.add(tuple(self.lexicon_key(word) for word in words))
+
+        generic = {self.lexicon_key(word) for word in CONVERSATIONAL_WORDS}
+        self.domain_terms = frozenset({self.lexicon_key(term) for term in terms} - generic)
+        self.domain_prefixes = frozenset(key[:self.DOMAIN_PREFIX_CHARS] for key in self.domain_terms
+                                         if len(key) >= self.DOMAIN_PREFIX_CHARS)
+        self.domain_phrases = frozenset(phrases)
+        self._domain_phrase_lengths = sorted({len(phrase) for phrase in phrases})
+        # Siglas de dos letras ('ah'): el tokenizer descarta las palabras tan cortas
+        seed_texts = [text for key, synonyms in SYNONYMS.items() for text in [key] + synonyms] + DOMAIN_SEED_PHRASES
+        self.domain_abbreviations = frozenset(
+            word for text in seed_texts for word in re.findall(r'[^\W\d_]+', self._normalize(text))
+            if len(word) == 2 and word not in STOPWORDS)
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"[RAG] Léxico de dominio: {len(self.domain_terms)} términos, {len(phrases)} frases "
+              f"en {elapsed:.0f} ms")
+
+    _SENTENCE_SPLIT = re.compile(r'(?<=[.!?:;])\s+|\n+')
+
+    def domain_answer_terms(self, anchors: Set[str]) -> Set[str]:
+        """
+        Términos de las respuestas que acompañan al vocabulario del dominio: aparecen
+        en al menos ANSWER_TERM_MIN_SENTENCES frases que nombran un término ancla
+        (SYNONYMS, producto) y esas frases son al menos ANSWER_TERM_MIN_RATIO de las
+        frases en que aparecen. Así entran "colágeno" o "elastina" y no la prosa
+        ("hoy", "parte", "francia").
+        """
+        with_anchor: Counter = Counter()
+        total: Counter = Counter()
+        for qa in self.qa_pairs:
+            for sentence in self._SENTENCE_SPLIT.split(qa['respuesta']):
+                tokens = set(self._tokenize(sentence, apply_stemming=False))
+                total.update(tokens)
+                if not anchors.isdisjoint(tokens):
+                    with_anchor.update(tokens)
+        return {term for term, n in with_anchor.items()
+                if n >= self.ANSWER_TERM_MIN_SENTENCES and n >= self.ANSWER_TERM_MIN_RATIO * total[term]}
+
+    @staticmethod
+    def lexicon_key(token: str) -> str:
+        """
+        Forma de un token para el léxico de dominio: sin plural ni vocal final, para
+        que singular/plural y masculino/femenino coincidan (efecto/efectos → efect,
+        secundario/secundarias → secundari, indicación/indicaciones → indicacion). El
+        stemmer no los iguala (efecto → efecto, efectos → efect).
+        """
+        if len(token) > 3 and token.endswith('s'):
+            token = token[:-1]
+        if len(token) > 4 and token[-1] in 'aeio':
+            token = token[:-1]
+        return token
+
+    def _domain_candidates(self, query: AnalyzedQuery) -> Set[str]:
+        """
+        Tokens del mensaje para el léxico de dominio: una corrección de typo solo
+        cuenta si lleva a un término ancla (producto, SYNONYMS); si no, vale la palabra
+        escrita ("hambre" no es "hombre", "vacaciones" no es "acciones").
+        """
+        tokens = set(query.tokens)
+        for original, corrected in query.corrections:
+            if corrected not in self._domain_anchors:
+                tokens.discard(corrected)
+                tokens.add(original)
+        return tokens
+
+    def _is_domain_token(self, token: str) -> bool:
+        """Token en el léxico; las palabras largas valen también por prefijo (recomendar/recomendado)"""
+        key = self.lexicon_key(token)
+        return key in self.domain_terms or (len(key) >= self.DOMAIN_PREFIX_CHARS
+                                            and key[:self.DOMAIN_PREFIX_CHARS] in self.domain_prefixes)
+
+    def anchor_mentions(self, query: Union[str, AnalyzedQuery]) -> int:
+        """
+        Productos (alias) y términos ancla distintos del texto (SYNONYMS, términos de
+        alto valor, nombres de producto). No usa los términos que las respuestas
+        aportan al léxico de dominio: sirve para puntuar frases de respuestas.
+        """
+        query = self.analyze(query)
+        return len(query.aliases) + len(self._domain_anchors.intersection(query.tokens))
+
+    def mentions_domain(self, query: Union[str, AnalyzedQuery]) -> bool:
+        """True si el mensaje nombra un producto (alias), un término o frase del léxico de dominio o una sigla"""
+        query = self.analyze(query)
+        if query.aliases or any(self._is_domain_token(token) for token in self._domain_candidates(query)):
+            return True
+        words = re.findall(r'[^\W\d_]+', query.normalized)
+        if not self.domain_abbreviations.isdisjoint(words):
+            return True
+        keys = [self.lexicon_key(word) for word in words]
+        return any(tuple(keys[i:i + n]) in self.domain_phrases
+                   for n in self._domain_phrase_lengths for i in range(len(keys) - n + 1))
+
+    def analyze(self, query: Union[str, AnalyzedQuery]) -> AnalyzedQuery:
+        """
+        Analiza un mensaje una sola vez: normalización, tokens (con typos corregidos),
+        raíces y alias. Los sinónimos están compilados en el índice.
+        """
+        if isinstance(query, AnalyzedQuery):
+            return query
+        lower = query.lower()
+        normalized = self._normalize(query)
+        words = re.sub(r'[^\w\s]', ' ', normalized).split()
+        tokens = tuple(w for w in words if w not in STOPWORDS and len(w) > 2)
+        stems = tuple(self.stemmer.stem(t) for t in tokens)
+
+        # Tokens desconocidos (ni el token ni su raíz están indexados): término más cercano
+        corrections = self._spelling_corrections(tokens, stems)
+        if corrections:
+            tokens = tuple(corrections.get(t, t) for t in tokens)
+            stems = tuple(self.stemmer.stem(t) for t in tokens)
+
+        aliases = tuple(dict.fromkeys(
+            canonical for alias, canonical in self.PRODUCT_ALIASES.items() if alias in lower
+        ))
+        return AnalyzedQuery(
+            raw=query, lower=lower, normalized=normalized, tokens=tokens, stems=stems, aliases=aliases,
+            corrections=tuple(corrections.items()),
+        )
+
+    def _spelling_corrections(self, tokens: Tuple[str, ...], stems: Tuple[str, ...]) -> Dict[str, str]:
+        """{token: término corregido} para los tokens que no coinciden con nada del índice de keywords"""
+        known = self.bm25.term_to_id
+        corrections = {}
+        for token, stem in zip(tokens, stems):
+            if token in known or stem in known or token in corrections:
+                continue
+            corrected = self.spelling.correct(token)
+            if corrected is not None:
+                corrections[token] = corrected
+        return corrections
+
+    def _index_terms(self, text: str) -> List[str]:
+        """Términos indexables de un texto: tokens originales + raíces distintas"""
+        return self._terms_from_tokens(self._tokenize(text, apply_stemming=False))
+
+    def _terms_from_tokens(self, tokens: Tuple[str, ...]) -> List[str]:
+        stems = [self.stemmer.stem(t) for t in tokens]
+        return list(tokens) + [s for t, s in zip(tokens, stems) if s != t]
 
     def build_keyword_index(self):
-        """Construye índice invertido para búsqueda por keywords"""
-        for i, qa in enumerate(self.qa_pairs):
-            text = qa['pregunta'] + ' ' + qa['respuesta']
-            tokens = set(self._tokenize(text, apply_stemming=False))
-            tokens_stemmed = set(self._tokenize(text, apply_stemming=True))
-            all_tokens = tokens | tokens_stemmed
-
-            for token in all_tokens:
-                if token not in self.keyword_index:
-                    self.keyword_index[token] = set()
-                self.keyword_index[token].add(i)
+        """Construye el índice BM25F (pregunta/respuesta) y el índice invertido de keywords"""
+        self.bm25.build([self._bm25_fields(f) for f in self.doc_fields])
 
         print(f"[RAG] Índice de keywords: {len(self.keyword_index)} términos únicos")
 
+    def build_ngram_index(self):
+        """Construye los vectores de n-gramas de caracteres de las preguntas"""
+        self.ngrams.build([f.pregunta_norm for f in self.doc_fields])
+        print(f"[RAG] Índice de n-gramas: {self.ngrams.dim}×{len(self.qa_pairs)} {self.ngrams.quantization}, "
+              f"{len(self.ngrams.weights.data)} no nulos ({self.ngrams.nbytes() // 1024} KB)")
+
+    @property
+    def ann_active(self) -> bool:
+        """True si el canal de n-gramas usa el índice aproximado IVF"""
+        if self.ann_mode == 'auto':
+            return len(self.qa_pairs) >= self.ANN_MIN_DOCS
+        return self.ann_mode == 'ivf'
+
+    def build_ann_index(self):
+        """Entrena el índice IVF del canal de n-gramas (parte de la construcción/carga del índice)"""
+        start = time.perf_counter()
+        self.ngrams.build_ivf()
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"[RAG] Índice IVF: {self.ngrams.ivf.n_lists} listas en {elapsed:.0f} ms "
+              f"(n_probe={self.ann_n_probe})")
+
+    def set_ann(self, mode: Optional[str] = None, n_probe: Optional[int] = None):
+        """Cambia el modo de búsqueda del canal de n-gramas ('exact', 'ivf', 'auto') y/o n_probe"""
+        if mode is not None:
+            if mode not in ('exact', 'ivf', 'auto'):
+                raise ValueError(f"Modo ANN desconocido: {mode}")
+            self.ann_mode = mode
+        if n_probe is not None:
+            self.ann_n_probe = n_probe
+        if self.ann_active and self.ngrams.ivf is None:
+            self.build_ann_index()
+        self.cache.clear()
+
+    def _bm25_fields(self, fields: DocumentFields) -> List[List[str]]:
+        """Términos indexables de cada campo BM25F (pregunta, respuesta)"""
+        return [self._terms_from_tokens(fields.pregunta_tokens),
+                self._terms_from_tokens(fields.respuesta_tokens)]
+
+    def build_category_index(self):
+        """Construye el índice categoría → filas de documentos"""
+        codes: Dict[str, int] = {}
+        self.category_codes = np.fromiter((codes.setdefault(qa.categoria, len(codes)) for qa in self.qa_pairs),
+                                          dtype=np.int16, count=len(self.qa_pairs))
+        self.category_names = list(codes)
+        order = np.argsort(self.category_codes, kind='stable')
+        counts = np.bincount(self.category_codes, minlength=len(codes))
+        starts = np.cumsum(counts) - counts
+        self.category_rows = {name: order[starts[c]:starts[c] + counts[c]]
+                              for c, name in enumerate(self.category_names)}
+        self._category_rows_cache: Dict[Tuple[str, ...], np.ndarray] = {}
+        print(f"[RAG] Índice de categorías: {len(self.category_rows)} categorías")
+
+    def build_concentration_masks(self):
+        """Boost de concentración: presencia de términos en pregunta/respuesta normalizadas"""
+        self.concentration_masks = self._concentration_masks(self.doc_fields)
+
+    @staticmethod
+    def _concentration_masks(doc_fields: Sequence[DocumentFields]) -> Dict[str, np.ndarray]:
+        def mask(field: str, needles: Tuple[str, ...]) -> np.ndarray:
+            return np.array([any(n in getattr(f, field) for n in needles) for f in doc_fields],
+                            dtype=bool)
+        return {
+            'pregunta_concentracion': mask('pregunta_norm', ('concentracion',)),
+            'pregunta_concentrado': mask('pregunta_norm', ('concentrado', 'potente')),
+            'respuesta_concentracion': mask('respuesta_norm', ('concentracion', 'concentrado')),
+        }
+
+    def build_boost_masks(self):
+        """Precalcula las filas que usan los boosts de búsqueda por intent"""
+        # Intent → filas de las categorías que coinciden con el intent
+        self.intent_rows = {}
+        for intent, keywords in INTENT_KEYWORDS.items():
+            cats = [cat for cat in self.category_rows
+                    if intent in cat or any(kw in cat for kw in keywords)]
+            self.intent_rows[intent] = self.rows_for_categories(cats)
+
+        # Tabla de boosts: fila 0 = sin intent; score final = max(score × multiplicador, mínimo)
+        n_docs = len(self.qa_pairs)
+        intents = list(self.intent_rows) + ['concentracion']
+        self._intent_ids = {intent: i + 1 for i, intent in enumerate(intents)}
+        self._boost_multipliers = np.ones((len(intents) + 1, n_docs))
+        self._boost_floors = np.full((len(intents) + 1, n_docs), -np.inf)
+        for intent, rows in self.intent_rows.items():
+            self._boost_multipliers[self._intent_ids[intent], rows] = 1.2
+
+        # Boost especial para intent de concentración: buscar en pregunta/respuesta
+        if self.concentration_masks:
+            m = self.concentration_masks
+            tier1 = m['pregunta_concentracion']
+            tier2 = m['pregunta_concentrado'] & ~tier1
+            tier3 = m['respuesta_concentracion'] & ~tier1 & ~tier2
+            c = self._intent_ids['concentracion']
+            self._boost_multipliers[c, tier1], self._boost_floors[c, tier1] = 4.0, 0.5  # boost muy significativo
+            self._boost_multipliers[c, tier2], self._boost_floors[c, tier2] = 3.0, 0.4
+            self._boost_multipliers[c, tier3] = 2.0
+
+        # Patrones de query normalizados una sola vez
+        self._query_patterns = {intent: [self._normalize(p) for p in patterns]
+                                for intent, patterns in QUERY_PATTERNS.items()}
+
+    def add_scorer(self, scorer: Scorer, weight: float):
+        """Añade una señal al pipeline de scoring (invalida la caché de resultados)"""
+        self.scorers = self.scorers + [(scorer, weight)]
+        self.cache.clear()
+
+    def set_fusion(self, method: Optional[str] = None, weights: Optional[Dict[str, float]] = None,
+                   rrf_k: int = 60):
+        """Cambia el método de fusión y/o los pesos por nombre de scorer (invalida la caché)"""
+        if method is not None:
+            self.fusion = ScoreFusion(method, rrf_k)
+        if weights:
+            self.scorers = [(scorer, weights.get(scorer.name, weight)) for scorer, weight in self.scorers]
+        self.cache.clear()
+
+    def search_config(self) -> tuple:
+        """
+        Configuración de scoring que no está en el artefacto del índice (fusión, peso
+        de cada scorer, modo ANN): dos motores con la misma base y la misma
+        configuración devuelven los mismos resultados.
+        """
+        return (self.fusion.method, self.fusion.rrf_k, tuple((scorer.name, float(weight)) for scorer, weight in self.scorers),
+                self.ann_mode, self.ann_n_probe)
+
+    def rows_for_categories(self, categories: List[str]) -> np.ndarray:
+        """Filas (ordenadas) de los documentos que pertenecen a alguna de las categorías"""
+        key = tuple(sorted(set(categories)))
+        rows = self._category_rows_cache.get(key)
+        if rows is None:
+            parts = [self.category_rows[c] for c in key if c in self.category_rows]
+            rows = np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+            self._category_rows_cache[key] = rows
+        return rows
+
+    def missing_categories(self, categories: List[str]) -> List[str]:
+        """Categorías de la lista que no tienen ningún documento en la base"""
+        return [c for c in categories if c not in self.category_rows]
+
     def compute_embeddings(self):
         """Calcula embeddings TF-IDF para todas las Q&A"""
-        documents = [qa['pregunta'] + ' ' + qa['respuesta'] for qa in self.qa_pairs]
-
-        # Construir vocabulario con stemming
-        all_words = []
-        for doc in documents:
-            all_words.extend(self._tokenize(doc))
-
-        self.vocab = list(set(all_words))
-        self.word_to_idx = {word: idx for idx, word in enumerate(self.vocab)}
-
-        # Calcular IDF
-        doc_freq = Counter()
-        for doc in documents:
-            unique_words = set(self._tokenize(doc))
-            for word in unique_words:
-                doc_freq[word] += 1
-
-        n_docs = len(documents)
-        self.idf = {word: math.log(n_docs / (freq + 1)) for word, freq in doc_freq.items()}
-
-        # Calcular embeddings
-        self.embeddings = []
-        for doc in documents:
-            vec = self._get_vector(doc)
-            self.embeddings.append(vec)
-
-        print(f"[RAG] Embeddings calculados: {len(self.vocab)} palabras en vocabulario")
-
-    def _get_vector(self, text: str) -> np.ndarray:
-        """Obtiene vector TF-IDF de un texto"""
-        words = self._tokenize(text)
-        tf = Counter(words)
-        vec = np.zeros(len(self.vocab))
-        for word, count in tf.items():
-            if word in self.word_to_idx:
-                vec[self.word_to_idx[word]] = count * self.idf.get(word, 0)
-        norm = np.linalg.norm(vec)
+        # Frecuencias con stemming de cada documento (pregunta + respuesta), desde los campos precalculados
+        documents = [self._stem_counts(f) for f in self.doc_fields]
+
+        # Construir vocabulario con stemming (orden estable para el artefacto persistido)
+        vocab = sorted({word for doc in documents for word in doc})
+        self.word_to_idx = {sys.intern(word): idx for idx, word in enumerate(vocab)}
+
+        # Frecuencias crudas como matriz dispersa (documentos × vocabulario; float32 es exacto para conteos)
+        rows = []
+        for tf in documents:
+            rows.append((np.fromiter((self.word_to_idx[w] for w in tf), dtype=np.int32, count=len(tf)),
+                         np.fromiter(tf.values(), dtype=np.float64, count=len(tf))))
+        self.tf_counts = CSRMatrix.from_rows(rows, len(vocab), dtype=np.float32)
+        self.derive_tfidf()
+
+        print(f"[RAG] Embeddings calculados: {len(vocab)} palabras en vocabulario "
+              f"({self.embeddings.data.size} valores no nulos)")
+
+    def _stem_counts(self, fields: DocumentFields) -> Counter:
+        """Frecuencias de raíces del documento (pregunta + respuesta) para el canal TF-IDF"""
+        return Counter(self.stemmer.stem(t) for t in fields.pregunta_tokens + fields.respuesta_tokens)
+
+    def derive_tfidf(self):
+        """Calcula IDF y la matriz TF-IDF normalizada (L2 por fila) desde las frecuencias crudas"""
+        n_docs = self.tf_counts.shape[0]
+        doc_freq = self.tf_counts.column_nnz()
+        self.idf = np.log(n_docs / (doc_freq + 1.0))
+        data = self.tf_counts.data * self.idf[self.tf_counts.indices]
+        row_ids = self.tf_counts.row_ids()
+        norms = np.sqrt(np.bincount(row_ids, weights=data * data, minlength=n_docs))
+        norms[norms == 0] = 1.0
+        self.embeddings = self.tf_counts.with_data((data / norms[row_ids]).astype(np.float32))
+
+    @property
+    def vocab(self) -> List[str]:
+        """Vocabulario TF-IDF por id (lista construida bajo demanda desde word_to_idx)"""
+        return list(self.word_to_idx)
+
+    def _get_sparse_vector(self, text: str) -> Tuple[np.ndarray, np.ndarray]:
+        """Obtiene vector TF-IDF disperso (índices, valores) de un texto"""
+        return self._sparse_vector_from_tokens(self._tokenize(text))
+
+    def _sparse_vector_from_tokens(self, tokens: Sequence[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """Vector TF-IDF disperso normalizado a partir de tokens ya stemmed"""
+        tf = Counter(w for w in tokens if w in self.word_to_idx)
+        indices = np.fromiter((self.word_to_idx[w] for w in tf), dtype=np.int64, count=len(tf))
+        values = np.fromiter(tf.values(), dtype=np.float64, count=len(tf)) * self.idf[indices]
+        norm = np.linalg.norm(values)
         if norm > 0:
-            vec = vec / norm
-        return vec
-
-    def _keyword_search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
-        """Búsqueda por keywords con boost por coincidencias múltiples"""
-        tokens = set(self._tokenize(query, apply_stemming=False))
-        tokens_stemmed = set(self._tokenize(query, apply_stemming=True))
-        all_tokens = tokens | tokens_stemmed
-
-        # Palabras clave de alta importancia (boost extra)
-        high_value_terms = {'biopro', 'fbio', 'dvs', '3dvs', 'biomodulador',
-                           'lifting', 'relleno', 'protocolo', 'precio'}
-
-        # Expandir con sinónimos
-        expanded_tokens = set(all_tokens)
-        for token in list(all_tokens):
-            if token in SYNONYMS:
-                expanded_tokens.update(SYNONYMS[token][:3])  # más sinónimos
-
-        # Contar matches por documento
-        doc_scores: Dict[int, float] = {}
-        for token in expanded_tokens:
-            if token in self.keyword_index:
-                for doc_idx in self.keyword_index[token]:
-                    if doc_idx not in doc_scores:
-                        doc_scores[doc_idx] = 0
-                    # Boost para tokens originales vs sinónimos
-                    boost = 2.0 if token in all_tokens else 1.0
-                    # Boost extra para términos de alta importancia
-                    if token in high_value_terms:
-                        boost *= 1.5
-                    doc_scores[doc_idx] += boost
-
-        # Boost adicional por coincidencia directa en pregunta
-        query_normalized = self._normalize(query)
-        for i, qa in enumerate(self.qa_pairs):
-            pregunta_norm = self._normalize(qa['pregunta'])
-            # Si palabras clave de la query aparecen en la pregunta
-            matches = sum(1 for t in all_tokens if t in pregunta_norm and len(t) > 3)
-            if matches > 0 and i in doc_scores:
-                doc_scores[i] *= (1 + matches * 0.3)
-
-        # Normalizar scores
-        if doc_scores:
-            max_score = max(doc_scores.values())
-            doc_scores = {k: v / max_score for k, v in doc_scores.items()}
-
-        # Ordenar por score
-        sorted_docs = sorted(doc_scores.items(), key=lambda x: x[1], reverse=True)
-        return sorted_docs[:top_k]
-
-    def _detect_intent(self, query: str) -> Optional[str]:
+            values = values / norm
+        return indices, values
+
+    def _keyword_scores(self, query: AnalyzedQuery) -> np.ndarray:
+        """Scores BM25F de keywords para todos los documentos, normalizados a [0, 1]"""
+        return self._keyword_scores_many([query])[0]
+
+    def _keyword_terms(self, query: AnalyzedQuery) -> Tuple[Dict[int, float], List[int], set]:
+        """
+        Vector BM25F de la query ({id de término: peso}), claves de sinónimos resueltas con
+        su columna precalculada y términos para el boost de coincidencia en pregunta
+        """
+        all_tokens = set(query.tokens) | set(query.stems)
+        term_to_id = self.bm25.term_to_id
+
+        # Boost para tokens originales vs sinónimos, extra para términos de alta importancia
+        weights = {term_to_id[t]: 2.0 * (1.5 if t in self.HIGH_VALUE_TERMS else 1.0)
+                   for t in all_tokens if t in term_to_id}
+
+        # Sinónimos: cada clave presente suma su columna precalculada. Si sus términos se
+        # solapan con la query o con otra clave presente se expanden término a término,
+        # para que cada término cuente una sola vez (como token original si lo es)
+        keys = [k for k in (self._synonym_key_ids.get(t) for t in all_tokens) if k is not None]
+        columns, expanded = [], []
+        for k in keys:
+            synonyms = self._synonym_keyword_weights[k].keys()
+            if synonyms.isdisjoint(weights) and all(
+                    synonyms.isdisjoint(self._synonym_keyword_weights[other]) for other in keys if other != k):
+                columns.append(k)
+            else:
+                expanded.append(k)
+        for k in expanded:
+            for term_id, weight in self._synonym_keyword_weights[k].items():
+                weights.setdefault(term_id, weight)
+
+        return weights, columns, {t for t in all_tokens if len(t) > 3}
+
+    def _keyword_scores_many(self, queries: Sequence[AnalyzedQuery]) -> np.ndarray:
+        """Scores de keywords de un lote de queries (queries × documentos), cada fila en [0, 1]"""
+        terms = [self._keyword_terms(q) for q in queries]
+        rows = np.repeat(np.arange(len(queries)), [len(weights) for weights, _, _ in terms])
+        ids = np.fromiter((i for weights, _, _ in terms for i in weights), dtype=np.int64, count=len(rows))
+        values = np.fromiter((w for weights, _, _ in terms for w in weights.values()),
+                             dtype=np.float64, count=len(rows))
+        scores = self.bm25.score_ids_many(rows, ids, values, len(queries))
+
+        # Columnas de sinónimos compiladas en el índice (query a query: no depende del lote)
+        for i, (_, columns, _) in enumerate(terms):
+            for k in columns:
+                scores[i] += self.synonym_keywords[k]
+
+        # Boost adicional por coincidencia directa de la query en la pregunta
+        matches = self.bm25.field_matches_many([match_terms for _, _, match_terms in terms], field=0)
+        scores *= 1 + matches * 0.3
+
+        # Normalizar scores por query
+        max_scores = scores.max(axis=1, keepdims=True) if scores.shape[1] else np.zeros((len(queries), 1))
+        np.divide(scores, max_scores, out=scores, where=max_scores > 0)
+        return scores
+
+    def _detect_intent(self, query: AnalyzedQuery) -> Optional[str]:
         """Detecta la intención de la query basado en keywords"""
-        query_lower = self._normalize(query)
+        query_lower = query.normalized
 
         # Primero verificar patrones de query completos
-        for intent, patterns in QUERY_PATTERNS.items():
+        for intent, patterns in self._query_patterns.items():
             for pattern in patterns:
-                if self._normalize(pattern) in query_lower:
+                if pattern in query_lower:
                     return intent
 
         for intent, keywords in INTENT_KEYWORDS.items():
@@ -342,92 +1039,375 @@ class RAGEngine:
                     return intent
         return None
 
-    def search(self, query: str, top_k: int = 5, categories: Optional[List[str]] = None) -> List[Tuple[dict, float]]:
+    def _score_documents(self, query: AnalyzedQuery) -> np.ndarray:
+        """Calcula el score híbrido de la query para TODOS los documentos en una pasada"""
+        return self._score_many([query])[0]
+
+    def _score_many(self, queries: Sequence[AnalyzedQuery]) -> np.ndarray:
+        """Score híbrido de un lote de queries (queries × documentos): scorers → fusión → boosts"""
+        channels = [scorer.score_many(self, queries) for scorer, _ in self.scorers]
+        combined = self.fusion.fuse(channels, [weight for _, weight in self.scorers])
+
+        # Boosts por intent (categorías del intent, concentración): una fila de la tabla por query
+        boost = np.fromiter((self._intent_ids.get(self._detect_intent(q), 0) for q in queries),
+                            dtype=np.int64, count=len(queries))
+        return np.maximum(combined * self._boost_multipliers[boost], self._boost_floors[boost])
+
+    def _ngram_scores_many(self, queries: Sequence[AnalyzedQuery]) -> np.ndarray:
+        """Coseno de n-gramas de caracteres de un lote de queries con todas las preguntas"""
+        return self.ngrams.score_many([q.normalized for q in queries],
+                                      n_probe=self.ann_n_probe if self.ann_active else None)
+
+    def _tfidf_query(self, query: AnalyzedQuery) -> Tuple[np.ndarray, np.ndarray, Dict[int, float]]:
+        """
+        Query TF-IDF normalizada: (ids, pesos) de las raíces originales y {clave: peso} de
+        los sinónimos, cuyas columnas precalculadas aportan el resto del coseno. La norma
+        incluye las raíces de los sinónimos (una vez por aparición de la clave).
+        """
+        tf = Counter(self.word_to_idx[w] for w in query.stems if w in self.word_to_idx)
+        ids = np.fromiter(tf, dtype=np.int64, count=len(tf))
+        values = np.fromiter(tf.values(), dtype=np.float64, count=len(tf)) * self.idf[ids]
+        keys = Counter(k for k in (self._synonym_key_ids.get(t) for t in query.tokens) if k is not None)
+
+        if keys:
+            expanded = Counter(tf)
+            for k, occurrences in keys.items():
+                for term_id, count in self._synonym_tfidf_vectors[k].items():
+                    expanded[term_id] += count * occurrences
+            expanded_ids = np.fromiter(expanded, dtype=np.int64, count=len(expanded))
+            counts = np.fromiter(expanded.values(), dtype=np.float64, count=len(expanded))
+            norm = np.linalg.norm(counts * self.idf[expanded_ids])
+        else:
+            norm = np.linalg.norm(values)
+        if norm > 0:
+            values /= norm
+            keys = {k: occurrences / norm for k, occurrences in keys.items()}
+        return ids, values, keys
+
+    def _tfidf_scores_many(self, queries: Sequence[AnalyzedQuery]) -> np.ndarray:
+        """Coseno TF-IDF de un lote de queries con sinónimos: un producto sobre los términos + columnas de claves"""
+        vectors = [self._tfidf_query(q) for q in queries]
+        n = len(queries)
+        if not vectors:
+            return np.zeros((0, len(self.qa_pairs)))
+        scores = self.embeddings.dot_sparse_many(
+            np.repeat(np.arange(n), [len(ids) for ids, _, _ in vectors]),
+            np.concatenate([ids for ids, _, _ in vectors]),
+            np.concatenate([values for _, values, _ in vectors]), n)
+        for i, (_, _, keys) in enumerate(vectors):
+            for k, weight in keys.items():
+                scores[i] += weight * self.synonym_tfidf[k]
+        return scores
+
+    def _select_top_k(self, scores: np.ndarray, top_k: int,
+                      categories: Optional[List[str]] = None) -> List[Tuple[dict, float]]:
+        """Selecciona los top_k documentos (opcionalmente restringidos a categorías)"""
+        if categories:
+            rows = self.rows_for_categories(categories)
+            top = rows[top_k_indices(scores[rows], top_k)]
+        else:
+            top = top_k_indices(scores, top_k)
+        return [(self.qa_pairs[i], float(scores[i])) for i in top]
+
+    def search(self, query: Union[str, AnalyzedQuery], top_k: int = 5,
+               categories: Optional[List[str]] = None) -> List[Tuple[dict, float]]:
         """
         Búsqueda híbrida: TF-IDF + keywords + expansión de sinónimos.
 
         Args:
-            query: Texto de búsqueda
+            query: Texto de búsqueda o mensaje ya analizado
             top_k: Número de resultados
             categories: Lista de categorías para filtrar (None = todas)
 
         Returns:
             Lista de (qa_pair, score)
         """
-        # 1. Expandir query con sinónimos
-        expanded_query = self._expand_query(query)
-
-        # 2. Búsqueda TF-IDF con query expandida
-        query_vec = self._get_vector(expanded_query)
+        query = self.analyze(query)
+        key = self._cache_key('search', query, top_k, categories)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached)
+        results = self._select_top_k(self._score_documents(query), top_k, categories)
+        self.cache.put(key, tuple(results))
+        return results
+
+    def search_dual(self, query: Union[str, AnalyzedQuery], top_k: int = 5,
+                    categories: Optional[List[str]] = None
+                    ) -> Tuple[List[Tuple[dict, float]], List[Tuple[dict, float]]]:
+        """
+        Búsqueda en los dos ámbitos (filtrado por categorías y sin filtro)
+        con una sola pasada de scoring.
 
-        tfidf_results = []
-        for i, (qa, emb) in enumerate(zip(self.qa_pairs, self.embeddings)):
-            if categories and qa['categoria'] not in categories:
-                continue
-            score = float(np.dot(query_vec, emb))
-            tfidf_results.append((i, score))
-
-        # 3. Búsqueda por keywords
-        keyword_results = self._keyword_search(query, top_k=top_k * 2)
-        keyword_dict = dict(keyword_results)
-
-        # 4. Combinar scores (híbrido)
-        # TF-IDF tiene más peso pero keywords ayuda cuando TF-IDF falla
-        combined_scores: Dict[int, float] = {}
-
-        # Detectar intent una vez
-        intent = self._detect_intent(query)
-
-        for i, tfidf_score in tfidf_results:
-            keyword_score = keyword_dict.get(i, 0)
-            # Ponderación: 60% TF-IDF, 40% keywords
-            combined = (tfidf_score * 0.6) + (keyword_score * 0.4)
-
-            qa = self.qa_pairs[i]
-
-            # Boost adicional si coincide con categoría de intent detectado
-            if intent:
-                category = qa.get('categoria', '')
-                if intent in category or any(kw in category for kw in INTENT_KEYWORDS.get(intent, [])):
-                    combined *= 1.2
-
-            # Boost especial para intent de concentración: buscar en pregunta/respuesta
-            if intent == 'concentracion':
-                pregunta_norm = self._normalize(qa['pregunta'])
-                respuesta_norm = self._normalize(qa['respuesta'])
-                if 'concentracion' in pregunta_norm:
-                    combined = max(combined * 4.0, 0.5)  # boost muy significativo
-                elif 'concentrado' in pregunta_norm or 'potente' in pregunta_norm:
-                    combined = max(combined * 3.0, 0.4)
-                elif 'concentracion' in respuesta_norm or 'concentrado' in respuesta_norm:
-                    combined *= 2.0
-
-            combined_scores[i] = combined
-
-        # 5. Ordenar y devolver top_k
-        sorted_results = sorted(combined_scores.items(), key=lambda x: x[1], reverse=True)
-
-        results = []
-        for i, score in sorted_results[:top_k]:
-            if categories and self.qa_pairs[i]['categoria'] not in categories:
+        Returns:
+            Tuple[filtrados, sin_filtro]: equivalentes a search(categories) y search(None)
+        """
+        query = self.analyze(query)
+        key = self._cache_key('dual', query, top_k, categories)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return list(cached[0]), list(cached[1])
+        scores = self._score_documents(query)
+        unfiltered = self._select_top_k(scores, top_k)
+        filtered = self._select_top_k(scores, top_k, categories) if categories else unfiltered
+        self.cache.put(key, (tuple(filtered), tuple(unfiltered)))
+        return filtered, list(unfiltered)
+
+    def search_scopes(self, query: Union[str, AnalyzedQuery], scopes: Dict[str, Optional[List[str]]],
+                      top_k: int = 5) -> Dict[str, List[Tuple[dict, float]]]:
+        """
+        Búsqueda en varios ámbitos de categorías (p. ej. los de cada agente candidato)
+        con una sola pasada de scoring: para cada ámbito, lo mismo que
+        search(categories=...), y queda en caché con la misma clave.
+        """
+        query = self.analyze(query)
+        results: Dict[str, List[Tuple[dict, float]]] = {}
+        scores = None
+        for name, categories in scopes.items():
+            key = self._cache_key('search', query, top_k, categories)
+            cached = self.cache.get(key)
+            if cached is not None:
+                results[name] = list(cached)
                 continue
-            results.append((self.qa_pairs[i], score))
+            if scores is None:
+                scores = self._score_documents(query)
+            found = self._select_top_k(scores, top_k, categories)
+            self.cache.put(key, tuple(found))
+            results[name] = found
+        return results
+
+    def _cache_key(self, kind: str, query: AnalyzedQuery, top_k: int,
+                   categories: Optional[List[str]]) -> tuple:
+        """
+        Clave de caché: texto normalizado (el scoring solo depende de él), categorías
+        sin orden, top_k y versión del índice.
+        """
+        return (kind, query.normalized.strip(self._CACHE_KEY_STRIP),
+                tuple(sorted(set(categories or ()))), top_k, self.version)
 
-        return results[:top_k]
+    def search_many(self, queries: Sequence[Union[str, AnalyzedQuery]], top_k: int = 5,
+                    categories: Optional[List[str]] = None) -> List[List[Tuple[dict, float]]]:
+        """
+        Búsqueda en lote: mismos resultados que search() para cada query, pero las
+        queries que no están en caché se puntúan juntas (un producto matriz × lote
+        por canal) y el top-k se selecciona por filas.
+
+        Útil para evaluación offline, precalentar la caché o generación masiva.
+        """
+        analyzed = [self.analyze(q) for q in queries]
+        keys = [self._cache_key('search', q, top_k, categories) for q in analyzed]
+        results: List[Optional[List[Tuple[dict, float]]]] = []
+        pending: Dict[tuple, List[int]] = {}
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key) if key not in pending else None
+            results.append(list(cached) if cached is not None else None)
+            if cached is None:
+                pending.setdefault(key, []).append(i)
+        if not pending:
+            return results
+
+        # Una fila por query distinta sin caché
+        batch = [analyzed[positions[0]] for positions in pending.values()]
+        scores = self._score_many(batch)
+        if categories:
+            rows = self.rows_for_categories(categories)
+            top = rows[top_k_indices_rows(scores[:, rows], top_k)]
+        else:
+            top = top_k_indices_rows(scores, top_k)
+
+        for b, (key, positions) in enumerate(pending.items()):
+            found = tuple((self.qa_pairs[i], float(scores[b, i])) for i in top[b])
+            self.cache.put(key, found)
+            for position in positions:
+                results[position] = list(found)
+        return results
+
+    def search_dual_many(self, queries: Sequence[Union[str, AnalyzedQuery]], top_k: int = 5,
+                         categories: Optional[List[str]] = None
+                         ) -> List[Tuple[List[Tuple[dict, float]], List[Tuple[dict, float]]]]:
+        """
+        search_dual() en lote: (filtrados, sin filtro) por query, con las queries sin
+        caché puntuadas juntas (lo usa el pool de procesos para sus lotes).
+        """
+        analyzed = [self.analyze(q) for q in queries]
+        keys = [self._cache_key('dual', q, top_k, categories) for q in analyzed]
+        results: List[Optional[Tuple[List[Tuple[dict, float]], List[Tuple[dict, float]]]]] = []
+        pending: Dict[tuple, List[int]] = {}
+        for i, key in enumerate(keys):
+            cached = self.cache.get(key) if key not in pending else None
+            results.append((list(cached[0]), list(cached[1])) if cached is not None else None)
+            if cached is None:
+                pending.setdefault(key, []).append(i)
+        if not pending:
+            return results
+
+        batch = [analyzed[positions[0]] for positions in pending.values()]
+        scores = self._score_many(batch)
+        top_unfiltered = top_k_indices_rows(scores, top_k)
+        if categories:
+            rows = self.rows_for_categories(categories)
+            top_filtered = rows[top_k_indices_rows(scores[:, rows], top_k)]
+        else:
+            top_filtered = top_unfiltered
+
+        for b, (key, positions) in enumerate(pending.items()):
+            unfiltered = tuple((self.qa_pairs[i], float(scores[b, i])) for i in top_unfiltered[b])
+            filtered = tuple((self.qa_pairs[i], float(scores[b, i])) for i in top_filtered[b])
+            self.cache.put(key, (filtered, unfiltered))
+            for position in positions:
+                results[position] = (list(filtered), list(unfiltered))
+        return results
+
+    def memory_report(self) -> Dict[str, object]:
+        """
+        Memoria aproximada del motor por componente (MB), para /api/health.
+
+        Los arrays compartidos se cuentan una sola vez. `mapped_mb` es la parte de
+        los arrays cargados del artefacto con mmap: el sistema los pagina desde
+        disco y no cuentan como memoria anónima del proceso. `projection` estima
+        la memoria con MEMORY_PROJECTION_FACTOR veces más documentos y qué
+        componente dominaría.
+        """
+        if self._static_nbytes is None:
+            # Registros y vocabularios no cambian durante la vida de la instancia
+            strings = {id(t): sys.getsizeof(t) for table in (self.word_to_idx, self.bm25.term_to_id) for t in table}
+            self._static_nbytes = {
+                'corpus': (sum(qa.nbytes() for qa in self.qa_pairs) + sys.getsizeof(self.qa_pairs) +
+                           sum(sys.getsizeof(name) for name in self.category_names)),
+                'vocabulary': (sys.getsizeof(self.word_to_idx) + sys.getsizeof(self.bm25.term_to_id) +
+                               sum(strings.values())),
+            }
+        seen: set = set()
+        mapped = [0]
+
+        def arrays_nbytes(*objects) -> int:
+            total = 0
+            for obj in objects:
+                arrays = ([getattr(obj, name) for name in CSRMatrix.STRUCTURE_ARRAYS + ('data', 'col_data')]
+                          if isinstance(obj, CSRMatrix) else [obj])
+                for array in arrays:
+                    if array is None or id(array) in seen:
+                        continue
+                    seen.add(id(array))
+                    total += array.nbytes
+                    if isinstance(array, np.memmap):
+                        mapped[0] += array.nbytes
+            return total
+
+        components = dict(self._static_nbytes)
+        components['corpus'] += arrays_nbytes(self.category_codes)
+        components['tfidf'] = arrays_nbytes(self.tf_counts, self.embeddings, self.idf)
+        components['keywords'] = arrays_nbytes(*self.bm25.field_counts, *self.bm25.field_matrices, self.bm25.matrix,
+                                               self.bm25.idf, self.bm25.doc_lengths)
+        components['ngrams'] = arrays_nbytes(*self.ngrams.arrays())
+        components['synonyms'] = arrays_nbytes(self.synonym_tfidf, self.synonym_keywords)
+        components['spelling'] = self.spelling.nbytes()
+        components['boosts'] = arrays_nbytes(*self.category_rows.values(), *self.intent_rows.values(),
+                                             *self.concentration_masks.values(),
+                                             self._boost_multipliers, self._boost_floors)
+
+        n_docs = max(len(self.qa_pairs), 1)
+        projected = {name: n if name in self.MEMORY_FIXED_COMPONENTS else n * self.MEMORY_PROJECTION_FACTOR
+                     for name, n in components.items()}
+
+        def mb(n: int) -> float:
+            return round(n / 1e6, 3)
+        return {
+            'documents': len(self.qa_pairs),
+            'total_mb': mb(sum(components.values())),
+            'mapped_mb': mb(mapped[0]),
+            'ngram_quantization': self.ngrams.quantization,
+            'components_mb': {name: mb(n) for name, n in components.items()},
+            'bytes_per_document': {name: round(n / n_docs) for name, n in components.items()
+                                   if name not in self.MEMORY_FIXED_COMPONENTS},
+            'projection': {
+                'documents': len(self.qa_pairs) * self.MEMORY_PROJECTION_FACTOR,
+                'total_mb': mb(sum(projected.values())),
+                'largest': max(projected, key=projected.get),
+                'components_mb': {name: mb(n) for name, n in projected.items()},
+            },
+        }
 
     def get_categories(self) -> List[str]:
         """Retorna todas las categorías disponibles"""
-        return list(set(qa['categoria'] for qa in self.qa_pairs))
+        return list(self.category_names)
 
 
 # Singleton del motor RAG
 _rag_instance = None
+_init_lock = threading.Lock()
+_reload_lock = threading.Lock()
 
 def get_rag_engine() -> RAGEngine:
-    """Obtiene la instancia singleton del RAG"""
+    """Obtiene la instancia singleton del RAG (segura entre hilos: se construye una sola vez)"""
+    global _rag_instance
+    engine = _rag_instance
+    if engine is None:
+        with _init_lock:
+            if _rag_instance is None:
+                base_path = os.path.dirname(os.path.dirname(__file__))
+                kb_path = os.path.join(base_path, 'knowledge_base.json')
+                _rag_instance = RAGEngine(kb_path)
+            engine = _rag_instance
+    return engine
+
+
+# Executor acotado para la búsqueda y el montaje del contexto: el trabajo de CPU
+# sale del event loop y el streaming de las demás sesiones no se detiene
+RETRIEVAL_WORKERS = int(os.getenv('RAG_WORKERS', str(min(4, os.cpu_count() or 1))))
+_retrieval_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+def get_retrieval_executor() -> ThreadPoolExecutor:
+    """Pool de hilos compartido por todas las sesiones (RAG_WORKERS hilos)"""
+    global _retrieval_executor
+    if _retrieval_executor is None:
+        with _executor_lock:
+            if _retrieval_executor is None:
+                _retrieval_executor = ThreadPoolExecutor(max_workers=max(1, RETRIEVAL_WORKERS),
+                                                         thread_name_prefix='rag')
+    return _retrieval_executor
+
+
+async def run_retrieval(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Ejecuta func(*args, **kwargs) en el executor de búsqueda sin bloquear el event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_retrieval_executor(), functools.partial(func, *args, **kwargs))
+
+
+def add_domain_seed_phrases(phrases: Iterable[str]):
+    """Añade frases al léxico de dominio de este motor y de los que se publiquen después"""
+    new = [phrase for phrase in phrases if phrase not in DOMAIN_SEED_PHRASES]
+    DOMAIN_SEED_PHRASES.extend(new)
+    if new and _rag_instance is not None:
+        _rag_instance.build_domain_lexicon()
+
+
+# Estado derivado de cada versión del motor (p. ej. el clasificador de intención)
+_reload_hooks: List[Callable[[RAGEngine], None]] = []
+
+def add_reload_hook(hook: Callable[[RAGEngine], None]):
+    """
+    Registra hook(engine), que prepara su estado para cada versión nueva del motor
+    antes de publicarla: corre en el hilo de la recarga (fuera del event loop) y
+    bajo el lock de recarga, así que nunca hay dos a la vez.
+    """
+    _reload_hooks.append(hook)
+
+
+def reload_rag_engine(path: Optional[str] = None) -> Dict[str, int]:
+    """
+    Recarga la base de conocimiento y publica la nueva versión del motor.
+
+    La publicación es un intercambio atómico de la referencia del singleton: las
+    búsquedas que ya tenían la instancia anterior terminan sobre ella y las
+    siguientes usan la nueva. Los hooks de recarga se ejecutan antes de publicar.
+    Si el JSON no es válido (o falla un hook) se lanza la excepción y la versión
+    publicada no cambia.
+    """
     global _rag_instance
-    if _rag_instance is None:
-        base_path = os.path.dirname(os.path.dirname(__file__))
-        kb_path = os.path.join(base_path, 'knowledge_base.json')
-        _rag_instance = RAGEngine(kb_path)
-    return _rag_instance
+    with _reload_lock:
+        engine, stats = get_rag_engine().reload(path)
+        for hook in _reload_hooks:
+            hook(engine)
+        _rag_instance = engine
+    return stats
@@ -0,0 +1,212 @@
+"""
+Pool opcional de procesos de búsqueda (escala la recuperación a varios núcleos).
+
+La búsqueda es Python + numpy y comparte el GIL: en un solo proceso uvicorn
+usa un núcleo. Con RAG_PROCESS_WORKERS > 0, cada worker abre su propio
+RAGEngine desde el artefacto del índice: los arrays se cargan con mmap, así que
+los procesos comparten las páginas en la caché del sistema en vez de copiar
+el índice.
+
+El cliente es async: las peticiones que llegan dentro de una ventana corta
+(RAG_BATCH_WINDOW_MS) se agrupan y se reparten en lotes entre los workers,
+que las puntúan juntas (search_dual_many). Los workers devuelven filas y
+scores; el proceso principal los traduce a sus QA pairs. Si la base cambió
+(otro kb_hash), el worker abre la versión nueva. Cada lote lleva la
+configuración de scoring del motor (search_config): si cambió en el proceso
+principal (set_fusion, set_ann, add_scorer), los workers no la tienen y la
+búsqueda se hace en local, igual que si el pool falla.
+"""
+import asyncio
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .rag_engine import AnalyzedQuery, RAGEngine, run_retrieval
+
+PROCESS_WORKERS = int(os.getenv('RAG_PROCESS_WORKERS', '0'))          # 0 = sin pool (búsqueda en el proceso)
+BATCH_WINDOW_MS = float(os.getenv('RAG_BATCH_WINDOW_MS', '2'))        # Espera máxima para agrupar peticiones
+MAX_BATCH = int(os.getenv('RAG_MAX_BATCH', '32'))
+
+# Petición al worker: (texto, top_k, categorías o None)
+Request = Tuple[str, int, Optional[Tuple[str, ...]]]
+# Respuesta: filas y scores de (filtrados, sin filtro)
+RowResults = Tuple[List[int], List[float], List[int], List[float]]
+
+
+# ---- Lado worker (funciones de módulo: se envían por pickle) ----
+
+_worker_engine: Optional[RAGEngine] = None
+_worker_rows: Dict[int, int] = {}
+
+
+def _open_worker_engine(kb_path: str, index_dir: Optional[str]):
+    """Abre el motor desde el artefacto (mmap) e indexa la fila de cada QA pair"""
+    global _worker_engine, _worker_rows
+    _worker_engine = RAGEngine(kb_path, index_dir)
+    _worker_rows = {id(qa): row for row, qa in enumerate(_worker_engine.qa_pairs)}
+
+
+def _init_worker(kb_path: str, index_dir: Optional[str]):
+    _open_worker_engine(kb_path, index_dir)
+    print(f"[RAG] Worker de búsqueda {os.getpid()} listo ({len(_worker_engine.qa_pairs)} documentos)")
+
+
+def _worker_config() -> tuple:
+    """Configuración de scoring del worker (la que lee del entorno al arrancar)"""
+    return _worker_engine.search_config()
+
+
+def _worker_search(kb_hash: str, config: tuple, requests: List[Request]) -> Optional[List[RowResults]]:
+    """Lote de search_dual; None si el worker no tiene la versión kb_hash de la base o la configuración `config`"""
+    if _worker_engine.kb_hash != kb_hash:
+        _open_worker_engine(_worker_engine.knowledge_base_path, _worker_engine.index_dir)
+        if _worker_engine.kb_hash != kb_hash:
+            return None
+    if _worker_engine.search_config() != config:
+        return None
+
+    # Las peticiones con el mismo top_k y categorías se puntúan juntas
+    groups: Dict[Tuple[int, Optional[Tuple[str, ...]]], List[int]] = defaultdict(list)
+    for i, (_, top_k, categories) in enumerate(requests):
+        groups[(top_k, categories)].append(i)
+    results: List[Optional[RowResults]] = [None] * len(requests)
+    for (top_k, categories), positions in groups.items():
+        found = _worker_engine.search_dual_many([requests[i][0] for i in positions], top_k,
+                                                list(categories) if categories else None)
+        for i, (filtered, unfiltered) in zip(positions, found):
+            results[i] = ([_worker_rows[id(qa)] for qa, _ in filtered], [score for _, score in filtered],
+                          [_worker_rows[id(qa)] for qa, _ in unfiltered], [score for _, score in unfiltered])
+    return results
+
+
+# ---- Lado cliente (proceso principal) ----
+
+class RetrievalPool:
+    """Cliente async del pool de procesos, con agrupación de peticiones en lotes"""
+
+    def __init__(self, kb_path: str, index_dir: Optional[str] = None, workers: int = PROCESS_WORKERS,
+                 batch_window_ms: float = BATCH_WINDOW_MS, max_batch: int = MAX_BATCH):
+        self.workers = workers
+        self.batch_window = batch_window_ms / 1000
+        self.max_batch = max_batch
+        # spawn: los workers no heredan hilos ni estado del servidor, cargan el artefacto
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_worker, initargs=(kb_path, index_dir))
+        self._pending: List[Tuple[RAGEngine, Request, asyncio.Future]] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+        self.worker_config: Optional[tuple] = None
+        self.requests = 0
+        self.batches = 0
+        self.fallbacks = 0
+        self.config_fallbacks = 0
+
+    async def start(self):
+        """Arranca todos los workers (cada uno abre el índice) antes de recibir tráfico"""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        configs = await asyncio.gather(*(loop.run_in_executor(self.executor, _worker_config)
+                                         for _ in range(self.workers)))
+        self.worker_config = configs[0]
+        elapsed = (time.perf_counter() - start) * 1000
+        print(f"[RAG] Pool de búsqueda: {self.workers} procesos listos en {elapsed:.0f} ms")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    async def search_dual(self, rag: RAGEngine, query: AnalyzedQuery, top_k: int = 5,
+                          categories: Optional[Sequence[str]] = None
+                          ) -> Tuple[List[Tuple[dict, float]], List[Tuple[dict, float]]]:
+        """Igual que rag.search_dual(query, top_k, categories), resuelto por el pool"""
+        if rag.search_config() != self.worker_config:
+            # Scoring cambiado en este proceso: los workers darían otros resultados
+            self.config_fallbacks += 1
+            return await run_retrieval(rag.search_dual, query, top_k, list(categories) if categories else None)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        request = (query.raw, top_k, tuple(categories) if categories else None)
+        self._pending.append((rag, request, future))
+        self.requests += 1
+        if len(self._pending) >= self.max_batch * self.workers:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.batch_window, self._flush)
+        try:
+            return await future
+        except Exception as e:
+            # Worker caído o base que el pool no puede abrir: se busca en local
+            self.fallbacks += 1
+            print(f"[RAG] Pool de búsqueda no disponible ({type(e).__name__}: {e}), búsqueda local")
+            return await run_retrieval(rag.search_dual, query, top_k, list(categories) if categories else None)
+
+    def _flush(self):
+        """Reparte las peticiones pendientes en lotes (uno por worker como mínimo)"""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        pending, self._pending = self._pending, []
+        by_engine: Dict[int, List[Tuple[RAGEngine, Request, asyncio.Future]]] = defaultdict(list)
+        for item in pending:
+            by_engine[id(item[0])].append(item)
+        for items in by_engine.values():
+            size = min(self.max_batch, max(1, -(-len(items) // self.workers)))
+            for start in range(0, len(items), size):
+                asyncio.ensure_future(self._run_batch(items[start:start + size]))
+
+    async def _run_batch(self, items: List[Tuple[RAGEngine, Request, asyncio.Future]]):
+        rag = items[0][0]
+        self.batches += 1
+        try:
+            found = await asyncio.get_running_loop().run_in_executor(
+                self.executor, _worker_search, rag.kb_hash, rag.search_config(), [request for _, request, _ in items])
+            if found is None:
+                raise RuntimeError(f"los workers no tienen la versión {rag.kb_hash} de la base "
+                                   f"o su configuración de búsqueda")
+        except Exception as e:
+            for _, _, future in items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        qa_pairs = rag.qa_pairs
+        for (_, _, future), (rows_f, scores_f, rows_u, scores_u) in zip(items, found):
+            if not future.done():
+                future.set_result(([(qa_pairs[r], s) for r, s in zip(rows_f, scores_f)],
+                                   [(qa_pairs[r], s) for r, s in zip(rows_u, scores_u)]))
+
+    def stats(self) -> Dict[str, float]:
+        """Contadores para /api/health"""
+        return {
+            'workers': self.workers,
+            'requests': self.requests,
+            'batches': self.batches,
+            'avg_batch': round(self.requests / self.batches, 2) if self.batches else 0.0,
+            'fallbacks': self.fallbacks,
+            'config_fallbacks': self.config_fallbacks,
+        }
+
+
+# Pool global (None = búsqueda en el proceso)
+_retrieval_pool: Optional[RetrievalPool] = None
+
+
+def get_retrieval_pool() -> Optional[RetrievalPool]:
+    return _retrieval_pool
+
+
+async def start_retrieval_pool(rag: RAGEngine, workers: int = PROCESS_WORKERS) -> Optional[RetrievalPool]:
+    """Arranca el pool si workers > 0 (tras guardar el artefacto del índice de `rag`)"""
+    global _retrieval_pool
+    if workers > 0 and _retrieval_pool is None:
+        pool = RetrievalPool(rag.knowledge_base_path, rag.index_dir, workers)
+        await pool.start()
+        _retrieval_pool = pool
+    return _retrieval_pool
+
+
+def stop_retrieval_pool():
+    global _retrieval_pool
+    if _retrieval_pool is not None:
+        _retrieval_pool.shutdown()
+        _retrieval_pool = None
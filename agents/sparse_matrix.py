@@ -0,0 +1,316 @@
+"""
+Matriz dispersa mínima (CSR) sobre numpy para el índice TF-IDF del RAG.
+Evita depender de scipy: solo guarda los valores distintos de cero.
+"""
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+
+class CSRMatrix:
+    """
+    Matriz dispersa en formato CSR (filas = documentos, columnas = términos).
+
+    Guarda además la transpuesta (CSC) para puntuar una query recorriendo
+    solo las columnas de sus términos no nulos.
+    """
+
+    # Arrays que definen la estructura (compartibles entre matrices con el mismo patrón)
+    STRUCTURE_ARRAYS = ('indptr', 'indices', 'col_ptr', 'col_rows', 'col_order')
+
+    def __init__(self, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray,
+                 shape: Tuple[int, int]):
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.shape = shape
+        self._build_columns()
+
+    @classmethod
+    def from_rows(cls, rows: List[Tuple[np.ndarray, np.ndarray]], n_cols: int,
+                  dtype=np.float64) -> "CSRMatrix":
+        """Construye la matriz a partir de una lista de filas (índices, valores)"""
+        lengths = np.array([len(idx) for idx, _ in rows], dtype=np.int64)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        if rows:
+            indices = np.concatenate([idx for idx, _ in rows]).astype(np.int32)
+            data = np.concatenate([val for _, val in rows]).astype(dtype)
+        else:
+            indices = np.zeros(0, dtype=np.int32)
+            data = np.zeros(0, dtype=dtype)
+        return cls(indptr, indices, data, (len(rows), n_cols))
+
+    @classmethod
+    def from_coo(cls, rows: np.ndarray, cols: np.ndarray, values: np.ndarray,
+                 shape: Tuple[int, int], dtype=np.float64) -> "CSRMatrix":
+        """Construye la matriz desde tripletas (fila, columna, valor), sumando duplicados"""
+        n_rows, n_cols = shape
+        keys = rows.astype(np.int64) * max(n_cols, 1) + cols.astype(np.int64)
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        data = np.bincount(inverse, weights=values, minlength=len(unique_keys))
+        out_rows = unique_keys // max(n_cols, 1)
+        indices = (unique_keys % max(n_cols, 1)).astype(np.int32)
+        indptr = np.zeros(n_rows + 1, dtype=np.int64)
+        np.cumsum(np.bincount(out_rows, minlength=n_rows), out=indptr[1:])
+        return cls(indptr, indices, data.astype(dtype), shape)
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], prefix: str, shape: Tuple[int, int],
+                    structure: Optional["CSRMatrix"] = None) -> "CSRMatrix":
+        """
+        Reconstruye la matriz desde arrays guardados (sin recalcular la vista por columnas).
+        Si se pasa `structure`, reutiliza sus arrays de estructura y solo lee los datos.
+        """
+        matrix = cls.__new__(cls)
+        matrix.shape = shape
+        for name in cls.STRUCTURE_ARRAYS:
+            value = getattr(structure, name) if structure is not None else arrays[prefix + name]
+            setattr(matrix, name, value)
+        matrix.data = arrays[prefix + 'data']
+        matrix.col_data = arrays[prefix + 'col_data']
+        return matrix
+
+    def to_arrays(self, prefix: str, include_structure: bool = True) -> Dict[str, np.ndarray]:
+        """Arrays necesarios para persistir la matriz (ver from_arrays)"""
+        arrays = {prefix + 'data': self.data, prefix + 'col_data': self.col_data}
+        if include_structure:
+            for name in self.STRUCTURE_ARRAYS:
+                arrays[prefix + name] = getattr(self, name)
+        return arrays
+
+    def _build_columns(self):
+        """Construye la vista por columnas (término → documentos)"""
+        n_rows, n_cols = self.shape
+        self.col_order = np.argsort(self.indices, kind='stable').astype(np.int32)
+        self.col_rows = self.row_ids()[self.col_order]
+        self.col_data = self.data[self.col_order]
+        self.col_ptr = np.zeros(n_cols + 1, dtype=np.int64)
+        np.cumsum(np.bincount(self.indices, minlength=n_cols), out=self.col_ptr[1:])
+
+    def with_data(self, data: np.ndarray) -> "CSRMatrix":
+        """Matriz con el mismo patrón de no nulos y otros valores (comparte la estructura)"""
+        matrix = CSRMatrix.__new__(CSRMatrix)
+        matrix.shape = self.shape
+        for name in self.STRUCTURE_ARRAYS:
+            setattr(matrix, name, getattr(self, name))
+        matrix.data = data
+        matrix.col_data = data[self.col_order]
+        return matrix
+
+    def row_ids(self) -> np.ndarray:
+        """Fila de cada valor almacenado (en orden CSR)"""
+        return np.repeat(np.arange(self.shape[0], dtype=np.int32), np.diff(self.indptr))
+
+    def row(self, i: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Devuelve (índices, valores) de la fila i"""
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:end], self.data[start:end]
+
+    def _row_offsets(self, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Posiciones (orden CSR) de las entradas de `rows`, concatenadas, y longitud de cada fila"""
+        starts = self.indptr[rows]
+        lengths = self.indptr[np.asarray(rows) + 1] - starts
+        total = int(lengths.sum())
+        return np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total), lengths
+
+    def take_rows(self, rows: np.ndarray) -> "CSRMatrix":
+        """Matriz con las filas `rows` en ese orden (fila i = fila rows[i] de esta)"""
+        offsets, lengths = self._row_offsets(rows)
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        return CSRMatrix(indptr, self.indices[offsets], self.data[offsets], (len(rows), self.shape[1]))
+
+    def dense_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Filas `rows` como matriz densa (len(rows) × columnas)"""
+        offsets, lengths = self._row_offsets(rows)
+        dense = np.zeros((len(rows), self.shape[1]), dtype=self.data.dtype)
+        dense[np.repeat(np.arange(len(rows)), lengths), self.indices[offsets]] = self.data[offsets]
+        return dense
+
+    def row_sums(self) -> np.ndarray:
+        """Suma de los valores de cada fila"""
+        return np.bincount(self.row_ids(), weights=self.data, minlength=self.shape[0])
+
+    def column_nnz(self) -> np.ndarray:
+        """Número de valores no nulos por columna (frecuencia documental)"""
+        return np.diff(self.col_ptr)
+
+    def dot_sparse(self, q_indices: np.ndarray, q_values: np.ndarray) -> np.ndarray:
+        """
+        Producto matriz × vector disperso.
+
+        El coste depende solo de las entradas de las columnas de la query,
+        no de documentos × vocabulario.
+        """
+        n_rows = self.shape[0]
+        if len(q_indices) == 0:
+            return np.zeros(n_rows)
+        starts = self.col_ptr[q_indices]
+        ends = self.col_ptr[q_indices + 1]
+        lengths = ends - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(n_rows)
+        # Posiciones de todas las entradas de las columnas de la query
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        weights = self.col_data[offsets] * np.repeat(q_values, lengths)
+        return np.bincount(self.col_rows[offsets], weights=weights, minlength=n_rows)
+
+    def column_positions(self, row_bounds: np.ndarray) -> np.ndarray:
+        """
+        Posición en la vista por columnas de la primera entrada con fila ≥ cada cota
+        (columnas × len(row_bounds)): las entradas de la columna j con filas en
+        [row_bounds[a], row_bounds[b]) son col_rows[pos[j, a]:pos[j, b]].
+        """
+        n_rows, n_cols = self.shape
+        col_ids = np.repeat(np.arange(n_cols, dtype=np.int64), np.diff(self.col_ptr))
+        keys = col_ids * (n_rows + 1) + self.col_rows
+        targets = (np.arange(n_cols, dtype=np.int64)[:, None] * (n_rows + 1) +
+                   np.asarray(row_bounds, dtype=np.int64)[None, :])
+        return np.searchsorted(keys, targets)
+
+    def dot_sparse_ranges(self, q_values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """
+        Como dot_sparse, pero solo sobre tramos de las columnas de la query.
+
+        starts/ends (términos de la query × tramos) son posiciones de la vista por
+        columnas (ver column_positions). Las filas fuera de los tramos quedan a 0 y
+        las de dentro dan exactamente el mismo score que dot_sparse.
+        """
+        n_rows = self.shape[0]
+        lengths = (ends - starts).ravel()
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros(n_rows)
+        offsets = np.repeat(starts.ravel() - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        weights = self.col_data[offsets] * np.repeat(np.repeat(q_values, starts.shape[1]), lengths)
+        return np.bincount(self.col_rows[offsets], weights=weights, minlength=n_rows)
+
+    def dot_sparse_many(self, q_rows: np.ndarray, q_indices: np.ndarray, q_values: np.ndarray,
+                        n_queries: int) -> np.ndarray:
+        """
+        Producto matriz × lote de queries dispersas (tripletas query, término, valor).
+
+        Devuelve scores densos (queries × filas). Equivale a llamar a dot_sparse
+        por cada query, pero acumula todas las entradas en un único bincount.
+        """
+        n_rows = self.shape[0]
+        if len(q_indices) == 0:
+            return np.zeros((n_queries, n_rows))
+        starts = self.col_ptr[q_indices]
+        lengths = self.col_ptr[q_indices + 1] - starts
+        total = int(lengths.sum())
+        if total == 0:
+            return np.zeros((n_queries, n_rows))
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(total)
+        weights = self.col_data[offsets] * np.repeat(q_values, lengths)
+        targets = np.repeat(np.asarray(q_rows, dtype=np.int64), lengths) * n_rows + self.col_rows[offsets]
+        return np.bincount(targets, weights=weights, minlength=n_queries * n_rows).reshape(n_queries, n_rows)
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria ocupada por los arrays de la matriz (ambas vistas)"""
+        return int(sum(getattr(self, name).nbytes for name in self.STRUCTURE_ARRAYS) +
+                   self.data.nbytes + self.col_data.nbytes)
+
+
+def merge_count_rows(matrices: Sequence[CSRMatrix], terms: List[str], sources: np.ndarray,
+                     new_rows: Dict[int, Sequence[Counter]]) -> Tuple[List[CSRMatrix], List[str]]:
+    """
+    Actualización incremental de matrices de frecuencias que comparten vocabulario.
+
+    Args:
+        matrices: Matrices actuales (una por campo), columnas = `terms`
+        terms: Vocabulario actual
+        sources: Para cada fila nueva, la fila actual que se conserva tal cual (-1 = fila nueva/editada)
+        new_rows: Fila nueva → frecuencias por matriz (Counter de términos) para las filas con -1
+
+    Returns:
+        (matrices, vocabulario) actualizados. Las columnas que quedan vacías en todas
+        las matrices se eliminan, así el resultado equivale a reconstruir desde cero.
+    """
+    term_to_id = {term: i for i, term in enumerate(terms)}
+    terms = list(terms)
+    for counters in new_rows.values():
+        for counts in counters:
+            for term in counts:
+                if term not in term_to_id:
+                    term_to_id[term] = len(terms)
+                    terms.append(term)
+
+    n_rows, n_cols = len(sources), len(terms)
+    kept_rows = np.flatnonzero(sources >= 0)
+    merged = []
+    for m, matrix in enumerate(matrices):
+        # Filas conservadas: copiar sus entradas (vectorizado) con su nueva posición
+        src = sources[kept_rows]
+        lengths = matrix.indptr[src + 1] - matrix.indptr[src]
+        total = int(lengths.sum())
+        offsets = (np.repeat(matrix.indptr[src] - np.cumsum(lengths) + lengths, lengths) +
+                   np.arange(total))
+        rows = [np.repeat(kept_rows, lengths)]
+        cols = [matrix.indices[offsets].astype(np.int64)]
+        vals = [np.asarray(matrix.data)[offsets]]
+        # Filas nuevas o editadas
+        for row, counters in new_rows.items():
+            counts = counters[m]
+            rows.append(np.full(len(counts), row, dtype=np.int64))
+            cols.append(np.fromiter((term_to_id[t] for t in counts), dtype=np.int64, count=len(counts)))
+            vals.append(np.fromiter(counts.values(), dtype=np.float64, count=len(counts)))
+        merged.append(CSRMatrix.from_coo(np.concatenate(rows), np.concatenate(cols),
+                                         np.concatenate(vals), (n_rows, n_cols), dtype=matrix.data.dtype))
+
+    # Eliminar términos que ya no aparecen en ningún documento
+    used = np.zeros(n_cols, dtype=bool)
+    for matrix in merged:
+        used |= matrix.column_nnz() > 0
+    if not used.all():
+        remap = np.cumsum(used) - 1
+        terms = [t for t, keep in zip(terms, used) if keep]
+        merged = [CSRMatrix(m.indptr, remap[m.indices].astype(np.int32), m.data, (n_rows, len(terms)))
+                  for m in merged]
+    return merged, terms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Índices de los k mayores scores, ordenados de mayor a menor.
+
+    Usa selección parcial (argpartition) en vez de ordenar todo el array.
+    Los empates se resuelven por índice de documento, como un sort estable.
+    """
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.zeros(0, dtype=np.int64)
+    if k < n:
+        part = np.argpartition(-scores, k - 1)[:k]
+        kth = scores[part].min()
+        candidates = np.flatnonzero(scores >= kth)
+    else:
+        candidates = np.arange(n)
+    order = np.lexsort((candidates, -scores[candidates]))
+    return candidates[order[:k]]
+
+
+def top_k_indices_rows(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    top_k_indices por cada fila de una matriz de scores (queries × documentos).
+
+    Selección parcial por filas y sort estable solo de los k candidatos, ordenados
+    antes por índice: mismo desempate por índice de documento. Las filas con
+    empates en el k-ésimo score (más de k candidatos) van por top_k_indices.
+    """
+    n_rows, n = scores.shape
+    if k <= 0 or n == 0:
+        return np.zeros((n_rows, 0), dtype=np.int64)
+    if k >= n:
+        return np.argsort(-scores, axis=1, kind='stable')
+    part = np.sort(np.argpartition(-scores, k - 1, axis=1)[:, :k], axis=1)
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    top = np.take_along_axis(part, order, axis=1)
+    tied = np.flatnonzero((scores >= part_scores.min(axis=1, keepdims=True)).sum(axis=1) > k)
+    for row in tied:
+        top[row] = top_k_indices(scores[row], k)
+    return top
@@ -0,0 +1,148 @@
+"""
+Corrección de términos mal escritos al estilo SymSpell (sin dependencias).
+
+En construcción se generan los borrados de cada término del vocabulario (hasta
+`max_distance` caracteres, solo sobre un prefijo de `prefix_length`) y se indexan
+por su hash: borrado → términos. En búsqueda se generan los borrados del token y
+se buscan todos a la vez en el array ordenado de hashes: solo los pocos candidatos
+encontrados se verifican con la distancia de edición, nunca el vocabulario entero.
+"""
+import sys
+from typing import List, Optional, Sequence, Set, Tuple
+import numpy as np
+
+
+def edit_distance(a: str, b: str, max_distance: int) -> int:
+    """
+    Distancia Damerau-Levenshtein (optimal string alignment): una transposición
+    de letras contiguas ("biopor" / "biopro") cuenta como una sola edición.
+    Devuelve max_distance + 1 si la distancia supera el máximo.
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    # El prefijo y el sufijo comunes no cambian la distancia: la tabla solo cubre el resto
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end = 0
+    while end < len(a) - start and end < len(b) - start and a[-1 - end] == b[-1 - end]:
+        end += 1
+    a, b = a[start:len(a) - end], b[start:len(b) - end]
+    if not a or not b:
+        return min(len(a) + len(b), max_distance + 1)
+
+    previous2: List[int] = []
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        previous2, previous = previous, current
+    return min(previous[-1], max_distance + 1)
+
+
+class SpellingIndex:
+    """
+    Índice de vecindario de borrados sobre un vocabulario con frecuencias.
+
+    Los borrados no se guardan como strings: cada uno se reduce a su hash (estable
+    dentro del proceso; el índice se construye al arrancar y no se persiste) en un
+    array ordenado, con los ids de sus términos agrupados al estilo CSR. Una
+    colisión de hash solo añade un candidato más, que la verificación descarta.
+
+    La distancia admitida crece con la longitud del token (`max_distance_for`):
+    los tokens cortos no se corrigen para no convertir palabras válidas que no
+    están en la base en términos parecidos pero ajenos.
+    """
+
+    def __init__(self, max_distance: int = 2, prefix_length: int = 7):
+        self.max_distance = max_distance
+        self.prefix_length = prefix_length
+        self.terms: List[str] = []
+        self.frequencies = np.zeros(0, dtype=np.int32)
+        self.delete_keys = np.zeros(0, dtype=np.int64)    # hash de cada borrado (ordenado, únicos)
+        self.delete_ptr = np.zeros(1, dtype=np.int64)     # términos del borrado k: delete_terms[ptr[k]:ptr[k + 1]]
+        self.delete_terms = np.zeros(0, dtype=np.int32)
+
+    def build(self, terms: Sequence[str], frequencies: Sequence[int]):
+        """Indexa los borrados de cada término (frecuencia = desempate entre candidatos)"""
+        self.terms = list(terms)
+        self.frequencies = np.asarray(frequencies, dtype=np.int32)
+        keys, term_ids = [], []
+        for term_id, term in enumerate(self.terms):
+            variants = self._variants(term[:self.prefix_length], self.max_distance)
+            keys.extend(hash(v) for v in variants)
+            term_ids.extend([term_id] * len(variants))
+        keys_arr = np.array(keys, dtype=np.int64)
+        order = np.argsort(keys_arr, kind='stable')
+        self.delete_keys, counts = np.unique(keys_arr[order], return_counts=True)
+        self.delete_ptr = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.delete_ptr[1:])
+        self.delete_terms = np.array(term_ids, dtype=np.int32)[order]
+
+    @property
+    def n_deletes(self) -> int:
+        return len(self.delete_keys)
+
+    def nbytes(self) -> int:
+        """Memoria de los arrays del índice (los términos son los del índice de keywords)"""
+        return int(self.frequencies.nbytes + self.delete_keys.nbytes + self.delete_ptr.nbytes +
+                   self.delete_terms.nbytes + sys.getsizeof(self.terms))
+
+    @staticmethod
+    def _variants(word: str, max_distance: int) -> Set[str]:
+        """La palabra y todas sus versiones con hasta max_distance caracteres borrados"""
+        variants = {word}
+        frontier = {word}
+        for _ in range(max_distance):
+            frontier = {w[:i] + w[i + 1:] for w in frontier if len(w) > 1 for i in range(len(w))}
+            variants |= frontier
+        return variants
+
+    def _candidates(self, variants: Set[str]) -> Set[int]:
+        """Ids de los términos que comparten algún borrado con la palabra"""
+        n_keys = len(self.delete_keys)
+        if not n_keys:
+            return set()
+        hashes = np.fromiter((hash(v) for v in variants), dtype=np.int64, count=len(variants))
+        pos = self.delete_keys.searchsorted(hashes)
+        pos[pos == n_keys] = n_keys - 1
+        pos = pos[self.delete_keys[pos] == hashes]
+        starts = self.delete_ptr[pos]
+        lengths = self.delete_ptr[pos + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return set(self.delete_terms[offsets].tolist())
+
+    def max_distance_for(self, word: str) -> int:
+        """Distancia permitida según la longitud: <6 → 0, 6-8 → 1, ≥9 → 2 (acotada por max_distance)"""
+        return min(self.max_distance, max(0, (len(word) - 3) // 3))
+
+    def lookup(self, word: str, max_distance: Optional[int] = None) -> List[Tuple[str, int]]:
+        """
+        Términos del vocabulario más cercanos a `word` como (término, distancia):
+        todos los de la distancia mínima encontrada, ordenados por frecuencia.
+        """
+        if max_distance is None:
+            max_distance = self.max_distance_for(word)
+        candidates = self._candidates(self._variants(word[:self.prefix_length], max(max_distance, 0)))
+
+        best_distance = max_distance + 1
+        best: List[int] = []
+        for term_id in candidates:
+            distance = edit_distance(word, self.terms[term_id], min(max_distance, best_distance))
+            if distance < best_distance:
+                best_distance, best = distance, [term_id]
+            elif distance == best_distance and distance <= max_distance:
+                best.append(term_id)
+        best.sort(key=lambda t: (-self.frequencies[t], self.terms[t]))
+        return [(self.terms[t], best_distance) for t in best]
+
+    def correct(self, word: str) -> Optional[str]:
+        """Término más probable para `word` (None si no hay ninguno a distancia permitida)"""
+        matches = self.lookup(word)
+        return matches[0][0] if matches else None
@@ -0,0 +1 @@
+# Benchmarks del sistema RAG (no se incluyen en la imagen Docker)
@@ -0,0 +1,88 @@
+"""
+Benchmark del índice aproximado IVF: recall y latencia frente a la búsqueda exacta.
+
+Genera una base sintética grande a partir de knowledge_base.json (preguntas
+recombinadas con fragmentos de otras respuestas), construye el motor y compara,
+para distintos n_probe, el top-k híbrido con IVF contra el exacto.
+
+Uso:
+    python -m benchmarks.bench_ann [--docs N] [--queries Q] [--top-k K]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _synthetic_kb(path: str, n_docs: int, seed: int = 0) -> list:
+    """Base sintética de n_docs QA pairs derivada de la base real"""
+    rng = random.Random(seed)
+    base_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    with open(os.path.join(base_path, 'knowledge_base.json'), 'r', encoding='utf-8') as f:
+        qa_pairs = json.load(f)['qa_pairs']
+    docs = []
+    for i in range(n_docs):
+        qa, other = rng.choice(qa_pairs), rng.choice(qa_pairs)
+        words = other['respuesta'].split()
+        start = rng.randrange(max(1, len(words) - 8))
+        docs.append({
+            'id': i,
+            'categoria': qa['categoria'],
+            'pregunta': f"{qa['pregunta']} {' '.join(words[start:start + 4])}",
+            'respuesta': f"{qa['respuesta']} {' '.join(words[start:start + 30])}",
+        })
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'qa_pairs': docs}, f, ensure_ascii=False)
+    return docs
+
+
+def _run(rag, queries, top_k):
+    """Resultados (ids) y latencia media por query en ms"""
+    start = time.perf_counter()
+    results = [[qa['id'] for qa, _ in rag.search(q, top_k=top_k)] for q in queries]
+    return results, (time.perf_counter() - start) / len(queries) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        kb_path = os.path.join(tmp, 'kb.json')
+        docs = _synthetic_kb(kb_path, args.docs)
+        with contextlib.redirect_stdout(io.StringIO()):
+            from agents.query_cache import QueryCache
+            from agents.rag_engine import RAGEngine
+            start = time.perf_counter()
+            rag = RAGEngine(kb_path, index_dir='')
+            build_s = time.perf_counter() - start
+            rag.set_ann('ivf')
+        rag.cache = QueryCache(max_entries=0)
+
+        rng = random.Random(1)
+        queries = [rag.analyze(rng.choice(docs)['pregunta'][:60]) for _ in range(args.queries)]
+
+        rag.set_ann('exact')
+        exact, exact_ms = _run(rag, queries, args.top_k)
+        print(f"Documentos: {args.docs} (construcción {build_s:.1f} s, {rag.ngrams.ivf.n_lists} listas IVF)")
+        print(f"  exacto:          {exact_ms:7.2f} ms/query")
+        n_lists = rag.ngrams.ivf.n_lists
+        for n_probe in [p for p in (1, 2, 4, 8, 16, 32, 64) if p < n_lists] + [n_lists]:
+            rag.set_ann('ivf', n_probe)
+            approx, approx_ms = _run(rag, queries, args.top_k)
+            recall = sum(len(set(a) & set(e)) for a, e in zip(approx, exact)) / sum(len(e) for e in exact)
+            print(f"  ivf n_probe={n_probe:<3d} {approx_ms:7.2f} ms/query  recall@{args.top_k}: {recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
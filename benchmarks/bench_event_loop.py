@@ -0,0 +1,164 @@
+"""
+Prueba de carga del event loop: latencia entre tokens mientras otras sesiones buscan.
+
+Simula `--streams` sesiones que emiten un token cada `--tick-ms` (como el streaming
+del LLM en websocket_chat) y `--sessions` sesiones que envían mensajes y
+ejecutan el mismo trabajo que el handler (análisis, reglas, búsqueda con
+fallback, contexto y enriquecimiento). Se compara el trabajo ejecutado dentro
+del event loop ("inline") con el executor acotado (run_retrieval) y, con
+--process-workers, con el pool de procesos: se informa el retraso entre tokens
+(p50/p99/máx) y el rendimiento de búsquedas. Con el pool se comprueba además que
+sus resultados son los de search_dual en local (con y sin filtro de categorías,
+y tras cambiar la fusión en el proceso principal, que debe resolverse en local).
+
+Uso:
+    python -m benchmarks.bench_event_loop [--docs N] [--sessions 16] [--streams 16] [--tick-ms 10]
+                                          [--process-workers N] [--check 50]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+async def _stream(tick: float, stop: asyncio.Event, gaps: list):
+    """Sesión que emite un token cada tick: guarda el retraso sobre lo previsto"""
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(tick)
+        now = time.perf_counter()
+        gaps.append(now - last - tick)
+        last = now
+
+
+async def _session(main, queries, offload: bool, done: list):
+    """Mismo trabajo por mensaje que websocket_chat (inline = todo en el event loop)"""
+    for query in queries:
+        if offload:
+            analyzed, _ = await main.run_retrieval(main._analyze_message, query)
+            _, agent = main._route_message(analyzed)
+            results = await agent.asearch_knowledge_with_fallback(analyzed, top_k=5)
+            await main.run_retrieval(main._build_context, agent, analyzed, results)
+        else:
+            analyzed, _ = main._analyze_message(query)
+            _, agent = main._route_message(analyzed)
+            results = agent.search_knowledge_with_fallback(analyzed, top_k=5)
+            main._build_context(agent, analyzed, results)
+        done.append(1)
+        await asyncio.sleep(0)
+
+
+def _same_results(a, b) -> bool:
+    """Mismos documentos en el mismo orden y mismos scores (tolerancia de redondeo)"""
+    return len(a) == len(b) and all(qa_a is qa_b and np.isclose(s_a, s_b) for (qa_a, s_a), (qa_b, s_b) in zip(a, b))
+
+
+async def _check_pool(pool, rag, queries, categories) -> int:
+    """Consultas (de la muestra) en que el pool no coincide con search_dual en local"""
+    mismatches = 0
+    for cats in (None, categories):
+        analyzed = [rag.analyze(q) for q in queries]
+        found = await asyncio.gather(*(pool.search_dual(rag, q, 5, cats) for q in analyzed))
+        for query, (filtered, unfiltered) in zip(analyzed, found):
+            local_filtered, local_unfiltered = rag.search_dual(query, 5, cats)
+            mismatches += not (_same_results(filtered, local_filtered) and _same_results(unfiltered, local_unfiltered))
+    return mismatches
+
+
+async def _run(main, queries, args, offload: bool) -> dict:
+    stop = asyncio.Event()
+    gaps: list = []
+    streams = [asyncio.create_task(_stream(args.tick_ms / 1000, stop, gaps)) for _ in range(args.streams)]
+    await asyncio.sleep(args.tick_ms / 1000)
+    done: list = []
+    per_session = [queries[i::args.sessions] for i in range(args.sessions)]
+    start = time.perf_counter()
+    await asyncio.gather(*(_session(main, q, offload, done) for q in per_session))
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await asyncio.gather(*streams)
+    delay_ms = np.asarray(gaps) * 1000
+    return {'p50': float(np.percentile(delay_ms, 50)), 'p99': float(np.percentile(delay_ms, 99)),
+            'max': float(delay_ms.max()), 'searches_s': len(done) / elapsed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--docs", type=int, default=0, help="base sintética de N documentos (0 = base real)")
+    parser.add_argument("--sessions", type=int, default=16, help="sesiones enviando mensajes")
+    parser.add_argument("--streams", type=int, default=16, help="sesiones recibiendo tokens")
+    parser.add_argument("--messages", type=int, default=400, help="mensajes en total")
+    parser.add_argument("--tick-ms", type=float, default=10.0, help="intervalo entre tokens simulado")
+    parser.add_argument("--process-workers", type=int, default=0,
+                        help="medir también el pool de procesos con N workers (RAG_PROCESS_WORKERS)")
+    parser.add_argument("--check", type=int, default=50, help="consultas de la comprobación pool = local")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(io.StringIO()):
+        import agents.rag_engine as rag_engine
+        from agents.query_cache import QueryCache
+        if args.docs:
+            from benchmarks.bench_ann import _synthetic_kb
+            kb_path = os.path.join(tmp, 'kb.json')
+            _synthetic_kb(kb_path, args.docs)
+            rag_engine._rag_instance = rag_engine.RAGEngine(kb_path, index_dir=os.path.join(tmp, 'index'))
+        import main as app_main
+        from agents.orchestrator import Orchestrator
+        from benchmarks.bench_retrieval import build_golden_set
+        app_main.orchestrator = Orchestrator()
+        rag = rag_engine.get_rag_engine()
+        rag.cache = QueryCache(max_entries=0)  # cada mensaje busca de verdad
+        golden = build_golden_set(rag.qa_pairs[:500], rag.PRODUCT_ALIASES)
+        queries = [g['query'] for g in golden][:args.messages]
+
+        results = {'inline': asyncio.run(_run(app_main, queries, args, offload=False)),
+                   'executor': asyncio.run(_run(app_main, queries, args, offload=True))}
+        if args.process_workers:
+            from agents import retrieval_pool
+
+            async def run_pool():
+                pool = await retrieval_pool.start_retrieval_pool(rag, args.process_workers)
+                try:
+                    run = await _run(app_main, queries, args, offload=True)
+                    stats = pool.stats()
+                    sample = queries[:args.check]
+                    categories = app_main.orchestrator.agents['objeciones'].categories
+                    checks = {'misma configuración': await _check_pool(pool, rag, sample, categories)}
+                    fusion = rag.fusion
+                    rag.set_fusion('rrf' if fusion.method != 'rrf' else 'weighted')
+                    try:
+                        checks['fusión cambiada'] = await _check_pool(pool, rag, sample, categories)
+                    finally:
+                        rag.set_fusion(fusion.method, rrf_k=fusion.rrf_k)
+                    return run, stats, checks, pool.stats()['config_fallbacks']
+                finally:
+                    retrieval_pool.stop_retrieval_pool()
+            results[f'pool ×{args.process_workers}'], pool_stats, pool_checks, config_fallbacks = asyncio.run(run_pool())
+
+    print(f"Documentos: {len(rag.qa_pairs)}, {len(queries)} mensajes, {args.sessions} sesiones buscando, "
+          f"{args.streams} en streaming (token cada {args.tick_ms:g} ms), "
+          f"{rag_engine.RETRIEVAL_WORKERS} hilos de búsqueda")
+    print(f"  {'':12s} {'retraso p50':>12s} {'p99':>9s} {'máx':>9s} {'búsquedas/s':>12s}")
+    for name, r in results.items():
+        print(f"  {name:12s} {r['p50']:9.2f} ms {r['p99']:6.2f} ms {r['max']:6.2f} ms {r['searches_s']:12.0f}")
+    if args.process_workers:
+        print(f"  pool: {pool_stats['batches']} lotes (media {pool_stats['avg_batch']} peticiones), "
+              f"{pool_stats['fallbacks']} búsquedas locales por fallo")
+        for name, mismatches in pool_checks.items():
+            print(f"  pool = search_dual local ({name}, {2 * min(args.check, len(queries))} consultas): "
+                  f"{'sí' if not mismatches else f'no ({mismatches} distintas)'}")
+        print(f"  búsquedas locales por configuración distinta: {config_fallbacks}")
+        if any(pool_checks.values()):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Evaluación del clasificador local de intención frente a las reglas del Orchestrator.
+
+Validación cruzada estratificada (k particiones) sobre el conjunto de
+entrenamiento (preguntas de la base etiquetadas por categoría + ejemplos de
+agents/intent_examples.json): precisión global y por intención, precisión de las
+predicciones por encima del umbral de confianza, fracción de mensajes que irían
+al LLM y latencia por mensaje del clasificador y de las reglas.
+
+Uso:
+    python -m benchmarks.bench_intent [--folds 5] [--threshold 0.6]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _folds(labels, n_folds: int, seed: int):
+    """Particiones estratificadas: índices de test de cada partición"""
+    rng = np.random.default_rng(seed)
+    folds = [[] for _ in range(n_folds)]
+    for label in sorted(set(labels)):
+        indices = np.flatnonzero(np.asarray(labels) == label)
+        rng.shuffle(indices)
+        for i, index in enumerate(indices):
+            folds[i % n_folds].append(int(index))
+    return folds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--folds", type=int, default=5)
+    parser.add_argument("--threshold", type=float, default=None, help="confianza mínima (por defecto la configurada)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from agents.intent_classifier import IntentClassifier
+        from agents.orchestrator import Orchestrator
+        orchestrator = Orchestrator()
+    rag = orchestrator.rag
+    threshold = orchestrator.LLM_FALLBACK_CONFIDENCE if args.threshold is None else args.threshold
+
+    with open(orchestrator.INTENT_EXAMPLES_PATH, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    texts, labels = IntentClassifier.training_set(
+        rag.qa_pairs, orchestrator.category_intents(data.get('categories', {})), data['examples'])
+    intents = list(orchestrator.AGENT_MAP)
+
+    predicted, confidence = [None] * len(texts), np.zeros(len(texts))
+    for test in _folds(labels, args.folds, args.seed):
+        held_out = set(test)
+        train = [i for i in range(len(texts)) if i not in held_out]
+        classifier = IntentClassifier(rag, intents).fit([texts[i] for i in train], [labels[i] for i in train])
+        for i in test:
+            prediction = classifier.predict(texts[i])
+            predicted[i], confidence[i] = prediction.intent, prediction.probability
+
+    rules = [orchestrator.classify_intent_rules(text) for text in texts]
+    correct = np.array([p == label for p, label in zip(predicted, labels)])
+    rules_correct = np.array([r == label for r, label in zip(rules, labels)])
+    confident = confidence >= threshold
+
+    print(f"Ejemplos: {len(texts)} ({', '.join(f'{i}: {labels.count(i)}' for i in intents)}), "
+          f"{args.folds} particiones")
+    print(f"  {'':28s} {'clasificador':>12s} {'reglas':>8s}")
+    print(f"  {'precisión global':28s} {correct.mean():12.3f} {rules_correct.mean():8.3f}")
+    for intent in intents:
+        mask = np.array([label == intent for label in labels])
+        print(f"  {'  ' + intent:28s} {correct[mask].mean():12.3f} {rules_correct[mask].mean():8.3f}")
+    print(f"  confianza ≥ {threshold:.2f}: {confident.mean():.1%} de los mensajes, "
+          f"precisión {correct[confident].mean() if confident.any() else 0.0:.3f} "
+          f"(el {1 - confident.mean():.1%} restante iría al LLM)")
+
+    analyzed = [rag.analyze(text) for text in texts]
+    classifier = orchestrator.intent_classifier
+    for name, classify in (("clasificador", classifier.predict), ("reglas", orchestrator.classify_intent_rules)):
+        start = time.perf_counter()
+        for _ in range(20):
+            for query in analyzed:
+                classify(query)
+        elapsed = (time.perf_counter() - start) / (20 * len(analyzed)) * 1e6
+        print(f"  latencia {name:14s} {elapsed:8.1f} µs/mensaje")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Tamaño y reutilización del prompt del chat en conversaciones simuladas.
+
+Simula `--sessions` conversaciones de `--turns` turnos con las preguntas del
+golden set: mismo enrutado, búsqueda y contexto que websocket_chat, y una
+respuesta sintética de `--answer-chars` caracteres (los hechos recuperados) que
+pasa al historial (compactado como en websocket_chat, o literal con
+--no-compaction). Para cada petición se informa el tamaño del prompt, la parte
+estática pre-renderizada, los tokens estimados (y los que ahorra el presupuesto
+de contexto), el prefijo común con la petición anterior de la misma sesión (lo
+que puede reutilizar la caché de prompts del proveedor) y el tiempo de
+empaquetado del contexto y construcción de los mensajes. Con --show-summary
+imprime el resumen del historial de la primera conversación.
+
+Uso:
+    python -m benchmarks.bench_prompt [--sessions 20] [--turns 8] [--answer-chars 4000] [--mode full]
+                                      [--no-compaction] [--show-summary]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MAX_HISTORY = 10  # Igual que websocket_chat
+
+
+def _serialize(messages) -> str:
+    return "".join(f"<{m['role']}>\n{m['content']}\n" for m in messages)
+
+
+def _common_prefix(a: str, b: str) -> int:
+    n = min(len(a), len(b))
+    if a[:n] == b[:n]:
+        return n
+    lo, hi = 0, n
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[:mid] == b[:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--answer-chars", type=int, default=4000, help="longitud de la respuesta simulada (~1000 tokens)")
+    parser.add_argument("--mode", default="full", choices=["full", "short"], help="response_mode")
+    parser.add_argument("--no-compaction", action="store_true",
+                        help="historial sin compactar (últimos MAX_HISTORY intercambios literales)")
+    parser.add_argument("--show-summary", action="store_true",
+                        help="imprime el resumen del historial de la primera conversación")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main as app_main
+        from agents.context_packer import estimate_tokens
+        from agents.conversation import ConversationHistory
+        from agents.orchestrator import Orchestrator
+        from agents.rag_engine import get_rag_engine
+        from benchmarks.bench_retrieval import build_golden_set
+        app_main.orchestrator = orchestrator = Orchestrator()
+        rag = get_rag_engine()
+    golden = build_golden_set(rag.qa_pairs, rag.PRODUCT_ALIASES)
+    queries = [g['query'] for g in golden]
+
+    prompt_chars, static_chars, reused, build_us, prompt_tokens, saved_tokens = [], [], [], [], [], []
+    compact_us = []
+    first_summary = ""
+    with contextlib.redirect_stdout(io.StringIO()):
+        for s in range(args.sessions):
+            conversation, history, previous = ConversationHistory(), [], ""
+            for t in range(args.turns):
+                message = queries[(s * args.turns + t) % len(queries)]
+                analyzed, _ = app_main._analyze_message(message)
+                intent, agent = app_main._route_message(analyzed)
+                results = agent.search_knowledge_with_fallback(analyzed, top_k=5)
+                start = time.perf_counter()
+                if not args.no_compaction:
+                    history = conversation.messages()
+                packed, _, _, coverage = app_main._build_context(agent, analyzed, results, history, args.mode)
+                messages = orchestrator.prompts.build_messages(
+                    intent, coverage, args.mode, packed.context, packed.history, message)
+                build_us.append((time.perf_counter() - start) * 1e6)
+                prompt_tokens.append(sum(estimate_tokens(m['content']) for m in messages))
+                saved_tokens.append(packed.saved_tokens)
+
+                serialized = _serialize(messages)
+                prompt_chars.append(len(serialized))
+                static_chars.append(len(messages[0]['content']))
+                if previous:
+                    reused.append(_common_prefix(previous, serialized) / len(serialized))
+                previous = serialized
+
+                facts = "\n\n".join(qa['respuesta'] for qa, _ in results) or message
+                answer = (facts * (args.answer_chars // len(facts) + 1))[:args.answer_chars]
+                if args.no_compaction:
+                    history += [{"role": "user", "content": message}, {"role": "assistant", "content": answer}]
+                    history = history[-(MAX_HISTORY * 2):]
+                else:
+                    start = time.perf_counter()
+                    conversation.add_exchange(message, answer)
+                    compact_us.append((time.perf_counter() - start) * 1e6)
+            if s == 0:
+                first_summary = conversation.summary_text()
+
+    print(f"Conversaciones: {args.sessions} × {args.turns} turnos, modo {args.mode}, "
+          f"respuestas de {args.answer_chars} caracteres, historial {'literal' if args.no_compaction else 'compactado'}")
+    print(f"  prompt medio:             {np.mean(prompt_chars):9.0f} caracteres (máx {max(prompt_chars)})")
+    print(f"  prefijo estático:         {np.mean(static_chars):9.0f} caracteres")
+    print(f"  tokens estimados:         {np.mean(prompt_tokens):9.0f} (máx {max(prompt_tokens)}), "
+          f"ahorrados por el presupuesto: {np.mean(saved_tokens):.0f} de media")
+    print(f"  tokens por turno:         " + " ".join(
+        f"{np.mean(prompt_tokens[t::args.turns]):.0f}" for t in range(args.turns)))
+    print(f"  prefijo común con la petición anterior: {np.mean(reused) if reused else 0.0:6.1%} del prompt")
+    print(f"  contexto y mensajes:      {np.mean(build_us):9.1f} µs")
+    if compact_us:
+        print(f"  guardar y compactar:      {np.mean(compact_us):9.1f} µs (máx {max(compact_us):.0f})")
+    if args.show_summary and first_summary:
+        print()
+        print(first_summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: CPU por mensaje con análisis compartido (AnalyzedQuery) vs análisis por consumidor.
+
+"antes": el flujo de 456601b. Cada consumidor (detección de mensajes vagos,
+reglas de intención, búsqueda, enriquecimiento) recibe el texto crudo y lo
+normaliza y tokeniza por su cuenta, y la búsqueda repite además su
+tokenización de entonces (expansión de sinónimos en texto y tokens con y sin
+raíz para el canal de keywords).
+"después": el mensaje se analiza una vez y todos reutilizan el AnalyzedQuery.
+La caché de resultados está desactivada en los dos: cada mensaje se puntúa.
+
+Uso:
+    python -m benchmarks.bench_query_analysis [--rounds N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MESSAGES = [
+    "¿Qué es BioPRO?",
+    "Un médico dice que es caro, ¿cómo respondo?",
+    "¿Cómo presento Novacutan a un dermatólogo?",
+    "Protocolo V-Lift para flacidez del óvalo facial",
+    "Diferencia entre FBio DVS Light, Medium y Volume",
+    "¿Qué aguja uso para labios?",
+    "El doctor prefiere Profhilo, no le convence",
+    "Contraindicaciones en embarazo y herpes",
+    "cuéntame más sobre la hialuronidasa",
+    "bio pro concentración",
+]
+
+
+def _legacy_search_tokenization(rag, message: str):
+    """Tokenización que la búsqueda hacía sobre el texto crudo en 456601b, además de su análisis"""
+    from agents.rag_engine import SYNONYMS
+    words = rag._tokenize(message, apply_stemming=False)
+    expanded = list(words)
+    for word in words:
+        expanded.extend(SYNONYMS.get(word, [])[:3])
+    rag._tokenize(' '.join(expanded))                       # canal TF-IDF (query expandida)
+    tokens = set(rag._tokenize(message, apply_stemming=False)) | set(rag._tokenize(message))
+    for token in tokens:                                    # canal keywords: sinónimos tokenizados por query
+        for synonym in SYNONYMS.get(token, [])[:3]:
+            rag._index_terms(synonym)
+
+
+def _pipeline_per_consumer(orchestrator, is_vague, message: str):
+    """Flujo anterior: cada etapa analiza el texto crudo por su cuenta"""
+    rag = orchestrator.rag
+    is_vague(rag.analyze(message))
+    intent = orchestrator.classify_intent_rules(rag.analyze(message))
+    agent = orchestrator.get_agent(intent)
+    _legacy_search_tokenization(rag, message)
+    results = agent.search_knowledge_with_fallback(rag.analyze(message), top_k=5)
+    agent.enrich_context(rag.analyze(message), results)
+
+
+def _pipeline_shared(orchestrator, is_vague, message: str):
+    """Flujo actual: un único AnalyzedQuery compartido"""
+    analyzed = orchestrator.analyze(message)
+    is_vague(analyzed)
+    intent = orchestrator.classify_intent_rules(analyzed)
+    agent = orchestrator.get_agent(intent)
+    results = agent.search_knowledge_with_fallback(analyzed, top_k=5)
+    agent.enrich_context(analyzed, results)
+
+
+def _measure(pipeline, orchestrator, is_vague, rounds: int) -> float:
+    """CPU media por mensaje en microsegundos"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.process_time()
+        for _ in range(rounds):
+            for message in MESSAGES:
+                pipeline(orchestrator, is_vague, message)
+        elapsed = time.process_time() - start
+    return elapsed / (rounds * len(MESSAGES)) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from agents.orchestrator import Orchestrator
+        from agents.query_cache import QueryCache
+        from main import is_greeting_or_vague
+        orchestrator = Orchestrator()
+        orchestrator.rag.cache = QueryCache(max_entries=0)  # cada mensaje busca de verdad
+
+    before = _measure(_pipeline_per_consumer, orchestrator, is_greeting_or_vague, args.rounds)
+    after = _measure(_pipeline_shared, orchestrator, is_greeting_or_vague, args.rounds)
+
+    print(f"Mensajes: {len(MESSAGES)} × {args.rounds} rondas")
+    print(f"  antes (análisis por consumidor): {before:8.1f} µs/mensaje")
+    print(f"  después (AnalyzedQuery):         {after:8.1f} µs/mensaje")
+    print(f"  ahorro:                          {100 * (1 - after / before):7.1f} %")
+
+
+if __name__ == "__main__":
+    main()
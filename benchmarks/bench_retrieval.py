@@ -0,0 +1,276 @@
+"""
+Evaluación de calidad y latencia del RAG sobre un conjunto dorado derivado de knowledge_base.json.
+
+Cada pregunta de la base genera queries cuya respuesta correcta es su propio
+documento: la pregunta exacta, una paráfrasis (plantillas de reformulación),
+sin acentos ni signos (estilo transcripción), con alias de producto ("bio-pro")
+y con un typo. Se informa recall@k y MRR globales, por variante y por
+categoría, y la latencia p50/p95/p99 de RAGEngine.search y de
+BaseAgent.search_knowledge_with_fallback (caché desactivada).
+
+La salida JSON (--output) permite comparar ejecuciones; con --compare se
+muestran las diferencias frente a un JSON anterior.
+
+Uso:
+    python -m benchmarks.bench_retrieval [--k 1 5 10] [--rounds N] [--output res.json] [--compare base.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Reformulaciones del inicio de la pregunta (la primera que encaja)
+PARAPHRASES: List[Tuple[str, str]] = [
+    (r'^¿qué es (.*)\?$', r'háblame de \1'),
+    (r'^¿cuáles? (?:es|son) (.*)\?$', r'dime \1'),
+    (r'^¿por qué (.*)\?$', r'explícame por qué \1'),
+    (r'^¿puedo (.*)\?$', r'se puede \1'),
+    (r'^¿cómo (.*)\?$', r'de qué manera \1'),
+    (r'^¿cuánt([oa]s?) (.*)\?$', r'quiero saber cuánt\1 \2'),
+    (r'^el doctor (.*)$', r'un médico \1'),
+    (r'^técnica para (.*)$', r'cómo hago \1'),
+    (r'^compara (.*)$', r'diferencias entre \1'),
+]
+
+# Letras sustituidas al generar typos (errores de teclado/transcripción frecuentes)
+TYPO_LETTERS = 'aeiourslnt'
+
+
+def _strip_accents(text: str) -> str:
+    text = unicodedata.normalize('NFD', text)
+    return ''.join(c for c in text if unicodedata.category(c) != 'Mn')
+
+
+def _spoken(text: str) -> str:
+    """Minúsculas sin acentos ni signos, como llega una transcripción"""
+    return re.sub(r'[¿?¡!.,;:]', '', _strip_accents(text.lower())).strip()
+
+
+def _paraphrase(pregunta: str) -> str:
+    lower = pregunta.lower()
+    for pattern, replacement in PARAPHRASES:
+        if re.match(pattern, lower):
+            return re.sub(pattern, replacement, lower)
+    return f"necesito información: {_spoken(pregunta)}"
+
+
+def _alias_variants(aliases: Dict[str, str]) -> List[Tuple[re.Pattern, str]]:
+    """Forma canónica → primer alias (con guion) que la produce, de la más larga a la más corta"""
+    inverse: Dict[str, str] = {}
+    for alias, canonical in aliases.items():
+        inverse.setdefault(canonical, alias)
+    return [(re.compile(r'\b' + re.escape(canonical) + r'\b', re.IGNORECASE), alias)
+            for canonical, alias in sorted(inverse.items(), key=lambda item: -len(item[0]))]
+
+
+def _typo(pregunta: str, rng: random.Random) -> str:
+    """Un error (sustitución, borrado o transposición) en una palabra larga"""
+    words = pregunta.split()
+    candidates = [i for i, w in enumerate(words) if len(w) >= 7 and w.isalpha()]
+    if not candidates:
+        return ""
+    i = rng.choice(candidates)
+    word = words[i]
+    pos = rng.randrange(1, len(word) - 1)
+    op = rng.choice('sdt')
+    if op == 's':
+        word = word[:pos] + rng.choice(TYPO_LETTERS) + word[pos + 1:]
+    elif op == 'd':
+        word = word[:pos] + word[pos + 1:]
+    else:
+        word = word[:pos - 1] + word[pos] + word[pos - 1] + word[pos + 1:]
+    words[i] = word
+    return ' '.join(words)
+
+
+def build_golden_set(qa_pairs: List[dict], aliases: Dict[str, str], seed: int = 0) -> List[dict]:
+    """Queries {query, variante, id esperado, categoría} generadas desde la base"""
+    rng = random.Random(seed)
+    alias_patterns = _alias_variants(aliases)
+    golden = []
+    for qa in qa_pairs:
+        pregunta = qa['pregunta']
+        variants = {
+            'exacta': pregunta,
+            'parafrasis': _paraphrase(pregunta),
+            'sin_acentos': _spoken(pregunta),
+            'typo': _typo(pregunta, rng),
+        }
+        aliased = pregunta
+        for pattern, alias in alias_patterns:
+            aliased = pattern.sub(alias, aliased)
+        if aliased != pregunta:
+            variants['alias'] = aliased
+        for variant, query in variants.items():
+            if query:
+                golden.append({'query': query, 'variant': variant,
+                               'expected': qa['id'], 'category': qa['categoria']})
+    return golden
+
+
+def _retrieval_metrics(ranks: List[int], ks: List[int]) -> Dict[str, float]:
+    """recall@k y MRR a partir de la posición (1-based, 0 = no encontrado) del documento correcto"""
+    ranks_arr = np.asarray(ranks)
+    found = ranks_arr > 0
+    metrics = {'queries': len(ranks)}
+    for k in ks:
+        metrics[f'recall@{k}'] = round(float(np.mean(found & (ranks_arr <= k))), 4) if ranks else 0.0
+    reciprocal = np.where(found, 1.0 / np.maximum(ranks_arr, 1), 0.0)
+    metrics['mrr'] = round(float(reciprocal.mean()), 4) if ranks else 0.0
+    return metrics
+
+
+def evaluate_retrieval(rag, golden: List[dict], ks: List[int]) -> dict:
+    """Métricas globales, por variante y por categoría (search_many = mismos resultados que search)"""
+    depth = max(ks)
+    results = rag.search_many([g['query'] for g in golden], top_k=depth)
+    ranks = []
+    for g, hits in zip(golden, results):
+        ids = [qa['id'] for qa, _ in hits]
+        ranks.append(ids.index(g['expected']) + 1 if g['expected'] in ids else 0)
+
+    groups: Dict[str, Dict[str, List[int]]] = {'by_variant': defaultdict(list), 'by_category': defaultdict(list)}
+    for g, rank in zip(golden, ranks):
+        groups['by_variant'][g['variant']].append(rank)
+        groups['by_category'][g['category']].append(rank)
+    report = {'overall': _retrieval_metrics(ranks, ks)}
+    for name, grouped in groups.items():
+        report[name] = {key: _retrieval_metrics(values, ks) for key, values in sorted(grouped.items())}
+    return report
+
+
+def _percentiles(samples_ns: List[int]) -> Dict[str, float]:
+    ms = np.asarray(samples_ns) / 1e6
+    return {'n': len(ms), 'mean_ms': round(float(ms.mean()), 4),
+            'p50_ms': round(float(np.percentile(ms, 50)), 4),
+            'p95_ms': round(float(np.percentile(ms, 95)), 4),
+            'p99_ms': round(float(np.percentile(ms, 99)), 4)}
+
+
+def measure_latency(rag, agents: Dict[str, object], golden: List[dict], rounds: int) -> dict:
+    """Latencia por llamada de search y de search_knowledge_with_fallback (agente dueño de la categoría)"""
+    owner = {category: agent for agent in agents.values() for category in agent.categories}
+    default = next(iter(agents.values()))
+    search_ns, fallback_ns = [], []
+    log = io.StringIO()
+    for g in golden[:20]:  # calentamiento
+        rag.search(g['query'])
+    with contextlib.redirect_stdout(log):
+        for _ in range(rounds):
+            for g in golden:
+                start = time.perf_counter_ns()
+                rag.search(g['query'], top_k=5)
+                search_ns.append(time.perf_counter_ns() - start)
+
+                agent = owner.get(g['category'], default)
+                start = time.perf_counter_ns()
+                agent.search_knowledge_with_fallback(g['query'])
+                fallback_ns.append(time.perf_counter_ns() - start)
+    fallback = _percentiles(fallback_ns)
+    fallback['fallback_rate'] = round(log.getvalue().count('[FALLBACK]') / max(len(fallback_ns), 1), 4)
+    return {'search': _percentiles(search_ns), 'search_knowledge_with_fallback': fallback}
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def _print_report(report: dict, ks: List[int]):
+    columns = [f'recall@{k}' for k in ks] + ['mrr']
+    header = f"{'':32s} {'n':>5s} " + ' '.join(f'{c:>9s}' for c in columns)
+
+    def row(name: str, metrics: dict):
+        print(f"{name:32s} {metrics['queries']:5d} " + ' '.join(f'{metrics[c]:9.3f}' for c in columns))
+
+    retrieval = report['retrieval']
+    print(header)
+    row('global', retrieval['overall'])
+    for group in ('by_variant', 'by_category'):
+        print()
+        for name, metrics in retrieval[group].items():
+            row(name, metrics)
+    print()
+    for name, stats in report['latency'].items():
+        extra = f"  fallback {stats['fallback_rate']:.1%}" if 'fallback_rate' in stats else ""
+        print(f"{name:32s} p50 {stats['p50_ms']:7.3f} ms  p95 {stats['p95_ms']:7.3f} ms  "
+              f"p99 {stats['p99_ms']:7.3f} ms{extra}")
+
+
+def _print_comparison(report: dict, baseline: dict):
+    """Diferencias de las métricas globales y de latencia frente a una ejecución anterior"""
+    print(f"\nComparación con {baseline['meta'].get('commit') or 'ejecución anterior'}:")
+    before, after = baseline['retrieval']['overall'], report['retrieval']['overall']
+    for name in after:
+        if name != 'queries' and name in before:
+            print(f"  {name:12s} {before[name]:.3f} → {after[name]:.3f} ({after[name] - before[name]:+.3f})")
+    for call, stats in report['latency'].items():
+        if call in baseline.get('latency', {}):
+            for p in ('p50_ms', 'p95_ms', 'p99_ms'):
+                old, new = baseline['latency'][call][p], stats[p]
+                change = f"{(new - old) / old:+.1%}" if old else ""
+                print(f"  {call} {p}: {old:.3f} → {new:.3f} {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--k", type=int, nargs='+', default=[1, 5, 10], help="cortes de recall@k")
+    parser.add_argument("--rounds", type=int, default=3, help="rondas de latencia sobre el conjunto dorado")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="ruta del informe JSON")
+    parser.add_argument("--compare", help="informe JSON anterior con el que comparar")
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from agents.orchestrator import Orchestrator
+        from agents.query_cache import QueryCache
+        from agents.rag_engine import get_rag_engine
+        rag = get_rag_engine()
+        orchestrator = Orchestrator()
+    rag.cache = QueryCache(max_entries=0)  # medir el coste real de cada búsqueda
+
+    golden = build_golden_set(rag.qa_pairs, rag.PRODUCT_ALIASES, seed=args.seed)
+    ks = sorted(set(args.k))
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': _git_commit(),
+            'kb_hash': rag.kb_hash,
+            'documents': len(rag.qa_pairs),
+            'golden_queries': len(golden),
+            'seed': args.seed,
+            'fusion': rag.fusion.method,
+            'ann': rag.ann_mode,
+        },
+        'retrieval': evaluate_retrieval(rag, golden, ks),
+        'latency': measure_latency(rag, orchestrator.agents, golden, args.rounds),
+    }
+
+    _print_report(report, ks)
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            _print_comparison(report, json.load(f))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"\nInforme guardado en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Benchmark + comprobación: RAGEngine.search_many vs search() query a query.
+
+Verifica que el lote devuelve exactamente los mismos resultados (documentos y
+scores) que search() para todas las preguntas de la base, con y sin filtro de
+categorías, y mide el tiempo por query de ambos caminos (caché desactivada).
+
+Uso:
+    python -m benchmarks.bench_search_many [--rounds N]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+CATEGORY_SETS = [None, ['productos_biopro', 'objeciones', 'zonas_tecnicas']]
+
+
+def _check(rag, queries) -> int:
+    """Número de queries cuyo resultado en lote difiere de search()"""
+    mismatches = 0
+    for categories in CATEGORY_SETS:
+        for top_k in (1, 5, 20):
+            batch = rag.search_many(queries, top_k=top_k, categories=categories)
+            for query, got in zip(queries, batch):
+                expected = rag.search(query, top_k=top_k, categories=categories)
+                if [(qa['id'], score) for qa, score in got] != [(qa['id'], score) for qa, score in expected]:
+                    mismatches += 1
+                    print(f"  DIFERENCIA: {query!r} (top_k={top_k}, categorías={categories})")
+    return mismatches
+
+
+def _measure(fn, rounds: int, n_queries: int) -> float:
+    """Tiempo medio por query en microsegundos"""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn()
+    return (time.perf_counter() - start) / (rounds * n_queries) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        from agents.query_cache import QueryCache
+        from agents.rag_engine import get_rag_engine
+        rag = get_rag_engine()
+    rag.cache = QueryCache(max_entries=0)  # medir y comparar sin caché
+
+    queries = [qa['pregunta'] for qa in rag.qa_pairs] + ["xyz", "", "bio pro concentración"]
+    analyzed = [rag.analyze(q) for q in queries]
+
+    mismatches = _check(rag, analyzed)
+    single = _measure(lambda: [rag.search(q, top_k=5) for q in analyzed], args.rounds, len(queries))
+    batch = _measure(lambda: rag.search_many(analyzed, top_k=5), args.rounds, len(queries))
+
+    print(f"Queries: {len(queries)} × {args.rounds} rondas")
+    print(f"  search() una a una:  {single:8.1f} µs/query")
+    print(f"  search_many():       {batch:8.1f} µs/query")
+    print(f"  resultados idénticos: {'sí' if mismatches == 0 else f'NO ({mismatches} diferencias)'}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
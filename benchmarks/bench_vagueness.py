@@ -0,0 +1,191 @@
+"""
+Comprobación de regresión de la detección de mensajes vagos (is_greeting_or_vague).
+
+Compara la detección actual (léxico de dominio derivado de la base, frases
+semilla de las reglas del Orchestrator y léxico de follow-ups) con la lista de
+regex escrita a mano que había antes. Todo mensaje que las regex trataban como
+consulta real (no vago) debe seguir sin ser vago; los saludos y la charla
+fuera del dominio ("qué tiempo hace hoy", "me gusta el fútbol") deben seguir
+siendo vagos. Mensajes: golden set, mensajes de bench_query_analysis, un
+ejemplo por cada patrón de la lista antigua (los prefijos se completan con una
+palabra de la base), sus plurales, y casos concretos. Sale con código 1 si hay
+regresiones. Informa también de la latencia por mensaje.
+
+Uso:
+    python -m benchmarks.bench_vagueness
+"""
+import argparse
+import contextlib
+import io
+import os
+import re
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Listas de is_greeting_or_vague antes de derivar el léxico de la base (referencia)
+BASELINE_FOLLOWUP_PATTERNS = [
+    r'cuentame', r'cuenteme', r'dime\s+mas', r'dame\s+mas', r'amplia',
+    r'profundiza', r'explica', r'explicame', r'detalla', r'detallame',
+    r'elabora', r'desarrolla', r'resume', r'resumeme', r'resumi',
+    r'continua', r'sigue', r'prosigue', r'mas\s+informacion',
+    r'mas\s+detalles', r'mas\s+sobre', r'que\s+mas', r'algo\s+mas',
+    r'otra\s+cosa', r'otra\s+pregunta', r'y\s+sobre', r'tambien',
+    r'ademas', r'aparte', r'igualmente', r'por\s+otro\s+lado',
+    r'en\s+cuanto\s+a', r'respecto\s+a', r'sobre\s+eso',
+    r'y\s+eso', r'por\s+que', r'como\s+asi', r'a\s+que\s+te\s+refieres',
+    r'no\s+entiendo', r'no\s+entendi', r'repite', r'repetir',
+    r'otra\s+vez', r'de\s+nuevo',
+]
+BASELINE_PHARMA_PATTERNS = [
+    # Productos y sustancias Novacutan
+    r'novacutan', r'biopro', r'bio\s*pro', r'fbio', r'f\s*bio',
+    r'dvs', r'3dvs', r'biomodulador', r'relleno', r'filler',
+    r'acido hialuronico', r'hialuronico', r'\bah\b', r'reticulante',
+    r'divinilsulfona', r'microesfera', r'bdde',
+    # Médico / clínico
+    r'medico', r'doctor', r'paciente', r'prescri', r'dosis',
+    r'indicaci', r'tratamiento', r'clinico', r'sesion',
+    r'dermato', r'cirujano', r'plastico', r'estetico', r'estetica',
+    # Técnicas y protocolos
+    r'v.?lift', r'd.?lift', r'lifting', r'canula', r'aguja',
+    r'protocolo', r'tecnica', r'inyecci', r'bolus', r'fanning',
+    r'retrotrazante', r'subdermic', r'supraperiostic',
+    # Zonas anatómicas
+    r'facial', r'ovalo', r'pomulo', r'mandibul', r'menton',
+    r'nasogeniano', r'surco', r'labio', r'ojera', r'lagrimal',
+    r'temporal', r'periorbital', r'peribucal', r'cuello',
+    # Condiciones estéticas
+    r'flacidez', r'arruga', r'volumen', r'rejuvenecimiento',
+    r'envejecimiento', r'firmeza', r'colageno', r'elastina',
+    r'edema', r'hinchaz', r'hematoma',
+    # Objeciones
+    r'\bcaro\b', r'costoso', r'precio', r'barato', r'coste',
+    r'no funciona', r'no sirve', r'no conoce',
+    r'efecto.? secundario', r'contraindicac',
+    r'otra marca', r'competencia', r'objecion',
+    r'profhilo', r'juvederm',
+    # Ventas y argumentos
+    r'argumento', r'vender', r'\bventa\b', r'presentar', r'visita',
+    r'represent', r'estrategi', r'perfil', r'diferenci',
+    r'ventaja', r'evidencia', r'estudio', r'pitch',
+    # Marca y certificaciones
+    r'novacutan', r'fijie', r'marcado ce', r'certificac',
+    r'dispositivo medico', r'clase iii',
+    # Producto genérico
+    r'producto', r'composici', r'concentraci', r'cohesividad',
+    r'calidad', r'pureza', r'purificacion',
+    # Seguridad
+    r'embaraz', r'anticoagulant', r'herpes', r'alergia',
+    r'hialuronidasa', r'complicaci', r'vascular', r'necrosis',
+    # Acciones del dominio
+    r'recomiend', r'recomendar', r'comparar', r'comparativ',
+    r'que es\b', r'para que sirve', r'como funciona', r'como respondo',
+    r'como presento', r'como vendo', r'como aplico',
+]
+
+# Consultas reales que no deben tomarse por saludos
+DOMAIN_MESSAGES = [
+    "no funciona", "efectos secundarios", "¿tiene efectos secundarios?", "hablame del colágeno",
+    "que opinas de la elastina", "qué calidad tiene", "clase III?", "el doctor dice que no le convence",
+    "los precios son altos", "¿y las contraindicaciones?", "ah", "dosis de AH",
+]
+# Saludos y mensajes sin consulta: deben seguir siendo vagos
+GREETINGS = [
+    "hola", "hola buenas", "buenos días", "buenas tardes", "buenas noches", "gracias", "muchas gracias",
+    "vale", "ok", "perfecto", "¿quién eres?", "¿qué puedes hacer?", "ayúdame", "necesito ayuda",
+    "qué tal", "¿qué tal estás?", "hola, ¿cómo estás?", "adiós", "hasta luego", "genial, gracias", "no sé",
+    "test", "¿me oyes?",
+]
+# Charla fuera del dominio: también vaga (respuesta conversacional, sin RAG ni LLM)
+OFF_TOPIC = [
+    "qué tiempo hace hoy", "¿va a llover mañana?", "quién ganó el partido", "me gusta el fútbol",
+    "mi perro está enfermo", "cuál es la capital de francia", "¿te gustan los gatos?", "¿qué hora es?",
+    "¿dónde puedo comer bien por aquí?", "¿qué planes tienes para el finde?", "tengo hambre",
+    "¿cuántos años tienes?", "estoy cansado", "hace mucho calor", "¿de qué equipo eres?",
+    "qué música te gusta", "¿me ayudas con mis deberes de matemáticas?", "me voy de vacaciones a la playa",
+    "el tráfico está fatal", "¿sabes cocinar paella?",
+]
+
+
+def baseline_is_vague(normalized: str) -> bool:
+    """is_greeting_or_vague con las listas de regex de antes"""
+    t = normalized.strip()
+    if any(re.search(p, t) for p in BASELINE_FOLLOWUP_PATTERNS):
+        return False
+    return not any(re.search(p, t) for p in BASELINE_PHARMA_PATTERNS)
+
+
+def _pattern_messages(rag) -> list:
+    """
+    Un mensaje por patrón antiguo (y su plural si es una palabra): los prefijos (p. ej. 'prescri') se
+    completan con la palabra más frecuente de la base o de las frases semilla.
+    """
+    from agents.pattern_matcher import regex_literal
+    from agents.rag_engine import DOMAIN_SEED_PHRASES
+    texts = [qa['pregunta'] + ' ' + qa['respuesta'] for qa in rag.qa_pairs] + DOMAIN_SEED_PHRASES
+    words = Counter(w for text in texts for w in re.findall(r'\w+', rag._normalize(text)))
+    messages = []
+    for pattern in BASELINE_PHARMA_PATTERNS:
+        literal = regex_literal(pattern)
+        *head, last = literal.split()
+        if last not in words:
+            completions = [w for w in words if w.startswith(last)]
+            if completions:
+                last = max(completions, key=words.__getitem__)
+        message = ' '.join(head + [last])
+        messages.append(message)
+        if ' ' not in message and message[-1] != 's' and not re.search(r'[aei]r$', message):
+            messages.append(message + ('s' if message[-1] in 'aeiou' else 'es'))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.parse_args()
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        import main as app_main
+        from agents.orchestrator import Orchestrator
+        from agents.rag_engine import get_rag_engine
+        from benchmarks.bench_query_analysis import MESSAGES
+        from benchmarks.bench_retrieval import build_golden_set
+        app_main.orchestrator = Orchestrator()
+        rag = get_rag_engine()
+
+    messages = [g['query'] for g in build_golden_set(rag.qa_pairs, rag.PRODUCT_ALIASES)]
+    messages += MESSAGES + DOMAIN_MESSAGES + _pattern_messages(rag)
+    messages = list(dict.fromkeys(messages))
+    analyzed = [rag.analyze(m) for m in messages]
+
+    regressions = [q.raw for q in analyzed if not baseline_is_vague(q.normalized) and app_main.is_greeting_or_vague(q)]
+    newly_domain = sum(1 for q in analyzed if baseline_is_vague(q.normalized) and not app_main.is_greeting_or_vague(q))
+    greetings_lost = [m for m in GREETINGS if not app_main.is_greeting_or_vague(rag.analyze(m))]
+    off_topic_lost = [m for m in OFF_TOPIC if not app_main.is_greeting_or_vague(rag.analyze(m))]
+
+    print(f"Léxico de dominio: {len(rag.domain_terms)} términos; {len(messages)} mensajes de consulta, "
+          f"{len(GREETINGS)} saludos, {len(OFF_TOPIC)} mensajes fuera del dominio")
+    print(f"  no vagos antes y vagos ahora (regresiones): {len(regressions)}")
+    for message in regressions:
+        print(f"    {message!r}")
+    print(f"  vagos antes y consulta ahora:               {newly_domain}")
+    print(f"  saludos que dejan de ser vagos:             {len(greetings_lost)} {greetings_lost or ''}")
+    print(f"  charla fuera del dominio no vaga:           {len(off_topic_lost)} de {len(OFF_TOPIC)} "
+          f"{off_topic_lost or ''}")
+
+    for name, check in (("antes (regex)", lambda q: baseline_is_vague(q.normalized)),
+                        ("ahora (léxico)", app_main.is_greeting_or_vague)):
+        start = time.perf_counter()
+        for _ in range(5):
+            for query in analyzed:
+                check(query)
+        elapsed = (time.perf_counter() - start) / (5 * len(analyzed)) * 1e6
+        print(f"  latencia {name:15s} {elapsed:6.1f} µs/mensaje")
+
+    sys.exit(1 if regressions or greetings_lost or off_topic_lost else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -7,11 +7,11 @@ import os
 import re
 import json
 import asyncio
-from typing import Optional
+from typing import Optional, Tuple
 from contextlib import asynccontextmanager
 
 import httpx
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, UploadFile, File, HTTPException, Header
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import FileResponse, StreamingResponse
 from pydantic import BaseModel
@@ -21,6 +21,11 @@ from groq import Groq
 
 # Importar sistema de agentes
 from agents.orchestrator import Orchestrator
+from agents.context_packer import ContextPacker, PackedContext
+from agents.conversation import ConversationHistory
+from agents.prompts import max_tokens_for
+from agents.rag_engine import AnalyzedQuery, get_rag_engine, reload_rag_engine, run_retrieval
+from agents.retrieval_pool import get_retrieval_pool, start_retrieval_pool, stop_retrieval_pool
 
 load_dotenv()
 
@@ -93,9 +98,39 @@ elevenlabs_voice_id = os.getenv("ELEVENLABS_VOICE_ID", "NWqMOQLlMBaUbjKYdhbW")
 if not elevenlabs_api_key:
     print("⚠️  ELEVENLABS_API_KEY no configurada - TTS deshabilitado")
 
+# Recarga en caliente de knowledge_base.json
+KB_RELOAD_TOKEN = os.getenv("KB_RELOAD_TOKEN")                 # Requerido para POST /api/admin/reload-kb
+KB_WATCH_INTERVAL = float(os.getenv("KB_WATCH_INTERVAL", "0"))  # Segundos entre comprobaciones (0 = sin watcher)
+
 # Orquestador de agentes
 orchestrator: Optional[Orchestrator] = None
 
+# Presupuesto de tokens del contexto dinámico (hechos + enriquecimiento + historial)
+context_packer = ContextPacker()
+
+
+async def _reload_knowledge_base() -> dict:
+    """Recarga incremental fuera del event loop (las sesiones abiertas no se interrumpen)"""
+    return await asyncio.to_thread(reload_rag_engine)
+
+
+async def _watch_knowledge_base(interval: float):
+    """Recarga la base cuando cambia la fecha de modificación del fichero"""
+    path = get_rag_engine().knowledge_base_path
+    last_mtime = os.path.getmtime(path)
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            mtime = os.path.getmtime(path)
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+            await _reload_knowledge_base()
+        except Exception as e:
+            # JSON a medio escribir o inválido: se mantiene la versión publicada
+            print(f"[RAG] Recarga automática fallida: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Inicializar el orquestador al arrancar"""
@@ -105,7 +140,16 @@ async def lifespan(app: FastAPI):
     # Acceder al RAG a través de cualquier agente (comparten la misma instancia singleton)
     rag = orchestrator.agents['productos'].rag
     print(f"Sistema listo. Base de conocimiento: {len(rag.qa_pairs)} documentos")
+    # Pool de procesos de búsqueda (RAG_PROCESS_WORKERS > 0): abren el artefacto ya guardado
+    await start_retrieval_pool(rag)
+    watcher = None
+    if KB_WATCH_INTERVAL > 0:
+        watcher = asyncio.create_task(_watch_knowledge_base(KB_WATCH_INTERVAL))
+        print(f"Vigilando cambios en la base de conocimiento cada {KB_WATCH_INTERVAL:g}s")
     yield
+    if watcher:
+        watcher.cancel()
+    stop_retrieval_pool()
     print("Cerrando aplicación...")
 
 app = FastAPI(
@@ -131,10 +175,28 @@ async def health_check():
         "status": "ok",
         "version": "3.0.0",
         "agents": ["productos", "objeciones", "argumentos"],
-        "knowledge_base_size": len(orchestrator.agents['productos'].rag.qa_pairs) if orchestrator else 0
+        "knowledge_base_size": len(orchestrator.agents['productos'].rag.qa_pairs) if orchestrator else 0,
+        "knowledge_base_version": orchestrator.rag.version if orchestrator else 0,
+        "retrieval_cache": orchestrator.rag.cache.stats() if orchestrator else {},
+        "retrieval_memory": orchestrator.rag.memory_report() if orchestrator else {},
+        "retrieval_pool": get_retrieval_pool().stats() if get_retrieval_pool() else {}
     }
 
 
+@app.post("/api/admin/reload-kb")
+async def reload_knowledge_base(x_reload_token: Optional[str] = Header(None)):
+    """Aplica los cambios de knowledge_base.json sin reiniciar (requiere KB_RELOAD_TOKEN)"""
+    if not KB_RELOAD_TOKEN:
+        raise HTTPException(status_code=503, detail="Recarga deshabilitada: KB_RELOAD_TOKEN no configurado")
+    if x_reload_token != KB_RELOAD_TOKEN:
+        raise HTTPException(status_code=403, detail="Token de recarga inválido")
+    try:
+        stats = await _reload_knowledge_base()
+    except (ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=f"Base de conocimiento inválida: {e}")
+    return {"status": "ok", **stats}
+
+
 @app.get("/api/test-infographic")
 async def test_infographic():
     """Endpoint de diagnóstico para probar la generación de infografías"""
@@ -475,80 +537,88 @@ def strip_wake_word(message: str) -> str:
     return t
 
 
-def is_greeting_or_vague(message: str) -> bool:
+# Follow-ups conversacionales: NUNCA son greetings aunque no tengan términos del dominio
+FOLLOWUP_WORDS = frozenset({
+    'cuentame', 'cuenteme', 'cuentanos', 'amplia', 'ampliame', 'amplialo', 'profundiza', 'explica',
+    'explicame', 'explicalo', 'explicamelo', 'detalla', 'detallame', 'detallalo', 'elabora', 'desarrolla',
+    'resume', 'resumeme', 'resumelo', 'resumir', 'resumido', 'resumen', 'cuentamelo', 'continua', 'sigue', 'prosigue', 'tambien', 'ademas', 'aparte',
+    'igualmente', 'repite', 'repitelo', 'repetir',
+})
+FOLLOWUP_PHRASES = frozenset({
+    ('dime', 'mas'), ('dame', 'mas'), ('mas', 'informacion'), ('mas', 'detalles'), ('mas', 'sobre'),
+    ('que', 'mas'), ('algo', 'mas'), ('otra', 'cosa'), ('otra', 'pregunta'), ('y', 'sobre'),
+    ('por', 'otro', 'lado'), ('en', 'cuanto', 'a'), ('respecto', 'a'), ('sobre', 'eso'), ('y', 'eso'),
+    ('por', 'que'), ('como', 'asi'), ('a', 'que', 'te', 'refieres'), ('no', 'entiendo'),
+    ('no', 'entendi'), ('otra', 'vez'), ('de', 'nuevo'),
+    # Consultas explícitas aunque el tema no esté en la base
+    ('que', 'es'), ('para', 'que', 'sirve'), ('como', 'funciona'), ('como', 'respondo'),
+    ('como', 'presento'), ('como', 'vendo'), ('como', 'aplico'),
+})
+FOLLOWUP_PHRASE_LENGTHS = sorted({len(phrase) for phrase in FOLLOWUP_PHRASES})
+
+
+def is_greeting_or_vague(query: AnalyzedQuery) -> bool:
     """Detecta si un mensaje NO contiene consulta pharma real.
-    Usa whitelist: si no hay ninguna palabra clave del dominio, es vago.
-    Excluye follow-ups conversacionales que indican continuación de charla."""
-    import unicodedata
-    t = unicodedata.normalize('NFD', message.lower().strip())
-    t = re.sub(r'[\u0300-\u036f]', '', t)  # quitar acentos
-
-    # Follow-ups conversacionales — NUNCA son greetings aunque no tengan keywords pharma
-    followup_patterns = [
-        r'cuentame', r'cuenteme', r'dime\s+mas', r'dame\s+mas', r'amplia',
-        r'profundiza', r'explica', r'explicame', r'detalla', r'detallame',
-        r'elabora', r'desarrolla', r'resume', r'resumeme', r'resumi',
-        r'continua', r'sigue', r'prosigue', r'mas\s+informacion',
-        r'mas\s+detalles', r'mas\s+sobre', r'que\s+mas', r'algo\s+mas',
-        r'otra\s+cosa', r'otra\s+pregunta', r'y\s+sobre', r'tambien',
-        r'ademas', r'aparte', r'igualmente', r'por\s+otro\s+lado',
-        r'en\s+cuanto\s+a', r'respecto\s+a', r'sobre\s+eso',
-        r'y\s+eso', r'por\s+que', r'como\s+asi', r'a\s+que\s+te\s+refieres',
-        r'no\s+entiendo', r'no\s+entendi', r'repite', r'repetir',
-        r'otra\s+vez', r'de\s+nuevo',
-    ]
-    if any(re.search(p, t) for p in followup_patterns):
+    Usa whitelist: si ningún término está en el léxico de dominio (derivado de la
+    base de conocimiento, los sinónimos y las reglas de intención), es vago. Excluye follow-ups
+    conversacionales que indican continuación de charla.
+    Recibe el mensaje ya analizado (minúsculas, sin acentos, typos corregidos)."""
+    words = re.sub(r'[^\w\s]', ' ', query.normalized).split()
+
+    # Follow-ups conversacionales (palabras sueltas o frases cortas)
+    if not FOLLOWUP_WORDS.isdisjoint(words):
         return False
+    for n in FOLLOWUP_PHRASE_LENGTHS:
+        if any(tuple(words[i:i + n]) in FOLLOWUP_PHRASES for i in range(len(words) - n + 1)):
+            return False
 
-    # Palabras clave que indican consulta real sobre el dominio estética/ventas
-    pharma_patterns = [
-        # Productos y sustancias Novacutan
-        r'novacutan', r'biopro', r'bio\s*pro', r'fbio', r'f\s*bio',
-        r'dvs', r'3dvs', r'biomodulador', r'relleno', r'filler',
-        r'acido hialuronico', r'hialuronico', r'\bah\b', r'reticulante',
-        r'divinilsulfona', r'microesfera', r'bdde',
-        # Médico / clínico
-        r'medico', r'doctor', r'paciente', r'prescri', r'dosis',
-        r'indicaci', r'tratamiento', r'clinico', r'sesion',
-        r'dermato', r'cirujano', r'plastico', r'estetico', r'estetica',
-        # Técnicas y protocolos
-        r'v.?lift', r'd.?lift', r'lifting', r'canula', r'aguja',
-        r'protocolo', r'tecnica', r'inyecci', r'bolus', r'fanning',
-        r'retrotrazante', r'subdermic', r'supraperiostic',
-        # Zonas anatómicas
-        r'facial', r'ovalo', r'pomulo', r'mandibul', r'menton',
-        r'nasogeniano', r'surco', r'labio', r'ojera', r'lagrimal',
-        r'temporal', r'periorbital', r'peribucal', r'cuello',
-        # Condiciones estéticas
-        r'flacidez', r'arruga', r'volumen', r'rejuvenecimiento',
-        r'envejecimiento', r'firmeza', r'colageno', r'elastina',
-        r'edema', r'hinchaz', r'hematoma',
-        # Objeciones
-        r'\bcaro\b', r'costoso', r'precio', r'barato', r'coste',
-        r'no funciona', r'no sirve', r'no conoce',
-        r'efecto.? secundario', r'contraindicac',
-        r'otra marca', r'competencia', r'objecion',
-        r'profhilo', r'juvederm',
-        # Ventas y argumentos
-        r'argumento', r'vender', r'\bventa\b', r'presentar', r'visita',
-        r'represent', r'estrategi', r'perfil', r'diferenci',
-        r'ventaja', r'evidencia', r'estudio', r'pitch',
-        # Marca y certificaciones
-        r'novacutan', r'fijie', r'marcado ce', r'certificac',
-        r'dispositivo medico', r'clase iii',
-        # Producto genérico
-        r'producto', r'composici', r'concentraci', r'cohesividad',
-        r'calidad', r'pureza', r'purificacion',
-        # Seguridad
-        r'embaraz', r'anticoagulant', r'herpes', r'alergia',
-        r'hialuronidasa', r'complicaci', r'vascular', r'necrosis',
-        # Acciones del dominio
-        r'recomiend', r'recomendar', r'comparar', r'comparativ',
-        r'que es\b', r'para que sirve', r'como funciona', r'como respondo',
-        r'como presento', r'como vendo', r'como aplico',
-    ]
+    # Términos del dominio estética/ventas: se actualizan con la base (productos nuevos incluidos)
+    return not get_rag_engine().mentions_domain(query)
+
+
+def _analyze_message(message: str) -> Tuple[AnalyzedQuery, bool]:
+    """Análisis del mensaje y detección de saludo/vago (se ejecuta en el executor de búsqueda)"""
+    analyzed = orchestrator.analyze(message)
+    return analyzed, is_greeting_or_vague(analyzed)
 
-    return not any(re.search(p, t) for p in pharma_patterns)
+
+def _route_message(analyzed: AnalyzedQuery):
+    """Intención por reglas (rápido y sin API call) y agente que la atiende"""
+    rule_match = orchestrator.match_intent_rules(analyzed)
+    intent = rule_match.intent
+    print(f"[DEBUG] Intent: {intent} (patrones: {rule_match.counts}, confianza: {rule_match.confidence:.2f})")
+
+    # Obtener agente correspondiente
+    agent = orchestrator.get_agent(intent)
+    print(f"[DEBUG] Agente: {agent.name}")
+    return intent, agent
+
+
+def _build_context(agent, analyzed: AnalyzedQuery, results, history=(), response_mode: str = "full"):
+    """
+    Contexto formateado (con el enriquecimiento del agente) e historial, empaquetados
+    en el presupuesto de tokens del modo de respuesta, y cobertura RAG de los resultados.
+    Es CPU: se ejecuta en el executor de búsqueda, no en el event loop.
+
+    Returns:
+        (packed, relevant_docs, max_score, rag_coverage)
+    """
+    # Enriquecer contexto con inteligencia del agente
+    enrichment = agent.enrich_context(analyzed, results)
+    packed: PackedContext = context_packer.pack(agent, results, enrichment, history, response_mode, min_score=0.1)
+    print(f"[DEBUG] RAG: {len(results)} resultados, contexto: {len(packed.context)} chars")
+    if packed.saved_tokens:
+        print(f"[CONTEXT] ~{packed.tokens} tokens (presupuesto {context_packer.budget(response_mode)}), "
+              f"ahorrados ~{packed.saved_tokens} — hechos: {packed.facts} ({packed.facts_truncated} recortados, "
+              f"{packed.facts_dropped} descartados), historial: {packed.history_dropped} mensajes descartados, "
+              f"{packed.history_truncated} recortados")
+
+    # Evaluar cobertura RAG
+    relevant_docs = [r for r in results if r[1] >= 0.1]
+    strong_docs = [r for r in results if r[1] >= 0.35]
+    max_score = max((r[1] for r in results), default=0.0)
+    rag_coverage = "high" if (len(strong_docs) >= 2 or max_score >= 0.5 or (len(strong_docs) >= 1 and len(relevant_docs) >= 3)) else ("medium" if len(relevant_docs) >= 1 else "low")
+    return packed, relevant_docs, max_score, rag_coverage
 
 
 GREETING_RESPONSE = """Soy **Novia**, tu asistente de ventas de Novacutan. Para poder ayudarte, cuéntame qué necesitas. Por ejemplo:
@@ -560,6 +630,14 @@ GREETING_RESPONSE = """Soy **Novia**, tu asistente de ventas de Novacutan. Para
 > Puedes usar las **preguntas sugeridas** en la pantalla de inicio o escribir tu consulta directamente."""
 
 
+async def _save_exchange(history: ConversationHistory, question: str, answer: str):
+    """Guarda el intercambio en el historial y lo compacta en el executor (tarea de fondo tras 'end')"""
+    try:
+        await run_retrieval(history.add_exchange, question, answer)
+    except Exception as e:
+        print(f"[HISTORY] No se pudo guardar el intercambio: {type(e).__name__}: {e}")
+
+
 @app.websocket("/ws/chat")
 async def websocket_chat(websocket: WebSocket):
     """
@@ -567,9 +645,9 @@ async def websocket_chat(websocket: WebSocket):
     """
     await websocket.accept()
 
-    # Historial de conversación para mantener contexto
-    conversation_history = []
-    MAX_HISTORY = 10  # Mantener últimos 10 intercambios (20 mensajes)
+    # Historial de conversación para mantener contexto (los intercambios antiguos se compactan en un resumen)
+    conversation_history = ConversationHistory()
+    saving: Optional[asyncio.Task] = None   # Guardado del último intercambio (en segundo plano)
 
     try:
         while True:
@@ -588,14 +666,18 @@ async def websocket_chat(websocket: WebSocket):
             user_message = message_data.get("message", "")
             response_mode = message_data.get("response_mode", "full")  # "short" o "full"
 
+            # El historial solo se lee cuando ya tiene el intercambio anterior (compactado)
+            if saving is not None:
+                await saving
+                saving = None
+
             # Contexto previo de chat guardado — poblar historial para continuidad
             prior = message_data.get("prior_context")
             if prior and not conversation_history:
                 q = prior.get("question", "")
                 a = prior.get("answer", "")
                 if q and a:
-                    conversation_history.append({"role": "user", "content": q})
-                    conversation_history.append({"role": "assistant", "content": a})
+                    conversation_history.add_exchange(q, a)
                     print(f"[WS] Contexto previo restaurado: Q={q[:50]}... A={a[:50]}...")
                 else:
                     print(f"[WS] prior_context recibido pero q/a vacíos: q='{q[:30]}' a='{a[:30]}'")
@@ -612,7 +694,8 @@ async def websocket_chat(websocket: WebSocket):
                 continue
             user_message = cleaned
 
-            is_vague = is_greeting_or_vague(user_message)
+            # Analizar el mensaje UNA vez (en el executor); todos los consumidores reutilizan el resultado
+            analyzed, is_vague = await run_retrieval(_analyze_message, user_message)
             print(f"[WS] Mensaje recibido — historial: {len(conversation_history)} msgs — vague: {is_vague} — query: '{user_message[:60]}'")
 
             # Saludos y mensajes vagos: responder directamente sin agente ni RAG
@@ -638,29 +721,13 @@ async def websocket_chat(websocket: WebSocket):
                 continue
 
             try:
-                # Clasificar intención con reglas (rápido y sin API call)
-                intent = orchestrator.classify_intent_rules(user_message)
-                print(f"[DEBUG] Intent: {intent}")
-
-                # Obtener agente correspondiente
-                agent = orchestrator.get_agent(intent)
-                print(f"[DEBUG] Agente: {agent.name}")
-
-                # Buscar contexto relevante en RAG (con fallback si score bajo)
-                results = agent.search_knowledge_with_fallback(user_message, top_k=5)
-                context = agent.format_context(results, min_score=0.1)
-                print(f"[DEBUG] RAG: {len(results)} resultados, contexto: {len(context)} chars")
-
-                # Enriquecer contexto con inteligencia del agente
-                enrichment = agent.enrich_context(user_message, results)
-                if enrichment:
-                    context += f"\n\n═══ CONTEXTO ADICIONAL DEL AGENTE ═══\n{enrichment}"
-
-                # Evaluar cobertura RAG
-                relevant_docs = [r for r in results if r[1] >= 0.1]
-                strong_docs = [r for r in results if r[1] >= 0.35]
-                max_score = max((r[1] for r in results), default=0.0)
-                rag_coverage = "high" if (len(strong_docs) >= 2 or max_score >= 0.5 or (len(strong_docs) >= 1 and len(relevant_docs) >= 3)) else ("medium" if len(relevant_docs) >= 1 else "low")
+                intent, agent = _route_message(analyzed)
+
+                # Buscar contexto relevante en RAG (con fallback si score bajo) fuera del event loop:
+                # pool de procesos si está activo, si no el executor de búsqueda
+                results = await agent.asearch_knowledge_with_fallback(analyzed, top_k=5)
+                packed, relevant_docs, max_score, rag_coverage = await run_retrieval(
+                    _build_context, agent, analyzed, results, conversation_history.messages(), response_mode)
 
                 # Enviar info del agente + cobertura RAG al frontend
                 print(f"[DEBUG] RAG coverage: {rag_coverage}, max_score: {max_score:.2f}, docs: {len(relevant_docs)}")
@@ -673,192 +740,14 @@ async def websocket_chat(websocket: WebSocket):
                 })
                 print(f"[DEBUG] agent_info enviado al frontend")
 
-                # Instrucciones dinámicas según cobertura RAG
-                if rag_coverage == "low":
-                    rag_instruction = """⚠️ COBERTURA RAG: BAJA — Hay poca información específica para esta consulta.
-
-REGLAS:
-1. Respuesta CORTA (máximo 150 palabras). No generes un argumentario completo.
-2. NO inventes cifras, porcentajes ni datos específicos.
-3. SÍ puedes mencionar consenso médico general sin cifras exactas (ej: "El ácido hialurónico reticulado con DVS ofrece mayor estabilidad y menor edema").
-4. Si HAY algún dato relevante en el contexto RAG de arriba (aunque sea tangencial), úsalo — son datos verificados de Novacutan.
-5. Redirige al usuario hacia temas que SÍ puedes cubrir con preguntas sugeridas.
-6. NO muestres secciones vacías ni uses placeholders.
-
-FORMATO para cobertura baja:
-## [Tema consultado]
-
-[Si hay datos RAG relevantes, preséntalos de forma útil y persuasiva]
-
-[1-2 frases de consenso médico general SIN cifras inventadas si aplica]
-
-**Te puedo ayudar con:**
-- [Pregunta sugerida 1 sobre productos/protocolos de Novacutan]
-- [Pregunta sugerida 2]
-- [Pregunta sugerida 3]"""
-                elif rag_coverage == "medium":
-                    rag_instruction = """⚠️ COBERTURA RAG: PARCIAL — Los datos verificados de arriba son limitados.
-
-REGLAS OBLIGATORIAS:
-1. Usa SOLO la información de los HECHOS VERIFICADOS de arriba.
-2. NO añadas datos externos. Si necesitas mencionar algo fuera del contexto, di "según consenso médico general" SIN cifras.
-3. Si una sección de tu formato no tiene datos verificados, OMÍTELA entera. No incluyas tablas con celdas vacías ni secciones sin contenido real.
-4. Aprovecha al MÁXIMO los datos que SÍ tienes: preséntelos de forma persuasiva, clara y útil para vender.
-5. PROHIBIDO EXTRAPOLAR INDICACIONES: Si un producto aparece en los datos verificados con indicación X, NO lo recomiendes para indicación Y. Solo recomienda cada producto para las indicaciones que EXPLÍCITAMENTE aparecen en los datos verificados. Ejemplo: si un producto está indicado para "flacidez facial", NO lo recomiendes para relleno labial a menos que los datos verificados digan EXPLÍCITAMENTE que tiene esa indicación.
-6. Menciona SOLO los productos que tengan indicación EXPLÍCITA para la condición consultada en los datos verificados."""
-                else:
-                    rag_instruction = """COBERTURA RAG: ALTA — Tienes buenos datos verificados arriba.
-Responde EXCLUSIVAMENTE con los datos verificados. NO complementes con conocimiento externo.
-Si alguna sección de tu formato no tiene datos verificados, OMÍTELA — no dejes huecos ni placeholders.
-Presenta TODA la información disponible de forma persuasiva, completa y útil para que el representante venda con confianza.
-PROHIBIDO EXTRAPOLAR INDICACIONES: Recomienda cada producto SOLO para las indicaciones que aparecen EXPLÍCITAMENTE en los datos verificados. No atribuyas indicaciones nuevas a un producto existente."""
-
-                # Instrucción de longitud según modo de respuesta
-                # Si cobertura baja, el formato ya está definido en rag_instruction — no aplicar templates de agente
-                if rag_coverage == "low":
-                    length_instruction = ""  # El formato de respuesta corta ya está en rag_instruction
-                elif response_mode == "short":
-                    # Formato resumido adaptado a cada agente — preserva los elementos de diseño clave
-                    if intent == "productos":
-                        length_instruction = """MODO RESUMIDO — Usa EXACTAMENTE este formato reducido (markdown):
-
-## [Nombre del producto o tema]
-
-| Parámetro | Valor |
-|-----------|-------|
-| (los 3-4 datos más importantes: composición, volumen, reticulante, zona) |
-
-**Indicación principal**: Una frase directa con FAB.
-
-**Protocolo**: Técnica y sesiones en una línea.
-
-**Dato diferenciador**
-> Frase clave FAB que el representante puede usar literalmente con el médico. OBLIGATORIO.
-
-REGLAS DE MODO RESUMIDO:
-- Máximo 200-250 palabras totales.
-- La tabla, la indicación FAB y el dato diferenciador (blockquote) son OBLIGATORIOS.
-- NO incluyas evidencia clínica, caso clínico ni secciones adicionales.
-- El dato diferenciador SIEMPRE debe ser un blockquote (>) con una frase memorable."""
-                    elif intent == "objeciones":
-                        length_instruction = """MODO RESUMIDO — Usa EXACTAMENTE este formato reducido (markdown):
-
-## Objeción: "[Resumen breve]"
-
-### Reconocimiento
-> Frase empática Feel-Felt-Found condensada en 2 líneas máximo.
-
-### Datos clave
-| Dato | Valor |
-|------|-------|
-| (2-3 datos que desmonta la objeción) |
-
-### Reencuadre
-Una frase de Boomerang o aversión a la pérdida. Máximo 2 líneas.
-
-### Guion sugerido
-> "Doctor/a, [frase lista para usar literalmente]." OBLIGATORIO.
-
-REGLAS DE MODO RESUMIDO:
-- Máximo 200-250 palabras totales.
-- La tabla, el reconocimiento y el guion sugerido (blockquote) son OBLIGATORIOS.
-- No incluyas secciones adicionales."""
-                    else:  # argumentos
-                        length_instruction = """MODO RESUMIDO — Usa EXACTAMENTE este formato reducido (markdown):
-
-## Argumentario: [Especialidad]
-
-### Insight clave
-> Dato sorprendente en 1-2 líneas. OBLIGATORIO.
-
-### Producto recomendado
-| Producto | Dosis | Indicación |
-|----------|-------|------------|
-| (1 producto principal) |
-
-### Argumentos clave
-1. **[Argumento 1]**: Dato concreto en 1 línea.
-2. **[Argumento 2]**: Dato concreto en 1 línea.
-
-### Guion de apertura
-> "Doctor/a, [frase de apertura lista para usar]." OBLIGATORIO.
-
-REGLAS DE MODO RESUMIDO:
-- Máximo 200-250 palabras totales.
-- El insight (blockquote), la tabla y el guion de apertura (blockquote) son OBLIGATORIOS.
-- NO incluyas SPIN, perfil de paciente, caso clínico ni plan de prescripción."""
-                else:
-                    length_instruction = "MODO EXTENDIDO: Responde con el formato completo y detallado según tu estructura habitual."
-
-                # Preparar prompt completo con anti-fabricación AL INICIO + contexto RAG
-                anti_fabrication = (
-                    "══════════════════════════════════════════\n"
-                    "REGLA #1 — LA MÁS IMPORTANTE DE TODAS:\n"
-                    "══════════════════════════════════════════\n"
-                    "USA SOLO datos de la sección 'DATOS VERIFICADOS DE NOVACUTAN' de abajo.\n"
-                    "- NO inventes cifras (mg, %, ratios) ni estudios que no estén en los datos verificados.\n"
-                    "- NO menciones productos que no aparezcan en los datos verificados.\n"
-                    "- Si una sección de tu formato NO tiene datos verificados disponibles → OMITE esa sección ENTERA. No la incluyas.\n"
-                    "- NUNCA pongas '—', 'No disponible', 'Consultar ficha técnica' ni celdas vacías. Si no hay dato, no pongas la fila/sección.\n"
-                    "- SÍ usa técnicas de persuasión (FAB, SPIN, Feel-Felt-Found, storytelling) con los datos que SÍ tienes.\n"
-                    "- Presenta los datos verificados de forma COMPLETA, ÚTIL y PERSUASIVA para que el representante pueda vender con confianza.\n"
-                    "══════════════════════════════════════════\n\n"
-                )
-
-                full_prompt = f"""{anti_fabrication}{agent.system_prompt}
-
-{context}
-
----
-{rag_instruction}
-
-{length_instruction}"""
-
-                # Tokens según modo (low coverage siempre corto)
-                if rag_coverage == "low":
-                    max_tokens = 400
-                elif response_mode == "short":
-                    max_tokens = 500
-                else:
-                    max_tokens = 1000
-
-                # Construir mensajes con historial de conversación
-                messages = [{"role": "system", "content": full_prompt}]
-
-                # Añadir historial previo (para contexto de conversación)
-                for hist_msg in conversation_history:
-                    messages.append(hist_msg)
-
-                # Instrucción de continuidad conversacional (inyectada justo antes del user msg)
-                if conversation_history:
-                    # Extraer la última pregunta del historial para dar contexto explícito
-                    last_user_q = ""
-                    for h in reversed(conversation_history):
-                        if h["role"] == "user":
-                            last_user_q = h["content"][:120]
-                            break
-                    messages.append({"role": "system", "content": (
-                        "CONTINUIDAD CONVERSACIONAL OBLIGATORIA:\n"
-                        f"El usuario venía hablando sobre: \"{last_user_q}\"\n"
-                        "Su nueva pregunta es un FOLLOW-UP de esa conversación.\n\n"
-                        "REGLAS:\n"
-                        "1. Tu respuesta DEBE conectar temáticamente con lo anterior. "
-                        "Si antes hablaban de precio y ahora preguntan sobre duración, "
-                        "conecta ambos temas (ej: el coste-beneficio a largo plazo).\n"
-                        "2. NO uses frases genéricas como 'En relación con lo anterior...' o "
-                        "'Continuando con el tema...'. En su lugar, conecta de forma ESPECÍFICA "
-                        "mencionando el tema concreto (ej: 'Precisamente, uno de los argumentos "
-                        "más potentes frente a la objeción del precio es el tiempo de respuesta...').\n"
-                        "3. NO repitas información ya dada. Amplía, profundiza o conecta con ángulos nuevos.\n"
-                        "4. Mantén tono conversacional natural, como un colega que te está explicando algo "
-                        "y tú le haces otra pregunta — no como un chatbot que empieza de cero cada vez."
-                    )})
-
-                # Añadir mensaje actual del usuario
-                messages.append({"role": "user", "content": user_message})
+                # Prompt: prefijo estático pre-renderizado (cacheable por el proveedor) + historial
+                # + hechos verificados y continuidad + mensaje del usuario (empaquetados en el presupuesto)
+                max_tokens = max_tokens_for(rag_coverage, response_mode)
+                messages = orchestrator.prompts.build_messages(
+                    intent, rag_coverage, response_mode, packed.context, packed.history, user_message)
 
                 print(f"[DEBUG] Llamando a Groq — modelo: {LLM_MODEL}, max_tokens: {max_tokens}, msgs: {len(messages)}")
-                print(f"[DEBUG] System prompt: {len(messages[0]['content'])} chars")
+                print(f"[DEBUG] System prompt: {len(messages[0]['content'])} chars estáticos + {len(packed.context)} de contexto")
 
                 # Stream de respuesta con Kimi K2 (Groq) — async para no bloquear event loop
                 stream = await llm_client.chat.completions.create(
@@ -883,14 +772,6 @@ REGLAS DE MODO RESUMIDO:
                         })
                 print(f"[DEBUG] Stream terminado — {token_count} tokens enviados")
 
-                # Guardar en historial
-                conversation_history.append({"role": "user", "content": user_message})
-                conversation_history.append({"role": "assistant", "content": full_response})
-
-                # Limitar historial para no exceder contexto
-                if len(conversation_history) > MAX_HISTORY * 2:
-                    conversation_history = conversation_history[-(MAX_HISTORY * 2):]
-
                 # Señal de fin de mensaje
                 print(f"[DEBUG] Enviando 'end' al frontend...")
                 await websocket.send_json({
@@ -899,6 +780,10 @@ REGLAS DE MODO RESUMIDO:
                 })
                 print(f"[DEBUG] 'end' enviado OK — respuesta completa")
 
+                # Guardar en historial en segundo plano: la compactación (CPU, en el executor) no
+                # retrasa la respuesta ni la recepción del siguiente mensaje
+                saving = asyncio.create_task(_save_exchange(conversation_history, user_message, full_response))
+
             except Exception as e:
                 print(f"[ERROR] {type(e).__name__}: {e}")
                 import traceback
@@ -909,6 +794,8 @@ REGLAS DE MODO RESUMIDO:
                 })
 
     except WebSocketDisconnect:
+        if saving is not None:
+            await saving
         print(f"[WS] Cliente desconectado — historial tenía {len(conversation_history)} mensajes")
     except Exception as e:
         print(f"[WS] Error WebSocket: {e}")